@@ -0,0 +1,633 @@
+#!/usr/bin/env python
+
+# Micro benchmarks for the Python parsers and writers, at several fixture sizes.
+#   python benchmark/micro.py run --output results.json
+#   python benchmark/micro.py compare baseline.json results.json
+#   python benchmark/micro.py dedupe
+#   python benchmark/micro.py logger
+
+import os
+import io
+import gc
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import datetime
+import tempfile
+import threading
+import contextlib
+import statistics
+import subprocess
+import tracemalloc
+import synthetic
+import stub_tool
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+docker_lib = os.path.join(repo, "docker_lib")
+pip_dir = os.path.join(repo, "pip")
+
+default_scales = (10, 1000, 10000)
+
+# Contigs per sample table for the finisher benchmark
+contigs_per_table = 100
+
+# Peak memory below this is noise and never counted as a regression
+memory_floor_kb = 64
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+## Fixtures, written once per scale and reused by every benchmark
+
+def contig_names(count):
+    return [f"NODE_{i + 1}_length_{2000 + i % 4000}_cov_{10 + i % 300}.5" for i in range(count)]
+
+def write_contigs(path, count, seed=1):
+    rng = random.Random(seed)
+    names = contig_names(count)
+    records = [(name, synthetic.random_genome(rng, rng.randint(1000, 6000))) for name in names]
+    synthetic.write_fasta(path, records, width=80)
+    return names
+
+def write_covstats(path, names, depth=None):
+    # depth(i) sets Avg_fold, the rest of the columns follow bbmap covstats
+    with open(path, 'w') as file:
+        file.write("#ID\tAvg_fold\tLength\tRef_GC\tCovered_percent\tCovered_bases\tPlus_reads\tMinus_reads\tRead_GC\tMedian_fold\tStd_Dev\n")
+        for i, name in enumerate(names):
+            fold = depth(i) if depth else 10 + i % 300
+            file.write(f"{name}\t{fold:.4f}\t{2000 + i % 4000}\t0.3500\t99.9000\t{1990 + i % 4000}\t{i * 7}\t{i * 7}\t0.3500\t{int(fold)}\t12.50\n")
+
+def write_scafstats(path, names):
+    with open(path, 'w') as file:
+        file.write("#name\t%unambiguousReads\tunambiguousMB\t%ambiguousReads\tambiguousMB\tunambiguousReads\tambiguousReads\tassignedReads\tassignedBases\n")
+        for i, name in enumerate(names):
+            file.write(f"{name}\t{100 / len(names):.5f}\t0.10000\t0.00000\t0.00000\t{i * 14}\t0\t{i * 14}\t{i * 2100}\n")
+
+def write_checkv_fixture(outdir, names):
+    # One in twenty contigs complete and one in ten high-quality, like a mixed assembly
+    grades = []
+    for i, name in enumerate(names):
+        if i % 20 == 0:
+            grade = "Complete"
+        elif i % 10 == 0:
+            grade = "High-quality"
+        else:
+            grade = ("Medium-quality", "Low-quality", "Not-determined")[i % 3]
+        grades.append((name, 2000 + i % 4000, grade))
+    stub_tool.write_checkv(outdir, grades)
+
+def write_basecov(path, names, phage_length=50000, depth=150):
+    # First contig is the phage between 100 and 400 X, the others are short and shallow
+    with open(path, 'w') as file:
+        file.write("#RefName\tPos\tCoverage\n")
+        file.writelines(f"{names[0]}\t{pos}\t{depth + pos % 37}\n" for pos in range(phage_length))
+        for name in names[1:]:
+            file.writelines(f"{name}\t{pos}\t{pos % 5}\n" for pos in range(100))
+
+def write_output_dir(output, count, seed=1):
+    # Finished output directory with count genomes and a manifest
+    from Phanatic import manifest
+    rng = random.Random(seed)
+    genomes = os.path.join(output, manifest.genome_dir)
+    os.makedirs(genomes, exist_ok=True)
+    for name in manifest.required_files + manifest.optional_files:
+        with open(os.path.join(output, name), 'w') as file:
+            file.write(f"{name}\n" * 100)
+    for i in range(count):
+        synthetic.write_fasta(os.path.join(genomes, f"phage_{i:05d}.fasta"),
+                              [(f"phage_{i:05d}", synthetic.random_genome(rng, 4000))])
+    built, rehashed = manifest.build(output)
+    manifest.write(built, os.path.join(output, '.hash_keys'))
+
+def fixture(workdir, scale, kind):
+    # Path of one fixture, written the first time it is asked for
+    directory = os.path.join(workdir, "fixtures", str(scale))
+    path = os.path.join(directory, kind)
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    names = contig_names(scale)
+    tmp = f"{path}.tmp"
+    if kind == "contigs.fasta":
+        write_contigs(tmp, scale)
+    elif kind == "covstats.tsv":
+        write_covstats(tmp, names)
+    elif kind == "scafstats.tsv":
+        write_scafstats(tmp, names)
+    elif kind == "checkv":
+        write_checkv_fixture(tmp, names)
+    elif kind == "genomes":
+        rng = random.Random(scale)
+        os.makedirs(tmp)
+        for i in range(scale):
+            synthetic.write_fasta(os.path.join(tmp, f"sample_NODE_{i + 1}.fasta"),
+                                  [(f"NODE_{i + 1}", synthetic.random_genome(rng, 4000))])
+    elif kind == "tables":
+        os.makedirs(tmp)
+        for sample in range(max(1, scale // contigs_per_table)):
+            sample_dir = os.path.join(tmp, f"sample{sample:04d}")
+            os.makedirs(sample_dir)
+            write_covstats(os.path.join(sample_dir, "covstats.tsv"), names[:contigs_per_table])
+    elif kind == "graph":
+        import base_coverage
+        os.makedirs(tmp)
+        write_covstats(os.path.join(tmp, "covstats.tsv"), names, depth=lambda i: 150.0 if i == 0 else 5.0)
+        basecov = os.path.join(tmp, "basecov.tsv")
+        write_basecov(basecov, names)
+        base_coverage.convert(basecov, os.path.join(tmp, base_coverage.store_name))
+        os.remove(basecov)
+    elif kind == "output":
+        write_output_dir(tmp, scale)
+    os.replace(tmp, path)
+    return path
+
+## Benchmarks, each setup returns the function that is timed
+
+def bench_covstat_filter(workdir, scale):
+    import functions, mapstats
+    path = fixture(workdir, scale, "covstats.tsv")
+    names = contig_names(scale)
+
+    # One table load per sample, then every contig is looked up
+    def run():
+        table = mapstats.load_table(path)
+        return [functions.covstat_filter(name, table) for name in names]
+    return run
+
+def bench_scafstat_filter(workdir, scale):
+    import functions, mapstats
+    path = fixture(workdir, scale, "scafstats.tsv")
+    names = contig_names(scale)
+
+    def run():
+        table = mapstats.load_table(path, keep="last")
+        return [functions.scafstat_filter(name, table) for name in names]
+    return run
+
+def bench_extract_genome(workdir, scale):
+    import functions
+    contigs = fixture(workdir, scale, "contigs.fasta")
+    names = contig_names(scale)
+    headers = names[::max(1, scale // 10)]
+    outdir = tempfile.mkdtemp(dir=workdir)
+    return lambda: [functions.extract_genome(contigs, header, outdir, "bench") for header in headers]
+
+def bench_contig_scan(workdir, scale):
+    import functions
+    contigs = fixture(workdir, scale, "contigs.fasta")
+    return lambda: functions.contig_scan(contigs)
+
+def bench_find_hq_genomes(workdir, scale):
+    import functions
+    checkv = os.path.join(fixture(workdir, scale, "checkv"), "quality_summary.tsv")
+    return lambda: functions.find_hq_genomes(checkv, "bench")
+
+def bench_barcode_phage(workdir, scale):
+    import functions
+    genomes = fixture(workdir, scale, "genomes")
+    files = sorted(os.path.join(genomes, file) for file in os.listdir(genomes))
+    outdir = tempfile.mkdtemp(dir=workdir)
+
+    def run():
+        tags = set()
+        for path in files:
+            tag = functions.generate_unique_tag(tags)
+            tags.add(tag)
+            functions.barcode_phage(path, tag, outdir)
+    return run
+
+def bench_filescan(workdir, scale):
+    import finisher
+    tables = fixture(workdir, scale, "tables")
+    paths = [os.path.join(tables, sample, "covstats.tsv") for sample in sorted(os.listdir(tables))]
+
+    # Table reads as the finisher pool returns them, then the concatenation
+    def run():
+        results = [(("table", path), finisher.read_table(path), None) for path in paths]
+        return finisher.filescan(results, "covstats.tsv")
+    return run
+
+def bench_coverage_graph(workdir, scale):
+    import finisher, base_coverage
+    graph = fixture(workdir, scale, "graph")
+    covstats = os.path.join(graph, "covstats.tsv")
+    store = os.path.join(graph, base_coverage.store_name)
+    outdir = tempfile.mkdtemp(dir=workdir)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            finisher.generate_coverage_graph(covstats, store, outdir)
+    return run
+
+def bench_check_task(workdir, scale, strict=False):
+    from Phanatic.check import check_task
+    output = fixture(workdir, scale, "output")
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = check_task(output, strict=strict)
+        if not report.ok:
+            raise RuntimeError(f"check of {output} failed")
+    return run
+
+def bench_check_task_strict(workdir, scale):
+    return bench_check_task(workdir, scale, strict=True)
+
+# Benchmark name -> setup(workdir, scale)
+benchmarks = {
+    "covstat_filter": bench_covstat_filter,
+    "scafstat_filter": bench_scafstat_filter,
+    "extract_genome": bench_extract_genome,
+    "contig_scan": bench_contig_scan,
+    "find_hq_genomes": bench_find_hq_genomes,
+    "barcode_phage": bench_barcode_phage,
+    "filescan": bench_filescan,
+    "coverage_graph": bench_coverage_graph,
+    "check_task": bench_check_task,
+    "check_task_strict": bench_check_task_strict,
+}
+
+## Timing
+
+def clock(func, loops):
+    # Seconds for loops calls with the garbage collector paused, like timeit
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        return time.perf_counter() - start
+    finally:
+        if enabled:
+            gc.enable()
+
+def measure(func, repeat=5, min_time=0.2):
+    # Loops are doubled until one batch takes min_time, the batch is then repeated
+    func()
+    loops = 1
+    while True:
+        elapsed = clock(func, loops)
+        if elapsed >= min_time or loops >= 1 << 16:
+            break
+        loops *= 2 if elapsed * 2 >= min_time else max(2, int(min_time / max(elapsed, 1e-9)))
+    times = [clock(func, loops) / loops for _ in range(repeat)]
+
+    # Allocation peak of one call, traced separately so tracing does not slow the timings
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "loops": loops,
+        "repeat": repeat,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "mean_s": statistics.mean(times),
+        "stdev_s": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "peak_kb": peak / 1024,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "-C", repo, "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def prepare(workdir):
+    # functions.py reads its config and log paths from PHANATIC_HOME when first imported
+    output = os.path.join(workdir, "output")
+    os.makedirs(output, exist_ok=True)
+    shutil.copy(os.path.join(repo, "config.ini"), os.path.join(workdir, "config.ini"))
+    os.environ["PHANATIC_HOME"] = workdir
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    sys.path[:0] = [docker_lib, pip_dir]
+
+def run_benchmarks(args):
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="phanatic_micro_"))
+    prepare(workdir)
+    scales = [int(scale) for scale in args.scales.split(",")]
+
+    results = {}
+    print(f"{'benchmark':<32}{'median':>12}{'min':>12}{'stdev':>10}{'loops':>8}{'peak_kb':>12}")
+    for name, setup in benchmarks.items():
+        if args.filter and args.filter not in name:
+            continue
+        for scale in scales:
+            key = f"{name}[{scale}]"
+            result = measure(setup(workdir, scale), args.repeat, args.min_time)
+            result.update({"benchmark": name, "scale": scale})
+            results[key] = result
+            print(f"{key:<32}{_duration(result['median_s']):>12}{_duration(result['min_s']):>12}"
+                  f"{100 * result['stdev_s'] / result['median_s']:>9.1f}%{result['loops']:>8}{result['peak_kb']:>12.1f}")
+
+    document = {
+        "meta": {
+            "date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "min_time": args.min_time,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(document, file, indent=2, sort_keys=True)
+        print(f"Results written to {args.output}")
+    if not args.workdir and not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+def compare(baseline, current, threshold=0.10, memory_threshold=0.25):
+    # Rows of (key, time ratio, memory ratio, status), a result is a regression past either threshold
+    rows = []
+    for key in sorted(set(baseline) | set(current), key=_order):
+        if key not in current:
+            rows.append((key, None, None, "missing"))
+            continue
+        if key not in baseline:
+            rows.append((key, None, None, "new"))
+            continue
+        old, new = baseline[key], current[key]
+        time_ratio = new["median_s"] / old["median_s"] if old["median_s"] else None
+        memory_ratio = new["peak_kb"] / old["peak_kb"] if old["peak_kb"] else None
+        status = "ok"
+        if time_ratio is not None and time_ratio > 1 + threshold:
+            status = "slower"
+        elif memory_ratio is not None and memory_ratio > 1 + memory_threshold \
+                and new["peak_kb"] - old["peak_kb"] > memory_floor_kb:
+            status = "more memory"
+        elif time_ratio is not None and time_ratio < 1 - threshold:
+            status = "faster"
+        rows.append((key, time_ratio, memory_ratio, status))
+    return rows
+
+def compare_files(args):
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    print(f"baseline {args.baseline}: {baseline['meta'].get('commit')} {baseline['meta'].get('date')}")
+    print(f"current  {args.current}: {current['meta'].get('commit')} {current['meta'].get('date')}")
+
+    rows = compare(baseline["results"], current["results"], args.threshold, args.memory_threshold)
+    print(f"{'benchmark':<32}{'baseline':>12}{'current':>12}{'time':>9}{'memory':>9}  status")
+    for key, time_ratio, memory_ratio, status in rows:
+        old = baseline["results"].get(key)
+        new = current["results"].get(key)
+        print(f"{key:<32}{_duration(old['median_s']) if old else '-':>12}{_duration(new['median_s']) if new else '-':>12}"
+              f"{_ratio(time_ratio):>9}{_ratio(memory_ratio):>9}  {status}")
+    regressions = [row for row in rows if row[3] in ("slower", "more memory")]
+    if regressions:
+        print(f"{len(regressions)} regression(s) past {100 * args.threshold:.0f}% time / {100 * args.memory_threshold:.0f}% memory")
+        return 1
+    print("No regressions")
+    return 0
+
+## Dedupe engine check, the numpy engine against an exact duplicate reference
+
+def dedupe_fixture(path, pairs=20000, seed=1, read_length=150):
+    # Interleaved pairs where some repeat an earlier pair exactly, with the reads swapped, or with one
+    # base changed. Returns [(read id, seq_1, seq_2, kind)] in file order
+    rng = random.Random(seed)
+    genome = synthetic.random_genome(rng, 20000)
+    fresh = synthetic.read_pairs(rng, genome, pairs, read_length)
+    records = []
+    for i in range(pairs):
+        roll = rng.random()
+        if records and roll < 0.15:
+            kind = "exact"
+            seq_1, seq_2 = rng.choice(records)[1:3]
+        elif records and roll < 0.20:
+            kind = "swapped"
+            seq_2, seq_1 = rng.choice(records)[1:3]
+        elif records and roll < 0.25:
+            kind = "near"
+            seq_1, seq_2 = rng.choice(records)[1:3]
+            position = rng.randrange(len(seq_1))
+            base = rng.choice([base for base in "ACGT" if base != seq_1[position]])
+            seq_1 = seq_1[:position] + base + seq_1[position + 1:]
+        else:
+            kind = "fresh"
+            seq_1, seq_2 = next(fresh)
+        records.append((f"p{i}", seq_1, seq_2, kind))
+
+    quality = "F" * read_length
+    with open(path, 'w') as file:
+        for name, seq_1, seq_2, kind in records:
+            file.write(f"@{name} 1:N:0:1\n{seq_1}\n+\n{quality[:len(seq_1)]}\n"
+                       f"@{name} 2:N:0:1\n{seq_2}\n+\n{quality[:len(seq_2)]}\n")
+    return records
+
+def pair_key(seq_1, seq_2, swapped):
+    return tuple(sorted((seq_1, seq_2))) if swapped else (seq_1, seq_2)
+
+def exact_reference(records, swapped):
+    # Read ids of the first pair with each sequence key
+    seen = set()
+    kept = []
+    for name, seq_1, seq_2, kind in records:
+        key = pair_key(seq_1, seq_2, swapped)
+        if key not in seen:
+            seen.add(key)
+            kept.append(name)
+    return kept
+
+def read_ids(path):
+    # Pair ids of an interleaved FASTQ, taken from the read 1 headers
+    with open(path) as file:
+        lines = file.readlines()
+    return [line[1:].split()[0] for line in lines[0::8]]
+
+def check_dedupe(args):
+    import fastq_dedupe
+    workdir = tempfile.mkdtemp(prefix="phanatic_dedupe_")
+    failures = []
+
+    def check(label, passed):
+        print(f"{'ok' if passed else 'FAILED':<8}{label}")
+        if not passed:
+            failures.append(label)
+
+    try:
+        reads = os.path.join(workdir, "reads.fastq")
+        records = dedupe_fixture(reads, args.pairs, args.seed)
+        kinds = {name: kind for name, seq_1, seq_2, kind in records}
+        out = os.path.join(workdir, "deduped.fastq")
+        print(f"{len(records)} pairs, " + ", ".join(f"{sum(1 for kind in kinds.values() if kind == name)} {name}"
+                                                    for name in ("fresh", "exact", "swapped", "near")))
+
+        # Table large enough for every pair, output matches the reference read for read. Small batches
+        # make most repeats cross a batch boundary, so they are found through the table
+        for swapped in (False, True):
+            reference = exact_reference(records, swapped)
+            stats = fastq_dedupe.dedupe_file(reads, out, table_mb=args.table_mb, batch_reads=args.batch_reads,
+                                             swapped=swapped)
+            check(f"swapped={swapped}: surviving ids match the exact reference ({len(reference)} pairs)",
+                  read_ids(out) == reference)
+            check(f"swapped={swapped}: counts {stats}",
+                  stats.kept == len(reference) and stats.duplicates == len(records) - len(reference)
+                  and stats.unchecked == 0)
+
+        # The dedupe.sh stand-in of the offline benchmark removes exact repeats in read order
+        stub = os.path.join(workdir, "stub.fastq")
+        stub_tool.dedupe({"in": reads, "out": stub}, [])
+        check("swapped=False: surviving ids match the dedupe.sh stand-in", read_ids(stub) == exact_reference(records, False))
+
+        # Table full, no first occurrence is lost and every extra pair kept was counted as unchecked
+        reference = exact_reference(records, True)
+        stats = fastq_dedupe.dedupe_file(reads, out, table_mb=0.001, batch_reads=500, swapped=True)
+        kept = read_ids(out)
+        position = {name: i for i, name in enumerate(kept)}
+        first = {}
+        for name, seq_1, seq_2, kind in records:
+            first.setdefault(pair_key(seq_1, seq_2, True), name)
+        expected = set(reference)
+        extra = set(name for name in kept if name not in expected)
+        check(f"table full: {stats}", stats.unchecked > 0)
+        check("table full: every first occurrence kept, in order",
+              all(name in position for name in reference)
+              and [position[name] for name in reference] == sorted(position[name] for name in reference))
+        check("table full: pairs kept beyond the reference are repeats of a kept pair",
+              all(first[pair_key(*pair[1:3], True)] in position for pair in records if pair[0] in extra))
+        check("table full: counts agree with the output",
+              stats.kept == len(kept) and stats.kept + stats.duplicates == len(records)
+              and len(extra) <= stats.unchecked)
+
+        # Pairs one base away are kept, dedupe.sh as run by phanatic (s=5 e=2) removes them
+        near = sum(1 for name in exact_reference(records, True) if kinds[name] == "near")
+        print(f"\n{near} pairs one base from an earlier pair are kept by the numpy engine. dedupe.sh runs with "
+              "s=5 e=2 and removes near repeats like these, so the two engines keep different reads.")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print(f"{len(failures)} checks failed")
+        return 1
+    return 0
+
+def finishes(func, timeout):
+    # Runs func on a daemon thread, False when it is still blocked after timeout seconds
+    thread = threading.Thread(target=func, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+def fork_and_log(log):
+    # Forking runs the at fork flush, the child logs on its own writer and exits with its status
+    pid = os.fork()
+    if pid == 0:
+        log.log("check", "from the child")
+        log.flush()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+def check_logger(args):
+    import logger
+    workdir = tempfile.mkdtemp(prefix="phanatic_logger_")
+    failures = []
+
+    def check(label, passed):
+        print(f"{'ok' if passed else 'FAILED':<8}{label}")
+        if not passed:
+            failures.append(label)
+
+    try:
+        path = os.path.join(workdir, "log.txt")
+        log = logger.Logger(path, "check", jsonl=True, interval=0.05)
+
+        # A surrogate escaped file name cannot be encoded as utf-8, the writer must outlive it
+        log.log("check", "bad \udcff name")
+        check("flush returns after an unencodable entry", finishes(log.flush, args.timeout))
+        check("fork returns after an unencodable entry", finishes(lambda: fork_and_log(log), args.timeout))
+        log.log("check", "after the fork")
+        check("flush returns after the fork", finishes(log.flush, args.timeout))
+        log.close()
+
+        with open(path, errors="replace") as file:
+            text = file.read()
+        records = []
+        if os.path.exists(os.path.splitext(path)[0] + ".jsonl"):
+            with open(os.path.splitext(path)[0] + ".jsonl") as file:
+                records = [json.loads(line) for line in file]
+        check("unencodable entry written escaped", "bad \\udcff name" in text)
+        check("entries after it written", "from the child" in text and "after the fork" in text)
+        check("jsonl has every entry", len(records) == 3)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print(f"{len(failures)} checks failed")
+        return 1
+    return 0
+
+def _order(key):
+    # benchmark[scale] keys sorted by name, then by size
+    name, _, scale = key.partition("[")
+    return name, int(scale.rstrip("]") or 0)
+
+def _duration(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+def _ratio(ratio):
+    return "-" if ratio is None else f"{ratio:.2f}x"
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Micro benchmarks for phanatic parsers and writers")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmarks")
+    run.add_argument('--scales', default=",".join(str(scale) for scale in default_scales),
+                     help='Comma separated fixture sizes (contigs, genomes or files)')
+    run.add_argument('--filter', help='Only run benchmarks whose name contains this')
+    run.add_argument('--repeat', type=int, default=5, help='Timed batches per benchmark')
+    run.add_argument('--min_time', type=float, default=0.2, help='Minimum seconds per timed batch')
+    run.add_argument('--output', help='Write the results to this JSON file')
+    run.add_argument('--workdir', help='Directory for fixtures, reused between runs when given')
+    run.add_argument('--keep', action="store_true", help='Keep the temporary fixture directory')
+
+    diff = commands.add_parser("compare", help="Compare two result files")
+    diff.add_argument('baseline')
+    diff.add_argument('current')
+    diff.add_argument('--threshold', type=float, default=0.10, help='Median time increase counted as a regression')
+    diff.add_argument('--memory_threshold', type=float, default=0.25, help='Peak memory increase counted as a regression')
+
+    dedupe = commands.add_parser("dedupe", help="Check the numpy dedupe engine against an exact duplicate reference")
+    dedupe.add_argument('--pairs', type=int, default=20000, help='Read pairs in the test file')
+    dedupe.add_argument('--table_mb', type=float, default=16, help='Digest table size for the exact checks')
+    dedupe.add_argument('--batch_reads', type=int, default=1000, help='Pairs per batch for the exact checks')
+    dedupe.add_argument('--seed', type=int, default=1)
+
+    log = commands.add_parser("logger", help="Check the log writer survives unencodable entries and forks")
+    log.add_argument('--timeout', type=float, default=10, help='Seconds before a flush or fork counts as hung')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "run":
+        return run_benchmarks(args)
+    if args.command == "dedupe":
+        sys.path[:0] = [docker_lib]
+        return check_dedupe(args)
+    if args.command == "logger":
+        sys.path[:0] = [docker_lib]
+        return check_logger(args)
+    return compare_files(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+# Offline end to end benchmark, the coordinator, finisher and hashing run on synthetic reads with stub tools.
+# Time spent in the tools is subtracted, so what is reported is the Python side of each stage
+
+import os
+import sys
+import json
+import time
+import shutil
+import runpy
+import argparse
+import contextlib
+import tempfile
+import subprocess
+import configparser
+import synthetic
+import stub_tool
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+docker_lib = os.path.join(repo, "docker_lib")
+pip_dir = os.path.join(repo, "pip")
+
+# Phases in the order assemble.sh runs them
+phases = {
+    "coordinator": os.path.join(docker_lib, "coordinator.py"),
+    "finisher": os.path.join(docker_lib, "finisher.py"),
+    "hash": os.path.join(docker_lib, "data_sec.py"),
+}
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def write_stubs(bin_dir):
+    # One wrapper per tool name, all running stub_tool.py with this interpreter
+    os.makedirs(bin_dir, exist_ok=True)
+    stub = os.path.abspath(stub_tool.__file__)
+    for tool in stub_tool.tools:
+        path = os.path.join(bin_dir, tool)
+        with open(path, 'w') as file:
+            file.write(f'#!/bin/sh\nexec "{sys.executable}" "{stub}" {tool} "$@"\n')
+        os.chmod(path, 0o755)
+
+def write_config(home, args):
+    # Repository defaults with the tool threads and memory sized down to fit a workstation
+    config = configparser.ConfigParser()
+    config.read(os.path.join(repo, "config.ini"))
+    settings = {
+        "pipeline": {"streaming": args.streaming, "fastqc": True, "mapping": True, "re_assembly": True},
+        "system": {"RAM": "1000m"},
+        "scheduler": {"workers": args.workers, "cpus": 0, "memory_gb": 0, "light_threads": 1,
+                      "finisher_workers": args.workers},
+        "SPAdes": {"threads": 1, "memory_gb": 1},
+        "cache": {"enable": False, "host_index": True},
+        "logging": {"metrics": True},
+        "trim": {"engine": args.trim_engine},
+        "dedupe": {"engine": args.dedupe_engine},
+    }
+    for section, values in settings.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, str(value))
+    with open(os.path.join(home, "config.ini"), 'w') as file:
+        config.write(file)
+
+def write_host_mapping(path, samples, host):
+    with open(path, 'w') as file:
+        file.write("host,read_1,read_2\n")
+        for sample in samples:
+            file.write(f"{os.path.basename(host)},{os.path.basename(sample.read_1)},{os.path.basename(sample.read_2)}\n")
+
+def record(path, row):
+    # Small appends from every worker process, one line each
+    with open(path, 'a') as file:
+        file.write(json.dumps(row) + "\n")
+
+# Seconds this process has spent waiting for the scheduler budget
+budget_wait = {"s": 0.0}
+
+def timed(records, phase, sample, step, func, trace):
+    # Wall time, budget wait and traced allocation peak of one stage function
+    import tracemalloc
+
+    def run(*args, **kwargs):
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        waited = budget_wait["s"]
+        try:
+            return func(*args, **kwargs)
+        finally:
+            row = {"phase": phase, "sample": sample, "step": step, "wall_s": time.perf_counter() - start,
+                   "wait_s": budget_wait["s"] - waited}
+            if trace:
+                row["traced_peak_mb"] = (tracemalloc.get_traced_memory()[1] - before) / 1024 ** 2
+            record(records, row)
+    return run
+
+def child(phase, records, trace):
+    # Runs one phase in this process with its stage functions timed
+    import resource
+    import tracemalloc
+    sys.path[:0] = [docker_lib, pip_dir]
+    if trace:
+        tracemalloc.start()
+
+    if phase == "coordinator":
+        import stages
+        import scheduler
+        add = stages.StageGraph.add
+        reserve = scheduler.reserve
+
+        @contextlib.contextmanager
+        def timed_reserve(*args):
+            start = time.perf_counter()
+            with reserve(*args) as cpus:
+                budget_wait["s"] += time.perf_counter() - start
+                yield cpus
+        scheduler.reserve = timed_reserve
+
+        def timed_add(graph, name, func, *args, **kwargs):
+            return add(graph, name, timed(records, phase, graph.sample, name, func, trace), *args, **kwargs)
+        stages.StageGraph.add = timed_add
+        runpy.run_path(phases[phase], run_name="__main__")
+    elif phase == "finisher":
+        import finisher
+        for kind, func in list(finisher.task_functions.items()):
+            finisher.task_functions[kind] = timed(records, phase, "", kind, func, trace)
+        finisher.main()
+    else:
+        runpy.run_path(phases[phase], run_name="__main__")
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    record(records, {"phase": phase, "main_rss_mb": usage.ru_maxrss / 1024})
+
+def run_phase(phase, env, records, trace, log):
+    command = [sys.executable, os.path.abspath(__file__), "--child", phase, "--records", records]
+    if trace:
+        command.append("--tracemalloc")
+    start = time.monotonic()
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "exit_code": process.returncode,
+        "wall_s": time.monotonic() - start,
+        "cpu_s": usage.ru_utime + usage.ru_stime,
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+    }
+
+def step_group(step):
+    # Per genome stages are reported together
+    return "reassembly" if step.startswith("reassembly_") else step
+
+def summarise(home, records, results):
+    from Phanatic.metrics import read_metrics
+
+    rows = []
+    if os.path.exists(records):
+        with open(records) as file:
+            rows = [json.loads(line) for line in file if line.strip()]
+    metrics_path = os.path.join(home, "output", "phanatic_metrics.tsv")
+    tools = read_metrics(metrics_path) if os.path.exists(metrics_path) else []
+
+    # Tool wall time per (sample, step), tools run outside the stage graph have no step.
+    # Tools of a streaming pipeline run side by side, the longest one covers the others
+    tool_wall = {}
+    streamed = {}
+    for tool in tools:
+        key = (tool["sample"], tool["step"])
+        if tool["stage"] == "stream":
+            streamed[key] = max(streamed.get(key, 0), tool["wall_s"])
+        else:
+            tool_wall[key] = tool_wall.get(key, 0) + tool["wall_s"]
+    for key, wall in streamed.items():
+        tool_wall[key] = tool_wall.get(key, 0) + wall
+
+    steps = {}
+    for row in rows:
+        if "step" not in row:
+            results[row["phase"]]["main_rss_mb"] = row["main_rss_mb"]
+            continue
+        name = f"{row['phase']}:{step_group(row['step'])}"
+        step = steps.setdefault(name, {"runs": 0, "wall_s": 0.0, "wait_s": 0.0, "tool_s": 0.0, "traced_peak_mb": 0.0})
+        tool_s = tool_wall.get((row["sample"], row["step"]), 0.0) if row["phase"] == "coordinator" else 0.0
+        step["runs"] += 1
+        step["wall_s"] += row["wall_s"]
+        step["wait_s"] += row["wait_s"]
+        step["tool_s"] += tool_s
+        step["traced_peak_mb"] = max(step["traced_peak_mb"], row.get("traced_peak_mb", 0.0))
+    for step in steps.values():
+        step["python_s"] = step["wall_s"] - step["wait_s"] - step["tool_s"]
+
+    # Python cpu time of a phase is its process tree minus the tools it ran
+    tool_cpu = sum(tool["user_s"] + tool["sys_s"] for tool in tools)
+    for phase, result in results.items():
+        spent = tool_cpu if phase == "coordinator" else 0.0
+        result["tool_cpu_s"] = spent
+        result["python_cpu_s"] = result["cpu_s"] - spent
+    return steps
+
+def report(results, steps, params):
+    print(f"\n{params['samples']} samples, {params['pairs']} read pairs, {params['workers']} workers")
+    print(f"{'phase':<14}{'wall_s':>10}{'python_cpu_s':>14}{'tool_cpu_s':>12}{'main_rss_mb':>13}{'peak_rss_mb':>13}")
+    for phase, result in results.items():
+        print(f"{phase:<14}{result['wall_s']:>10.2f}{result['python_cpu_s']:>14.2f}{result['tool_cpu_s']:>12.2f}"
+              f"{result.get('main_rss_mb', 0):>13.1f}{result['peak_rss_mb']:>13.1f}")
+    total = {key: sum(result[key] for result in results.values()) for key in ("wall_s", "python_cpu_s", "tool_cpu_s")}
+    print(f"{'total':<14}{total['wall_s']:>10.2f}{total['python_cpu_s']:>14.2f}{total['tool_cpu_s']:>12.2f}")
+
+    print(f"\n{'step':<28}{'runs':>6}{'wall_s':>10}{'wait_s':>10}{'tool_s':>10}{'python_s':>10}{'traced_mb':>11}")
+    for name, step in sorted(steps.items(), key=lambda item: -item[1]["python_s"]):
+        print(f"{name:<28}{step['runs']:>6}{step['wall_s']:>10.2f}{step['wait_s']:>10.2f}{step['tool_s']:>10.2f}"
+              f"{step['python_s']:>10.3f}{step['traced_peak_mb']:>11.2f}")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Offline phanatic pipeline benchmark with stub tools")
+    parser.add_argument('--samples', type=int, default=4, help='Number of read pairs files')
+    parser.add_argument('--depth', type=float, default=150, help='Read depth of each phage genome')
+    parser.add_argument('--genome_length', type=int, default=45000, help='Mean phage genome length')
+    parser.add_argument('--host_length', type=int, default=200000, help='Host genome length')
+    parser.add_argument('--contaminated', type=float, default=0.25, help='Fraction of samples with a second phage')
+    parser.add_argument('--workers', type=int, default=1, help='[scheduler] workers and finisher_workers')
+    parser.add_argument('--streaming', action="store_true", help='Run with [pipeline] streaming = True')
+    parser.add_argument('--trim_engine', choices=["bbduk", "numpy"], default="bbduk", help='[trim] engine')
+    parser.add_argument('--dedupe_engine', choices=["dedupe", "numpy"], default="dedupe", help='[dedupe] engine')
+    parser.add_argument('--resume', action="store_true", help='Run the coordinator a second time over finished samples')
+    parser.add_argument('--tracemalloc', action="store_true", help='Record the allocation peak of each stage (slower)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help='Directory for the synthetic run, a temporary directory by default')
+    parser.add_argument('--keep', action="store_true", help='Keep the working directory')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--child', choices=list(phases), help=argparse.SUPPRESS)
+    parser.add_argument('--records', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        child(args.child, args.records, args.tracemalloc)
+        return 0
+
+    home = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="phanatic_bench_"))
+    output = os.path.join(home, "output")
+    shutil.rmtree(output, ignore_errors=True)
+    os.makedirs(output)
+    print(f"Working directory: {home}")
+
+    # Synthetic reads and the run layout of the container
+    start = time.monotonic()
+    samples, host, catalogue = synthetic.generate(home, args.samples, args.depth, args.genome_length,
+                                                  args.host_length, args.contaminated, seed=args.seed)
+    print(f"Generated {len(samples)} samples in {time.monotonic() - start:.1f}s")
+    write_stubs(os.path.join(home, "bin"))
+    write_config(home, args)
+    write_host_mapping(os.path.join(output, "host_mapping.csv"), samples, host)
+    database = os.path.join(home, "database", "checkv-db-v1.5")
+    os.makedirs(database, exist_ok=True)
+
+    env = dict(os.environ)
+    env.update({
+        "PHANATIC_HOME": home,
+        "CHECKVDB": database,
+        stub_tool.catalogue_env: catalogue,
+        "PATH": os.pathsep.join([os.path.join(home, "bin"), env.get("PATH", "")]),
+        "PYTHONPATH": os.pathsep.join([docker_lib, pip_dir, env.get("PYTHONPATH", "")]),
+        "MPLBACKEND": "Agg",
+    })
+
+    records = os.path.join(home, "stage_times.jsonl")
+    if os.path.exists(records):
+        os.remove(records)
+    sys.path[:0] = [docker_lib, pip_dir]
+
+    results = {}
+    with open(os.path.join(home, "benchmark.log"), 'w') as log:
+        for phase in phases:
+            results[phase] = run_phase(phase, env, records, args.tracemalloc, log)
+            if results[phase]["exit_code"] != 0:
+                print(f"ERROR: {phase} exited with {results[phase]['exit_code']}, see {log.name}")
+                break
+        steps = summarise(home, records, results)
+
+        # Finished samples are skipped by their manifests, this pass measures the checkpoint checks
+        if args.resume and all(result["exit_code"] == 0 for result in results.values()):
+            resumed = run_phase("coordinator", env, os.devnull, False, log)
+            resumed["python_cpu_s"] = resumed["cpu_s"]
+            resumed["tool_cpu_s"] = 0.0
+            results["resume"] = resumed
+
+    # Samples that crashed are listed in the run log
+    crashed = []
+    log_path = os.path.join(output, "phanatic_log.tsv")
+    if os.path.exists(log_path):
+        with open(log_path) as file:
+            crashed = [line.strip() for line in file if "sample run crashed" in line]
+    for line in crashed:
+        print(line)
+
+    params = {key: value for key, value in vars(args).items() if key not in ("child", "records", "json")}
+    params["pairs"] = sum(sample.pairs for sample in samples)
+    report(results, steps, params)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({"params": params, "phases": results, "steps": steps, "crashed": crashed}, file, indent=2)
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(home, ignore_errors=True)
+    failed = crashed or any(result["exit_code"] != 0 for result in results.values())
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+
+# Deterministic stand-ins for bbtools, SPAdes, CheckV and fastqc, called as stub_tool.py <tool> <args>.
+# Outputs follow the real file formats closely enough for the coordinator and finisher to run on them
+
+import os
+import sys
+import gzip
+import zlib
+import random
+import shutil
+import zipfile
+
+# Catalogue of every sequence in the synthetic reads, written by synthetic.generate
+catalogue_env = "PHANATIC_STUB_CATALOGUE"
+
+complement = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+streams = {"stdin", "stdin.fq", "stdin.fastq"}
+outputs = {"stdout", "stdout.fq", "stdout.fastq", "stdout.sam"}
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class KmerIndex(object):
+    # k-mers sampled every step bases, a read is placed by looking up its first step k-mers
+    def __init__(self, records, k=25, step=16):
+        self.k = k
+        self.step = step
+        self.names = [name for name, seq in records]
+        self.seqs = [seq for name, seq in records]
+        self.index = {}
+        for i, seq in enumerate(self.seqs):
+            for pos in range(0, len(seq) - k + 1, step):
+                self.index.setdefault(seq[pos:pos + k], (i, pos))
+
+    def locate(self, read):
+        # (sequence index, leftmost position, reverse strand) or None
+        k = self.k
+        for reverse, seq in ((False, read), (True, reverse_complement(read))):
+            for offset in range(min(self.step, len(seq) - k + 1)):
+                hit = self.index.get(seq[offset:offset + k])
+                if hit is not None and hit[1] >= offset:
+                    return hit[0], hit[1] - offset, reverse
+        return None
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def parse(argv):
+    # bbtools style key=value arguments, everything else is kept as a flag
+    values = {}
+    flags = []
+    for arg in argv:
+        key, sep, value = arg.partition("=")
+        if sep and not arg.startswith("-"):
+            values[key.lower()] = value
+        else:
+            flags.append(arg)
+    return values, flags
+
+def option(flags, name, default=None):
+    if name in flags and flags.index(name) + 1 < len(flags):
+        return flags[flags.index(name) + 1]
+    return default
+
+def open_in(path):
+    if path in streams:
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rt')
+    return open(path)
+
+def open_out(path):
+    if path in outputs:
+        return sys.stdout
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith(".gz"):
+        return gzip.open(path, 'wt', compresslevel=1)
+    return open(path, 'w')
+
+def close(handle):
+    if handle not in (sys.stdin, sys.stdout):
+        handle.close()
+    else:
+        handle.flush()
+
+def reverse_complement(seq):
+    return seq.translate(complement)[::-1]
+
+def fastq(handle):
+    # (name, seq, qual) records
+    while True:
+        header = handle.readline()
+        if not header:
+            return
+        seq = handle.readline().rstrip("\n")
+        handle.readline()
+        qual = handle.readline().rstrip("\n")
+        yield header[1:].rstrip("\n"), seq, qual
+
+def pairs(handle):
+    # Interleaved records taken two at a time
+    records = fastq(handle)
+    for first in records:
+        second = next(records, None)
+        if second is None:
+            return
+        yield first, second
+
+def write_record(out, record):
+    out.write(f"@{record[0]}\n{record[1]}\n+\n{record[2]}\n")
+
+def read_fasta(path):
+    records = []
+    name = None
+    seq = []
+    with open_in(path) as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    records.append((name, "".join(seq)))
+                name = line[1:].split()[0]
+                seq = []
+            elif line:
+                seq.append(line)
+    if name is not None:
+        records.append((name, "".join(seq)))
+    return records
+
+def write_fasta(path, records, width=70):
+    with open_out(path) as file:
+        for name, seq in records:
+            file.write(f">{name}\n")
+            for i in range(0, len(seq), width):
+                file.write(seq[i:i + width] + "\n")
+
+def seeded(*parts):
+    return random.Random(zlib.crc32("|".join(str(part) for part in parts).encode()))
+
+## bbtools
+
+def bbduk(values, flags):
+    # Pairs interleaved and trimmed to ftl..ftr, short reads dropped
+    left = int(values.get("ftl", 0))
+    right = int(values.get("ftr", -1))
+    minimum = int(values.get("minlength", 0))
+    out = open_out(values["out"])
+    with open_in(values["in1"]) as in_1, open_in(values["in2"]) as in_2:
+        for first, second in zip(fastq(in_1), fastq(in_2)):
+            trimmed = []
+            for name, seq, qual in (first, second):
+                end = right + 1 if right >= 0 else len(seq)
+                trimmed.append((name, seq[left:end], qual[left:end]))
+            if all(len(seq) >= minimum for name, seq, qual in trimmed):
+                write_record(out, trimmed[0])
+                write_record(out, trimmed[1])
+    close(out)
+
+def dedupe(values, flags):
+    # Exact duplicate pairs removed
+    seen = set()
+    out = open_out(values["out"])
+    handle = open_in(values["in"])
+    for first, second in pairs(handle):
+        key = (first[1], second[1])
+        if key in seen:
+            continue
+        seen.add(key)
+        write_record(out, first)
+        write_record(out, second)
+    close(handle)
+    close(out)
+
+def copy_reads(values, flags):
+    # bbnorm / bbmerge, reads are passed through unchanged
+    out = open_out(values["out"])
+    handle = open_in(values["in"])
+    shutil.copyfileobj(handle, out)
+    close(handle)
+    close(out)
+    if "outu" in values:
+        close(open_out(values["outu"]))
+
+def reformat(values, flags):
+    minimum = int(values.get("minlength", 0))
+    records = [(name, seq) for name, seq in read_fasta(values["in"]) if len(seq) >= minimum]
+    write_fasta(values["out"], records)
+
+def index_reference(path):
+    return os.path.join(path, "ref", "genome", "1")
+
+def bbmap(values, flags):
+    # Index build when there are no reads, otherwise reads are placed by k-mer lookup
+    if "path" in values and "ref" in values and "in" not in values:
+        directory = index_reference(values["path"])
+        os.makedirs(directory, exist_ok=True)
+        records = read_fasta(values["ref"])
+        write_fasta(os.path.join(directory, "chr1.fa"), records)
+        with open(os.path.join(directory, "summary.txt"), 'w') as file:
+            file.write(f"scaffolds\t{len(records)}\nbases\t{sum(len(seq) for name, seq in records)}\n")
+        return
+
+    if "ref" in values:
+        records = read_fasta(values["ref"])
+    else:
+        records = read_fasta(os.path.join(index_reference(values["path"]), "chr1.fa"))
+    index = KmerIndex(records)
+
+    # Per contig coverage as start / end deltas
+    deltas = [[0] * (len(seq) + 1) for name, seq in records]
+    plus = [0] * len(records)
+    minus = [0] * len(records)
+    assigned = [0] * len(records)
+    assigned_bases = [0] * len(records)
+    gc = [0] * len(records)
+    total = 0
+
+    sam = open_out(values["out"]) if "out" in values else None
+    mapped_out = open_out(values["outm"]) if "outm" in values else None
+    unmapped_out = open_out(values["outu"]) if "outu" in values else None
+    if sam is not None:
+        for name, seq in records:
+            sam.write(f"@SQ\tSN:{name}\tLN:{len(seq)}\n")
+
+    handle = open_in(values["in"])
+    for pair in pairs(handle):
+        total += 2
+        hits = [index.locate(seq) for name, seq, qual in pair]
+        for (name, seq, qual), hit in zip(pair, hits):
+            if hit is None:
+                continue
+            contig, start, reverse = hit
+            end = min(start + len(seq), len(records[contig][1]))
+            deltas[contig][start] += 1
+            deltas[contig][end] -= 1
+            if reverse:
+                minus[contig] += 1
+            else:
+                plus[contig] += 1
+            assigned[contig] += 1
+            assigned_bases[contig] += len(seq)
+            gc[contig] += seq.count("G") + seq.count("C")
+
+        if sam is not None:
+            for mate, ((name, seq, qual), hit) in enumerate(zip(pair, hits)):
+                flag = 0x1 | (0x40 if mate == 0 else 0x80)
+                qname = name.split()[0].rsplit("/", 1)[0]
+                if hit is None:
+                    flag |= 0x4
+                    sam.write(f"{qname}\t{flag}\t*\t0\t0\t*\t*\t0\t0\t{seq}\t{qual}\n")
+                    continue
+                contig, start, reverse = hit
+                if reverse:
+                    flag |= 0x10
+                    seq, qual = reverse_complement(seq), qual[::-1]
+                sam.write(f"{qname}\t{flag}\t{records[contig][0]}\t{start + 1}\t60\t{len(seq)}M\t*\t0\t0\t{seq}\t{qual}\n")
+        target = mapped_out if any(hit is not None for hit in hits) else unmapped_out
+        if target is not None:
+            write_record(target, pair[0])
+            write_record(target, pair[1])
+    close(handle)
+    for out in (sam, mapped_out, unmapped_out):
+        if out is not None:
+            close(out)
+
+    # Coverage tables
+    coverage = []
+    for delta in deltas:
+        depth = 0
+        depths = []
+        for change in delta[:-1]:
+            depth += change
+            depths.append(depth)
+        coverage.append(depths)
+
+    if "basecov" in values:
+        with open_out(values["basecov"]) as file:
+            file.write("#RefName\tPos\tCoverage\n")
+            for (name, seq), depths in zip(records, coverage):
+                file.writelines(f"{name}\t{pos}\t{depth}\n" for pos, depth in enumerate(depths))
+
+    if "covstats" in values:
+        with open_out(values["covstats"]) as file:
+            file.write("#ID\tAvg_fold\tLength\tRef_GC\tCovered_percent\tCovered_bases\tPlus_reads\tMinus_reads\tRead_GC\tMedian_fold\tStd_Dev\n")
+            for i, ((name, seq), depths) in enumerate(zip(records, coverage)):
+                length = len(depths) or 1
+                mean = sum(depths) / length
+                covered = sum(1 for depth in depths if depth > 0)
+                ordered = sorted(depths)
+                median = ordered[len(ordered) // 2] if ordered else 0
+                std = (sum((depth - mean) ** 2 for depth in depths) / length) ** 0.5
+                ref_gc = (seq.count("G") + seq.count("C")) / max(len(seq), 1)
+                read_gc = gc[i] / assigned_bases[i] if assigned_bases[i] else 0
+                file.write(f"{name}\t{mean:.4f}\t{len(seq)}\t{ref_gc:.4f}\t{100 * covered / length:.4f}\t{covered}\t"
+                           f"{plus[i]}\t{minus[i]}\t{read_gc:.4f}\t{median}\t{std:.2f}\n")
+
+    if "scafstats" in values:
+        with open_out(values["scafstats"]) as file:
+            file.write("#name\t%unambiguousReads\tunambiguousMB\t%ambiguousReads\tambiguousMB\tunambiguousReads\tambiguousReads\tassignedReads\tassignedBases\n")
+            for i, (name, seq) in enumerate(records):
+                percent = 100 * assigned[i] / total if total else 0
+                file.write(f"{name}\t{percent:.5f}\t{assigned_bases[i] / 1e6:.5f}\t0.00000\t0.00000\t"
+                           f"{assigned[i]}\t0\t{assigned[i]}\t{assigned_bases[i]}\n")
+
+## Assembly and QC
+
+def spades(values, flags):
+    # Catalogue sequences with enough reads come out whole, thinly covered ones as fragments
+    outdir = option(flags, "-o")
+    reads = option(flags, "--12")
+    os.makedirs(outdir, exist_ok=True)
+    catalogue = read_fasta(os.environ[catalogue_env])
+    index = KmerIndex(catalogue)
+    rng = seeded(os.path.basename(reads), os.path.getsize(reads))
+
+    bases = [0] * len(catalogue)
+    with open_in(reads) as handle:
+        for first, second in pairs(handle):
+            hit = index.locate(first[1])
+            if hit is not None:
+                bases[hit[0]] += len(first[1]) + len(second[1])
+
+    contigs = []
+    for (name, seq), count in zip(catalogue, bases):
+        if not count:
+            continue
+        depth = count / len(seq)
+        if depth >= 5:
+            contigs.append((seq, depth))
+            continue
+        for _ in range(min(10, int(depth * 10) + 1)):
+            size = rng.randint(300, 3000)
+            start = rng.randint(0, max(0, len(seq) - size))
+            contigs.append((seq[start:start + size], depth))
+
+    # Short low coverage contigs every assembly has
+    for _ in range(3):
+        contigs.append(("".join(rng.choices("ACGT", k=rng.randint(150, 900))), rng.uniform(1, 4)))
+
+    contigs.sort(key=lambda contig: -len(contig[0]))
+    records = [(f"NODE_{i + 1}_length_{len(seq)}_cov_{depth:.6f}", seq) for i, (seq, depth) in enumerate(contigs)]
+    write_fasta(os.path.join(outdir, "contigs.fasta"), records)
+    write_fasta(os.path.join(outdir, "scaffolds.fasta"), records)
+    with open(os.path.join(outdir, "spades.log"), 'w') as file:
+        file.write(f"stub assembly of {reads}: {len(records)} contigs\n")
+
+def checkv_grade(length):
+    # Quality is set by contig length, contigs over 30 kb are reported complete
+    if length >= 30000:
+        return "Complete"
+    if length >= 10000:
+        return "Medium-quality"
+    if length >= 5000:
+        return "Low-quality"
+    return "Not-determined"
+
+def write_checkv(outdir, contigs):
+    # CheckV end_to_end tables for (name, length, quality) contigs
+    quality = ["contig_id", "contig_length", "provirus", "proviral_length", "gene_count", "viral_genes",
+               "host_genes", "checkv_quality", "miuvig_quality", "completeness", "completeness_method",
+               "contamination", "kmer_freq", "warnings"]
+    completeness = ["contig_id", "contig_length", "proviral_length", "aai_expected_length", "aai_completeness",
+                    "aai_confidence", "aai_error", "aai_num_hits", "aai_top_hit", "aai_id", "aai_af",
+                    "hmm_completeness_lower", "hmm_completeness_upper", "hmm_num_hits"]
+    contamination = ["contig_id", "contig_length", "total_genes", "viral_genes", "host_genes", "provirus",
+                     "proviral_length", "host_length", "region_types", "region_lengths", "region_coords_bp",
+                     "region_coords_genes"]
+    complete = ["contig_id", "contig_length", "kmer_freq", "prediction_type", "confidence_level",
+                "confidence_reason", "repeat_length", "repeat_count"]
+    tables = {"quality_summary.tsv": [quality], "completeness.tsv": [completeness],
+              "contamination.tsv": [contamination], "complete_genomes.tsv": [complete]}
+
+    os.makedirs(outdir, exist_ok=True)
+    for name, length, grade in contigs:
+        genes = max(1, length // 1000)
+        viral = max(1, int(genes * 0.6))
+        if grade == "Complete":
+            miuvig, percent = "High-quality", 100.0
+            tables["complete_genomes.tsv"].append([name, length, 1.0, "DTR", "high", "AAI-based (high)", 55, 1])
+        elif grade == "High-quality":
+            miuvig, percent = "High-quality", 95.0
+        elif grade == "Not-determined":
+            miuvig, percent = "Genome-fragment", "NA"
+        else:
+            miuvig, percent = "Genome-fragment", round(min(100.0, 100 * length / 40000), 2)
+        method = "AAI-based (high-confidence)" if percent != "NA" else "NA"
+        warning = "" if percent != "NA" else "no viral genes detected"
+        tables["quality_summary.tsv"].append([name, length, "No", "NA", genes, viral, 0, grade, miuvig,
+                                              percent, method, 0.0, 1.0, warning])
+        tables["completeness.tsv"].append([name, length, "NA", 40000, percent, "high", 5.0, 10,
+                                           "DTR_000001", 95.5, 90.1, "NA", "NA", "NA"])
+        tables["contamination.tsv"].append([name, length, genes, viral, 0, "No", "NA", "NA",
+                                            "viral", length, f"1-{length}", f"1-{genes}"])
+
+    for filename, rows in tables.items():
+        with open(os.path.join(outdir, filename), 'w') as file:
+            file.writelines("\t".join(str(value) for value in row) + "\n" for row in rows)
+
+def checkv(values, flags):
+    infile, outdir = flags[1], flags[2]
+    records = read_fasta(infile)
+    write_checkv(outdir, [(name, len(seq), checkv_grade(len(seq))) for name, seq in records])
+
+def fastqc(values, flags):
+    outdir = option(flags, "-o")
+    reads = flags[0]
+    name = os.path.basename(reads)
+    for ext in (".fastq.gz", ".fq.gz", ".fastq", ".fq"):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+            break
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(outdir, f"{name}_fastqc.html"), 'w') as file:
+        file.write(f"<html><body>stub report for {reads}</body></html>\n")
+    with zipfile.ZipFile(os.path.join(outdir, f"{name}_fastqc.zip"), 'w') as archive:
+        archive.writestr(f"{name}_fastqc/summary.txt", f"PASS\tBasic Statistics\t{name}\n")
+
+# Tool names as called by functions.py
+tools = {
+    "bbduk.sh": bbduk,
+    "dedupe.sh": dedupe,
+    "bbnorm.sh": copy_reads,
+    "bbmerge.sh": copy_reads,
+    "reformat.sh": reformat,
+    "bbmap.sh": bbmap,
+    "spades.py": spades,
+    "checkv": checkv,
+    "fastqc": fastqc,
+}
+
+def main(argv):
+    tool = argv[0]
+    values, flags = parse(argv[1:])
+    tools[tool](values, flags)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
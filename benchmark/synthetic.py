@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Synthetic phage genomes and paired reads for the offline pipeline benchmark
+
+import os
+import gzip
+import random
+
+complement = str.maketrans("ACGT", "TGCA")
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class Sample(object):
+    def __init__(self, name, phages, read_1, read_2, pairs):
+        self.name = name;
+        self.phages = phages;
+        self.read_1 = read_1;
+        self.read_2 = read_2;
+        self.pairs = pairs;
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def random_genome(rng, length, gc=0.35):
+    # Phage genomes are AT rich, bases are drawn with the given GC content
+    at = (1 - gc) / 2
+    weights = [at, gc / 2, gc / 2, at]
+    return "".join(rng.choices("ACGT", weights=weights, k=length))
+
+def reverse_complement(seq):
+    return seq.translate(complement)[::-1]
+
+def write_fasta(path, records, width=70):
+    with open(path, 'w') as file:
+        for name, seq in records:
+            file.write(f">{name}\n")
+            for i in range(0, len(seq), width):
+                file.write(seq[i:i + width] + "\n")
+
+def read_pairs(rng, genome, count, read_length=150, insert=350, spread=30):
+    # Error free pairs from both strands, yields (read_1, read_2) sequences
+    for _ in range(count):
+        size = max(read_length, min(len(genome), int(rng.gauss(insert, spread))))
+        start = rng.randint(0, len(genome) - size)
+        fragment = genome[start:start + size]
+        if rng.random() < 0.5:
+            fragment = reverse_complement(fragment)
+        yield fragment[:read_length], reverse_complement(fragment)[:read_length]
+
+def write_sample(rng, name, sources, outdir, read_length=150, compresslevel=1):
+    # sources are (genome, pairs), the reads are shuffled together into _R1 / _R2 files
+    reads = []
+    for genome, count in sources:
+        reads.extend(read_pairs(rng, genome, count, read_length))
+    rng.shuffle(reads)
+
+    read_1 = os.path.join(outdir, f"{name}_R1.fastq.gz")
+    read_2 = os.path.join(outdir, f"{name}_R2.fastq.gz")
+    quality = "F" * read_length
+    with gzip.open(read_1, 'wt', compresslevel=compresslevel) as out_1, \
+         gzip.open(read_2, 'wt', compresslevel=compresslevel) as out_2:
+        for i, (seq_1, seq_2) in enumerate(reads):
+            out_1.write(f"@{name}:{i} 1:N:0:1\n{seq_1}\n+\n{quality}\n")
+            out_2.write(f"@{name}:{i} 2:N:0:1\n{seq_2}\n+\n{quality}\n")
+    return read_1, read_2, len(reads)
+
+def pairs_for_depth(length, depth, read_length=150):
+    return max(1, int(length * depth / (2 * read_length)))
+
+def generate(outdir, samples=4, depth=150, genome_length=45000, host_length=200000,
+             contaminated=0.25, host_fraction=0.03, read_length=150, seed=1):
+    # Writes reads for each sample, the host genome and a catalogue of every sequence to outdir.
+    # Returns (samples, host_path, catalogue_path)
+    rng = random.Random(seed)
+    input_dir = os.path.join(outdir, "input")
+    os.makedirs(input_dir, exist_ok=True)
+
+    host = random_genome(rng, host_length, gc=0.5)
+    host_path = os.path.join(input_dir, "host_genome.fasta")
+    write_fasta(host_path, [("host_chromosome", host)])
+    catalogue = [("host_chromosome", host)]
+
+    # Some samples carry a second phage, which the coordinator reports as contaminated
+    result = []
+    second = int(round(samples * contaminated))
+    for i in range(samples):
+        name = f"sample{i + 1:03d}"
+        phages = []
+        sources = []
+        for j in range(2 if i < second else 1):
+            length = int(genome_length * rng.uniform(0.85, 1.15))
+            genome = random_genome(rng, length)
+            phages.append(f"{name}_phage{j + 1}")
+            catalogue.append((phages[-1], genome))
+            sources.append((genome, pairs_for_depth(length, depth, read_length)))
+        phage_pairs = sum(count for genome, count in sources)
+        sources.append((host, max(1, int(phage_pairs * host_fraction))))
+        read_1, read_2, pairs = write_sample(rng, name, sources, input_dir, read_length)
+        result.append(Sample(name, phages, read_1, read_2, pairs))
+
+    catalogue_path = os.path.join(outdir, "catalogue.fasta")
+    write_fasta(catalogue_path, catalogue)
+    return result, host_path, catalogue_path
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Batch barcoding, tags every genome and writes the barcoded files and index in one pass
+
+import os
+import random
+import hashlib
+
+characters = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class BarcodeBatch(object):
+    def __init__(self, prefix, length, deterministic=False):
+        self.prefix = prefix
+        self.length = length
+        self.deterministic = deterministic
+        self.tags = set()
+        self.random = random.SystemRandom()
+
+    def tag(self, sequence=None):
+        # Deterministic tags come from the sequence hash, so a rerun gives every genome the same tag
+        attempt = 0
+        while True:
+            if self.deterministic and sequence is not None:
+                code = hash_code(sequence, self.length, attempt)
+                attempt += 1
+            else:
+                code = "".join(self.random.choices(characters, k=self.length))
+            tag = f"{self.prefix}_{code}"
+            if tag not in self.tags:
+                self.tags.add(tag)
+                return tag
+
+    def run(self, files, outdir, index):
+        # Returns [(file, tag)] for every genome written, errors are returned as [(file, message)]
+        os.makedirs(outdir, exist_ok=True)
+        tagged = []
+        errors = []
+        for path in sorted(files):
+            name = os.path.basename(path)
+            # An unreadable, malformed or unwritable genome is reported and the rest of the batch carries on
+            try:
+                sequence = read_single(path)
+                tag = self.tag(sequence)
+                write_fasta(os.path.join(outdir, f"{tag}.fasta"), tag, sequence)
+            except (ValueError, OSError) as e:
+                errors.append((name, str(e)))
+                continue
+            tagged.append((name, tag))
+
+        # Index written once, replacing the index from an earlier run
+        lines = ["sample,phage_ID\n"] + [f"{name},{tag}.fasta\n" for name, tag in tagged]
+        with open(index, 'w', newline='') as csvfile:
+            csvfile.writelines(lines)
+        return tagged, errors
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def hash_code(sequence, length, attempt=0):
+    # Base 36 digits of the sequence SHA-256, attempt salts the hash after a collision
+    digest = hashlib.sha256(sequence + b"\0" + str(attempt).encode()).digest()
+    number = int.from_bytes(digest, 'big')
+    code = []
+    for _ in range(length):
+        number, digit = divmod(number, len(characters))
+        code.append(characters[digit])
+    return "".join(code)
+
+def read_single(path):
+    # Sequence of a FASTA holding exactly one record
+    with open(path, 'rb') as file:
+        data = file.read()
+    records = data.count(b"\n>") + (1 if data.startswith(b">") else 0)
+    if records == 0:
+        raise ValueError("No records found in handle")
+    if records > 1:
+        raise ValueError("More than one record found in handle")
+    lines = data.split(b"\n")[1:]
+    return b"".join(line.strip() for line in lines)
+
+def write_fasta(path, title, sequence, width=60):
+    lines = [f">{title}\n".encode()]
+    lines.extend(sequence[i:i + width] + b"\n" for i in range(0, len(sequence), width))
+    with open(path, 'wb') as file:
+        file.writelines(lines)
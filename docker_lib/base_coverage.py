@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+
+# Per base coverage analysis on numpy arrays, with a binary store replacing bbmap basecov text
+
+import os
+import numpy as np
+
+# Binary store, coverage values as little endian uint32 with a <store>.idx table of contig offsets
+store_name = "basecov.bin"
+store_dtype = np.dtype('<u4')
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class IndexEntry(object):
+    def __init__(self, name, offset, length, start):
+        self.name = name;
+        self.offset = offset;
+        self.length = length;
+        self.start = start;
+
+class CoverageStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.entries = {entry.name: entry for entry in read_index(f"{path}.idx")}
+        if os.path.getsize(path) == 0:
+            self.data = np.zeros(0, dtype=store_dtype)
+        else:
+            self.data = np.memmap(path, dtype=store_dtype, mode='r')
+
+    def __contains__(self, contig):
+        return contig in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def names(self):
+        return list(self.entries)
+
+    def length(self, contig):
+        return self.entries[contig].length
+
+    def values(self, contig, start=None, end=None):
+        # Coverage slice by position, a view onto the mapped file
+        entry = self.entries[contig]
+        start = entry.start if start is None else max(start, entry.start)
+        end = entry.start + entry.length if end is None else min(end, entry.start + entry.length)
+        offset = entry.offset + start - entry.start
+        return self.data[offset:offset + max(end - start, 0)]
+
+    def contig(self, contig):
+        # Positions and coverage for one contig
+        entry = self.entries[contig]
+        positions = np.arange(entry.start, entry.start + entry.length, dtype=np.uint32)
+        return positions, self.values(contig)
+
+    def runs(self, chunk_values=1 << 20):
+        # Same (contig, first position, coverage) stream as read_runs, in slices of the mapped file
+        for entry in self.entries.values():
+            for i in range(0, entry.length, chunk_values):
+                yield entry.name, entry.start + i, self.data[entry.offset + i:entry.offset + min(i + chunk_values, entry.length)]
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def read_runs(basecov, chunk_bytes=4 << 20):
+    # Yields (contig, first position, coverage array) for each stretch of consecutive positions,
+    # parsing the text in fixed size chunks so memory does not grow with the file
+    with open(basecov, 'rb') as file:
+        remainder = b""
+        header = True
+        while True:
+            block = file.read(chunk_bytes)
+            data = remainder + block
+            if not block:
+                if data and not data.endswith(b"\n"):
+                    data += b"\n"
+                remainder = b""
+            else:
+                cut = data.rfind(b"\n") + 1
+                data, remainder = data[:cut], data[cut:]
+
+            # Comment lines only appear at the top of the file
+            while header and data:
+                if not data.startswith(b"#"):
+                    header = False
+                    break
+                cut = data.find(b"\n") + 1
+                if cut == 0:
+                    break
+                data = data[cut:]
+
+            if data:
+                yield from _parse_block(data)
+            if not block:
+                return
+
+def _parse_block(data):
+    # Only the first ID of each run is decoded, position and coverage are parsed as integers
+    arr = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(arr == 10)
+    starts = np.concatenate([[0], newlines[:-1] + 1])
+    keep = newlines > starts
+    newlines = newlines[keep]
+    starts = starts[keep]
+    tabs = np.flatnonzero(arr == 9)
+    if len(tabs) != 2 * len(newlines):
+        raise ValueError("basecov lines must have three tab separated columns")
+    tabs = tabs.reshape(-1, 2)
+
+    ends = newlines - (arr[newlines - 1] == 13)
+    positions = _parse_ints(arr, tabs[:, 0] + 1, tabs[:, 1]).astype(np.int64)
+    coverage = _parse_ints(arr, tabs[:, 1] + 1, ends)
+
+    # A new run starts wherever the position does not follow on from the line before
+    breaks = np.flatnonzero(positions[1:] != positions[:-1] + 1) + 1
+    bounds = np.concatenate([[0], breaks, [len(positions)]])
+    for i in range(len(bounds) - 1):
+        first, last = bounds[i], bounds[i + 1]
+        name = data[starts[first]:tabs[first, 0]].decode()
+        yield name, int(positions[first]), coverage[first:last].astype(store_dtype)
+
+def _parse_ints(arr, starts, ends):
+    # Decimal fields between starts and ends, converted without a python loop per line
+    lengths = ends - starts
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    if np.any(lengths <= 0):
+        raise ValueError("basecov position and coverage columns must be integers")
+    total = int(lengths.sum())
+    field = np.repeat(np.arange(len(starts)), lengths)
+    index = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[field]
+    digits = arr[index].astype(np.uint64) - 48
+    if np.any(digits > 9):
+        raise ValueError("basecov position and coverage columns must be integers")
+    power = (ends[field] - 1 - index).astype(np.uint64)
+    return np.add.reduceat(digits * np.uint64(10) ** power, np.cumsum(lengths) - lengths)
+
+def convert(basecov, path, chunk_bytes=4 << 20):
+    # Writes basecov text as a binary store at path plus a <path>.idx offset table
+    entries = []
+    seen = set()
+    offset = 0
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as file:
+        for name, start, values in read_runs(basecov, chunk_bytes):
+            entry = entries[-1] if entries else None
+            if entry is not None and entry.name == name and start >= entry.start + entry.length:
+                # Gaps within a contig are stored as zero coverage
+                gap = start - entry.start - entry.length
+                if gap:
+                    file.write(np.zeros(gap, dtype=store_dtype).tobytes())
+                entry.length += gap + len(values)
+            elif name in seen:
+                raise ValueError(f"{basecov}: positions for {name} are not in order")
+            else:
+                seen.add(name)
+                entry = IndexEntry(name, offset, len(values), start)
+                entries.append(entry)
+            file.write(values.tobytes())
+            offset = entry.offset + entry.length
+    write_index(entries, f"{path}.idx")
+    os.replace(tmp, path)
+    return path
+
+def write_index(entries, index_path):
+    with open(index_path, 'w') as file:
+        for entry in entries:
+            file.write(f"{entry.name}\t{entry.offset}\t{entry.length}\t{entry.start}\n")
+
+def read_index(index_path):
+    entries = []
+    with open(index_path) as file:
+        for line in file:
+            name, offset, length, start = line.rstrip('\n').split('\t')[:4]
+            entries.append(IndexEntry(name, int(offset), int(length), int(start)))
+    return entries
+
+def load_contig(path, contig):
+    # Positions and coverage for one contig, from a binary store or basecov text
+    if path.endswith(".bin"):
+        return CoverageStore(path).contig(contig)
+    positions = []
+    values = []
+    for name, start, run in read_runs(path):
+        if name == contig:
+            positions.append(np.arange(start, start + len(run), dtype=np.uint32))
+            values.append(run)
+    if not values:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=store_dtype)
+    return np.concatenate(positions), np.concatenate(values)
+
+def read_coverage(path, chunk_bytes=4 << 20):
+    # Coverage runs from a binary store or basecov text, memory is bounded by the chunk size
+    if path.endswith(".bin"):
+        return CoverageStore(path).runs(chunk_bytes // store_dtype.itemsize)
+    return read_runs(path, chunk_bytes)
+
+def windows(runs, window):
+    # Mean, minimum and zero coverage stretches per window, in one pass over the runs.
+    # Yields (contig, start, end, mean, min, zero bases, zero runs, longest zero run)
+    name = None
+    carry = np.zeros(0, dtype=store_dtype)
+    start = 0
+    expected = 0
+    for contig, first, values in runs:
+        if contig != name:
+            if len(carry):
+                yield from _window_rows(name, start, carry.reshape(1, -1))
+            name = contig
+            carry = np.zeros(0, dtype=store_dtype)
+            start = expected = first
+        end = first + len(values)
+        if first > expected:
+            # Positions missing from basecov have no coverage
+            values = np.concatenate([np.zeros(first - expected, dtype=store_dtype), values])
+        expected = end
+        values = np.concatenate([carry, values]) if len(carry) else np.asarray(values)
+
+        full = len(values) // window * window
+        if full:
+            yield from _window_rows(name, start, values[:full].reshape(-1, window))
+            start += full
+        carry = values[full:]
+    if len(carry):
+        yield from _window_rows(name, start, carry.reshape(1, -1))
+
+def _window_rows(contig, start, blocks):
+    count, width = blocks.shape
+    means = blocks.mean(axis=1, dtype=np.float64)
+    mins = blocks.min(axis=1)
+    zero = blocks == 0
+    zero_bases = np.count_nonzero(zero, axis=1)
+
+    # Zero stretches found on the flattened windows, a False column keeps them from joining rows
+    padded = np.zeros((count, width + 1), dtype=np.int8)
+    padded[:, :width] = zero
+    edges = np.diff(np.concatenate([[0], padded.ravel()]))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    rows = run_starts // (width + 1)
+    zero_runs = np.bincount(rows, minlength=count)
+    longest = np.zeros(count, dtype=np.int64)
+    np.maximum.at(longest, rows, run_ends - run_starts)
+
+    for i in range(count):
+        first = start + i * width
+        yield (contig, first, first + width, float(means[i]), int(mins[i]),
+               int(zero_bases[i]), int(zero_runs[i]), int(longest[i]))
+
+def write_windows(path, rows):
+    # Tab separated window table, returns per contig totals for a summary
+    totals = {}
+    with open(path, 'w') as file:
+        file.write("#contig\tstart\tend\tmean\tmin\tzero_bases\tzero_runs\tlongest_zero_run\n")
+        for contig, start, end, mean, low, zero_bases, zero_runs, longest in rows:
+            file.write(f"{contig}\t{start}\t{end}\t{mean:.2f}\t{low}\t{zero_bases}\t{zero_runs}\t{longest}\n")
+            total = totals.setdefault(contig, {"bases": 0, "depth": 0.0, "zero_bases": 0, "zero_windows": 0, "lowest_window_mean": None})
+            total["bases"] += end - start
+            total["depth"] += mean * (end - start)
+            total["zero_bases"] += zero_bases
+            total["zero_windows"] += zero_bases == end - start
+            if total["lowest_window_mean"] is None or mean < total["lowest_window_mean"]:
+                total["lowest_window_mean"] = mean
+    return totals
+
+def below_cutoff(values, cutoff):
+    # Number of bases with coverage under cutoff
+    return int(np.count_nonzero(values < cutoff))
+
+def downsample(x, y, bins):
+    # Keeps the min and max of each bin in position order, so spikes and dips survive the reduction
+    n = len(y)
+    if bins <= 0 or n <= 2 * bins:
+        return x, y
+    size = -(-n // bins)
+    bins = -(-n // size)
+    padded = np.empty(bins * size, dtype=y.dtype)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    blocks = padded.reshape(bins, size)
+
+    starts = np.arange(bins) * size
+    lows = starts + blocks.argmin(axis=1)
+    highs = starts + blocks.argmax(axis=1)
+    index = np.minimum(np.sort(np.concatenate([lows, highs])), n - 1)
+    index = index[np.concatenate([[True], index[1:] != index[:-1]])]
+    return x[index], y[index]
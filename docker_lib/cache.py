@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+# Content addressed cache for tool outputs, keyed on input file contents and the command line
+
+import os
+import json
+import time
+import fcntl
+import contextlib
+import shutil
+import hashlib
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class StageCache(object):
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects = os.path.join(root, "objects")
+        self.digests = os.path.join(root, "digests")
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.digests, exist_ok=True)
+
+    def key(self, command, inputs, outputs, params=None):
+        # Paths are replaced by placeholders so the same reads under another sample name still match
+        tokens = []
+        for token in command:
+            token = str(token)
+            for i, path in enumerate(inputs):
+                token = token.replace(str(path), f"<in{i}>")
+            for i, path in enumerate(outputs):
+                token = token.replace(str(path), f"<out{i}>")
+            tokens.append(token)
+        digests = [self.file_digest(path) for path in inputs]
+        key = json.dumps([tokens, digests, params], sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def file_digest(self, path):
+        # Digests are remembered per path, size, mtime and inode so large reads are hashed once
+        stat = os.stat(path)
+        ident = f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}:{stat.st_ino}"
+        memo = os.path.join(self.digests, hashlib.sha256(ident.encode()).hexdigest())
+        try:
+            with open(memo) as file:
+                return file.read().strip()
+        except OSError:
+            pass
+        digest = hash_path(path)
+        _write_atomic(memo, digest)
+        return digest
+
+    def object_path(self, key):
+        return os.path.join(self.objects, key[:2], key)
+
+    @contextlib.contextmanager
+    def lock(self, mode):
+        # Restores hold the lock shared and eviction exclusive, so no entry is removed while it is linked out
+        with open(os.path.join(self.root, ".lock"), "a") as lock:
+            fcntl.flock(lock, mode)
+            yield
+
+    def restore(self, key, outputs):
+        obj = self.object_path(key)
+        with self.lock(fcntl.LOCK_SH):
+            if not os.path.exists(os.path.join(obj, "size")):
+                return False
+            for i, path in enumerate(outputs):
+                if not os.path.exists(os.path.join(obj, str(i))):
+                    return False
+            try:
+                for i, path in enumerate(outputs):
+                    remove_path(path)
+                    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                    _link_tree(os.path.join(obj, str(i)), path)
+                os.utime(os.path.join(obj, "size"))
+            except OSError:
+                for path in outputs:
+                    remove_path(path)
+                return False
+        return True
+
+    def store(self, key, outputs):
+        obj = self.object_path(key)
+        if os.path.exists(obj):
+            return
+        tmp = f"{obj}.tmp.{os.getpid()}"
+        remove_path(tmp)
+        os.makedirs(tmp)
+        try:
+            for i, path in enumerate(outputs):
+                _link_tree(path, os.path.join(tmp, str(i)))
+            with open(os.path.join(tmp, "size"), "w") as file:
+                file.write(str(_tree_size(tmp)))
+            os.rename(tmp, obj)
+        except OSError:
+            remove_path(tmp)
+            return
+        self.evict()
+
+    def evict(self):
+        # Least recently used objects are removed until the cache fits, the size file mtime is the last use
+        with self.lock(fcntl.LOCK_EX):
+            entries = []
+            total = 0
+            for prefix in os.listdir(self.objects):
+                for key in os.listdir(os.path.join(self.objects, prefix)):
+                    size_file = os.path.join(self.objects, prefix, key, "size")
+                    try:
+                        with open(size_file) as file:
+                            size = int(file.read())
+                        used = os.stat(size_file).st_mtime
+                    except (OSError, ValueError):
+                        continue
+                    entries.append((used, size, os.path.join(self.objects, prefix, key)))
+                    total += size
+            entries.sort()
+            for used, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                remove_path(path)
+                total -= size
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def hash_path(path, chunk_size=4 * 1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _link_tree(source, destination):
+    # Hard links where possible, copies across filesystems
+    if os.path.isdir(source):
+        os.makedirs(destination, exist_ok=True)
+        for entry in os.listdir(source):
+            _link_tree(os.path.join(source, entry), os.path.join(destination, entry))
+        return
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+def _write_atomic(path, text):
+    tmp = f"{path}.tmp.{os.getpid()}.{time.monotonic_ns()}"
+    with open(tmp, "w") as file:
+        file.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# CheckV output reader, the summary tables are read once into one record per contig
+
+import os
+import csv
+
+# CheckV output tables, in the order they are merged
+tables = {
+    "quality": "quality_summary.tsv",
+    "complete": "complete_genomes.tsv",
+    "completeness": "completeness.tsv",
+    "contamination": "contamination.tsv",
+}
+
+# Columns that are matched between tables rather than merged
+keys = ("contig_id", "contig_length")
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class CheckVRecord(object):
+    def __init__(self, contig_id):
+        self.contig_id = contig_id;
+        self.contig_length = None;
+        self.checkv_quality = None;
+        self.completeness = None;
+        self.contamination = None;
+        self.provirus = None;
+        self.complete = False;
+        self.fields = {};
+
+    @property
+    def high_quality(self):
+        return self.checkv_quality == 'High-quality'
+
+class CheckVResults(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.records = {}
+        self.complete_order = []
+        self.quality_order = []
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, contig_id):
+        return contig_id in self.records
+
+    def __getitem__(self, contig_id):
+        return self.records[contig_id]
+
+    def record(self, contig_id):
+        if contig_id not in self.records:
+            self.records[contig_id] = CheckVRecord(contig_id)
+        return self.records[contig_id]
+
+    def complete_genomes(self):
+        return tuple(self.complete_order)
+
+    def hq_genomes(self):
+        return tuple(contig for contig in self.quality_order if self.records[contig].high_quality)
+
+    def selected(self):
+        # Complete then high-quality contigs, each contig listed once
+        selected = []
+        seen = set()
+        for contig in self.complete_genomes() + self.hq_genomes():
+            if contig not in seen:
+                seen.add(contig)
+                selected.append(contig)
+        return selected
+
+    def rows(self, sample=None, drop=()):
+        # Quality, completeness and contamination columns per contig, found in all three tables
+        rows = []
+        for contig in self.quality_order:
+            record = self.records[contig]
+            if not all(name in record.fields for name in ("quality", "completeness", "contamination")):
+                continue
+            row = {}
+            if sample is not None:
+                row['sample'] = sample
+            row['contig_id'] = record.contig_id
+            row['contig_length'] = record.contig_length
+            _merge(row, {k: v for k, v in record.fields["quality"].items() if k not in drop})
+            _merge(row, record.fields["completeness"])
+            _merge(row, record.fields["contamination"])
+            rows.append(row)
+        return rows
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def load(directory):
+    # Reads each CheckV table once, missing tables are skipped
+    results = CheckVResults(directory)
+    for table, filename in tables.items():
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='') as tsvfile:
+            reader = csv.reader(tsvfile, delimiter='\t')
+            header = next(reader, None)
+            if header is None:
+                continue
+            for row in reader:
+                if not row:
+                    continue
+                values = dict(zip(header, (_value(value) for value in row)))
+                contig = row[0]
+                record = results.record(contig)
+                if record.contig_length is None:
+                    record.contig_length = values.get('contig_length')
+
+                if table == "quality":
+                    if table not in record.fields:
+                        results.quality_order.append(contig)
+                    record.checkv_quality = values.get('checkv_quality')
+                    record.completeness = values.get('completeness')
+                    record.contamination = values.get('contamination')
+                    record.provirus = values.get('provirus') == 'Yes'
+                elif table == "complete":
+                    if not record.complete:
+                        results.complete_order.append(contig)
+                    record.complete = True
+
+                # Later rows for the same contig do not replace the first
+                if table not in record.fields:
+                    record.fields[table] = {k: v for k, v in values.items() if k not in keys}
+    return results
+
+def _merge(row, fields):
+    # Columns already present are suffixed _x / _y, matching a pandas merge
+    for key, value in fields.items():
+        if key in row:
+            row[f"{key}_x"] = row.pop(key)
+            row[f"{key}_y"] = value
+        else:
+            row[key] = value
+
+def _value(value):
+    if value in ('', 'NA'):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
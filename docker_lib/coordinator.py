@@ -7,22 +7,25 @@ import sys
 import datetime
 import subprocess
 import configparser
-from Bio import SeqIO
 import csv
 import functions as ji
+import scheduler
+import stages
+import mapstats
+import metrics
 
 # Reading inputs
-input = '/assemble/input'
-output = '/assemble/output'
-logs = "/assemble/output/phanatic_log.tsv"
+input = ji.input_dir
+output = ji.output_dir
+logs = ji.logs
 
 # Configuring pipeline
-config_file = "/assemble/output/config.ini"
+config_file = os.path.join(output, "config.ini")
 config = configparser.ConfigParser()
 if os.path.isfile(config_file):
     config.read(config_file)
 else:
-    config_file = "/assemble/config.ini"
+    config_file = os.path.join(ji.home, "config.ini")
     config.read(config_file)
 
 # Phanatic settings
@@ -34,6 +37,7 @@ try:
     enable_mapping = config.getboolean("pipeline", "mapping")
     enable_reassembly = config.getboolean("pipeline", "re_assembly")
     enable_phageterm = config.getboolean("pipeline", "identify_termini")
+    enable_streaming = config.getboolean("pipeline", "streaming", fallback=False)
 except ValueError:
     sys.exit("Config file incorrectly set, pipeline values must be booleans")
 
@@ -64,137 +68,231 @@ if enable_reassembly:
 if enable_qc:
     ji.logfile("pipeline options", "QC enabled", logs)
     qc_dir = os.path.join(output, "reads_quality")
-    os.makedirs(qc_dir)
+    os.makedirs(qc_dir, exist_ok=True)
 
 # Host mapping file
 enable_host_mapping = False
-host_mapping_file = "/assemble/output/host_mapping.csv"
+host_mapping_file = os.path.join(output, "host_mapping.csv")
 if os.path.exists(host_mapping_file):
     ji.logfile("pipeline options", "host mapping enabled", logs)
     host_mapping_dir = os.path.join(output, "mapping_QC_to_host")
     phage_host_mapping_dir = os.path.join(output, "mapping_phageQC_to_host")
     enable_host_mapping = True
 
-# Phanatic run 
-for pair in pairs:
-    
-    # Trimming reads
-    trim = ji.PE_trim(pair, trim_dir)
-    
-    # Removing duplicates
-    if ji.check_filepath(trim):
-        deduped = ji.remove_duplicate_reads(trim, dedupe_dir, pair.name)
+    # Read once here so every sample worker shares the table
+    ji.load_host_mapping(host_mapping_file)
+
+# Streaming only writes the deduplicated reads when a later stage maps them
+keep_deduped = enable_mapping or enable_reassembly or enable_host_mapping
+if enable_streaming:
+    ji.logfile("pipeline options", f"streaming trim / dedupe / normalise, deduped reads kept: {keep_deduped}", logs)
+
+# Summary files, created up front as samples append to them concurrently
+sample_file = os.path.join(output, 'sample_summary.csv')
+if not os.path.exists(sample_file):
+    ji.create_csv(sample_file, "sample,genomes,sample_status")
+
+contig_file = os.path.join(output, 'contig_summary.csv')
+if not os.path.exists(contig_file):
+    ji.create_csv(contig_file, "sample,contig_name,normalised_seq_depth,QC_seq_depth,phage_QC_mapped_(%),mapped_status")
+
+assembly_check_file = os.path.join(output, 'mapping_reassembly.csv')
+if not os.path.exists(assembly_check_file):
+    ji.create_csv(assembly_check_file, "sample,mapped_contig_size(1st),mapped_contig_count,unmapped_contig_count,mapped_contig_warning,unmapped_contig_warning,same_size_check")
+
+# Stage manifests for resuming interrupted runs
+checkpoint_dir = os.path.join(output, ".checkpoints")
+
+def section(name):
+    if config.has_section(name):
+        return dict(config[name])
+    return {}
+
+# Config that changes sample results. Workers, memory, logging and the cache are left out so they can be
+# tuned between runs without re-running finished samples
+result_sections = ["phanatic", "pipeline", "input", "trim", "dedupe", "merge", "normalise",
+                   "SPAdes", "filter", "barcoding", "coverage"]
+run_params = {name: section(name) for name in result_sections if config.has_section(name)}
+
+# Phanatic run
+def run_sample(pair):
+    graph = stages.StageGraph(pair.name, checkpoint_dir)
+    rows = {sample_file: [], contig_file: [], assembly_check_file: []}
+
+    def write_rows():
+        for filename, lines in rows.items():
+            ji.merge_csv_lines(filename, lines)
+        return rows
+
+    # Skipping samples finished by a previous run with the same reads and config
+    graph.add("complete", write_rows, inputs=[pair.read_1, pair.read_2], params=run_params,
+              outputs=lambda rows: list(rows))
+    if graph.current("complete"):
+        ji.logfile("Sample already complete", pair.name, logs)
+        return
+
+    # Rows from an earlier run with a different config are replaced
+    previous = graph.manifest("complete")
+    if previous is not None:
+        for filename, lines in previous["result"].items():
+            ji.remove_csv_lines(filename, lines)
+
+    # Tool resource metrics are recorded against the sample
+    with metrics.label(sample=pair.name):
+        if process_sample(pair, graph, rows):
+            graph.build("complete")
+
+    # Sample finish
+    ji.logfile("Sample run complete", pair.name, logs)
+
+def process_sample(pair, graph, rows):
+
+    # Read processing stages
+    if enable_streaming:
+        graph.add("reads", lambda: ji.stream_reads(pair, dedupe_dir, norm_dir, enable_normalise, keep_deduped),
+                  inputs=[pair.read_1, pair.read_2],
+                  params={"trim": section("trim"), "dedupe": section("dedupe"),
+                          "normalise": enable_normalise and section("normalise"), "deduped": keep_deduped})
+        dedupe_stage = reads_stage = "reads"
+        qc_reads = lambda: graph.results["reads"][0]
+        assembly_reads = lambda: graph.results["reads"][1]
     else:
-        continue
+        graph.add("trim", lambda: ji.PE_trim(pair, trim_dir),
+                  inputs=[pair.read_1, pair.read_2], params=section("trim"))
+        graph.add("dedupe", lambda: ji.remove_duplicate_reads(graph.results["trim"], dedupe_dir, pair.name),
+                  deps=["trim"], params=section("dedupe"))
+        if enable_normalise:
+            graph.add("normalise", lambda: ji.normalise_reads(graph.results["dedupe"], norm_dir, pair.name),
+                      deps=["dedupe"], params=section("normalise"))
+            reads_stage = "normalise"
+        else:
+            reads_stage = "dedupe"
+        dedupe_stage = "dedupe"
+        qc_reads = lambda: graph.results["dedupe"]
+        assembly_reads = lambda: graph.results[reads_stage]
+    graph.add("assembly", lambda: ji.PE_assembly(assembly_reads(), spades_dir, pair.name),
+              deps=[reads_stage], params=section("SPAdes"))
+    graph.add("filter", lambda: ji.format_genome(graph.results["assembly"], filtered_dir, pair.name, filter=enable_filter),
+              deps=["assembly"], params={"filter": enable_filter, **section("filter")})
+    graph.add("checkv", lambda: ji.checkv(graph.results["filter"], checkv_dir, pair.name),
+              deps=["filter"], params={"database": os.environ.get("CHECKVDB")})
+    if enable_mapping:
+        if enable_normalise:
+            graph.add("map_norm", lambda: ji.map_reads(graph.results["filter"], assembly_reads(), mapped2, pair.name),
+                      deps=["filter", reads_stage])
+
+    # Removing duplicates
+    if graph.build(dedupe_stage) is None:
+        return
+    deduped = qc_reads()
 
     # Removing trimmed reads
-    try:
-        os.remove(trim)
-    except Exception as e:
-        ji.logfile(f"Error: {trim} could not be removed", f"{e}", logs)
+    trim = graph.results.get("trim")
+    if trim is not None and os.path.exists(trim):
+        try:
+            os.remove(trim)
+        except Exception as e:
+            ji.logfile(f"Error: {trim} could not be removed", f"{e}", logs)
 
     # Normalising reads
-    if ji.check_filepath(deduped):
-        if enable_normalise:
-            normalised = ji.normalise_reads(deduped, norm_dir, pair.name)
-            assemble_reads = normalised
-        else:
-            assemble_reads = deduped
+    if deduped is None or ji.check_filepath(deduped):
+        graph.build(reads_stage)
+        assemble_reads = assembly_reads()
 
     # Assembly
-    if ji.check_filepath(assemble_reads):
-        assembly = ji.PE_assembly(assemble_reads, spades_dir, pair.name)
+    if assemble_reads is not None and ji.check_filepath(assemble_reads):
+        assembly = graph.build("assembly")
     else:
-        continue
+        return
+    if assembly is None:
+        return
     
     # Checking for empty assembly
     if os.path.getsize(assembly) == 0:
         ji.logfile("ERROR: contigs file empty", f"{pair.name}: check SPAdes log", logs)
-        continue
+        return
     
     # Filtering assembly
     if ji.check_filepath(assembly):
-        if enable_filter:
-            filtered = ji.format_genome(assembly, filtered_dir, pair.name, filter=True)
-        else:
-            filtered = ji.format_genome(assembly, filtered_dir, pair.name)
+        filtered = graph.build("filter")
     else:
-        continue
+        return
+    if filtered is None:
+        return
     
     # CheckV
     if os.path.getsize(filtered) == 0:
         ji.logfile("ERROR: Filtered contigs empty", f"{pair.name}: check contigs file", logs)
-        continue
+        return
     
     if ji.check_filepath(filtered):
-        checkv = ji.checkv(filtered, checkv_dir, pair.name)
+        checkv = graph.build("checkv")
     else:
-        continue
+        return
+    if checkv is None:
+        return
     
+    # Extractions
+    complete_genomes = os.path.join(checkv, "complete_genomes.tsv")
+    quality_summary = os.path.join(checkv, "quality_summary.tsv")
+    
+    if ji.check_filepath(complete_genomes) and ji.check_filepath(quality_summary):
+        headers = ji.find_genomes(checkv, pair.name)
+    else:
+        return
+
     # Mapping reads to phage contigs
     if enable_mapping:
         
-        # QC
+        # QC, one alignment also separates the reads of every candidate genome for reassembly
+        separate = headers if enable_reassembly else []
+        graph.add("map_qc", lambda: ji.map_reads(filtered, deduped, mapped, pair.name, separate=separate),
+                  deps=["filter", dedupe_stage], params={"separate": list(separate)})
         ji.logfile("QC read mapping to phage contigs", f"{pair.name}", logs)
-        ji.map_reads(filtered, deduped, mapped, pair.name)
+        graph.build("map_qc")
 
         # Normalised
         if enable_normalise:
             ji.logfile("Normalised / subsampled read mapping to phage contigs", f"{pair.name}", logs)
-            ji.map_reads(filtered, assemble_reads, mapped2, pair.name)
-    
-    # Extractions
-    complete_genomes = os.path.join(checkv, "complete_genomes.tsv")
-    quality_summary = os.path.join(checkv, "quality_summary.tsv")
+            graph.build("map_norm")
     
-    if ji.check_filepath(complete_genomes):
-        complete = ji.find_complete_genomes(complete_genomes, pair.name)
-    else:
-        continue
-    
-    if ji.check_filepath(quality_summary):
-        hq = ji.find_hq_genomes(quality_summary, pair.name)
-    else:
-        continue
-
-    headers = complete+hq
     ji.logfile("Expected genomes", f"{pair.name}: {len(headers)}", logs)
     
-    # Making summary file
-    sample_file = os.path.join(output, 'sample_summary.csv')
-    if not os.path.exists(sample_file):
-        ji.create_csv(sample_file, "sample,genomes,sample_status")
-    
+    # Recording sample status
     if len(headers) == 0:
         ji.logfile("Sample failed", pair.name, logs)
-        ji.append_csv(sample_file, f"{pair.name},{len(headers)},failed")
-        continue
+        rows[sample_file].append(f"{pair.name},{len(headers)},failed")
+        return True
     elif len(headers) == 1:
         ji.logfile("Clean sample", pair.name, logs)
-        ji.append_csv(sample_file, f"{pair.name},{len(headers)},clean")
+        rows[sample_file].append(f"{pair.name},{len(headers)},clean")
     elif len(headers) > 1:
         ji.logfile("Potential contamination", pair.name, logs)
-        ji.append_csv(sample_file, f"{pair.name},{len(headers)},contaminated")
+        rows[sample_file].append(f"{pair.name},{len(headers)},contaminated")
     
     # Making extraction dir
-    if not os.path.exists(extraction_dir):
-        os.makedirs(extraction_dir)
+    os.makedirs(extraction_dir, exist_ok=True)
+
+    # Mapping stats, read once per sample
+    norm_covstats = None
+    qc_covstats = None
+    qc_scafstats = None
+    if enable_mapping:
+        qc_covstats = mapstats.load_table(os.path.join(mapped, pair.name, 'covstats.tsv'))
+        qc_scafstats = mapstats.load_table(os.path.join(mapped, pair.name, 'scafstats.tsv'), keep="last")
+        if enable_normalise:
+            norm_covstats = mapstats.load_table(os.path.join(mapped2, pair.name, 'covstats.tsv'))
 
     # Looping through contigs
-    contig_file = os.path.join(output, 'contig_summary.csv')
-    if not os.path.exists(contig_file):
-        ji.create_csv(contig_file, "sample,contig_name,normalised_seq_depth,QC_seq_depth,phage_QC_mapped_(%),mapped_status")
-    genomes = []
+    passed = []
     for header in headers:
         ji.logfile("Coverage filtering", f"Scanning: {header}", logs)
         
         # Depth check (normalised reads)
-        covstat = os.path.join(mapped2, pair.name, 'covstats.tsv')
-        norm_depth, coverage_target = ji.covstat_filter(header, covstat)
+        norm_depth, coverage_target = ji.covstat_filter(header, norm_covstats)
 
         # Percentage mapping (QC reads)
-        scafstat = os.path.join(mapped, pair.name, 'scafstats.tsv')
-        perc_mapped, perc_target = ji.scafstat_filter(header, scafstat)
+        perc_mapped, perc_target = ji.scafstat_filter(header, qc_scafstats)
         
         # Assessing None values
         if norm_depth is None:
@@ -203,7 +301,7 @@ for pair in pairs:
             ji.logfile("Mapping percentage check failed", f"Check {header} QC mapping", logs)
 
         # Logging file data
-        if norm_depth >= coverage_target:
+        if norm_depth is not None and norm_depth >= coverage_target:
             cov_pass = "PASS"
             ji.logfile("Normalised depth check PASSED", header, logs)
         else:
@@ -211,7 +309,7 @@ for pair in pairs:
             ji.logfile("Normalised depth check: WARNING", header, logs)
 
         # Logging file data
-        if perc_mapped >= perc_target:
+        if perc_mapped is not None and perc_mapped >= perc_target:
             perc_pass = "PASS"
             ji.logfile("Percentage mapping check PASSED", header, logs)
         else:
@@ -219,22 +317,20 @@ for pair in pairs:
             ji.logfile("Percentage mapping check: FAILED", header, logs)
         
         # Depth check (QC reads)
-        covstat = os.path.join(mapped, pair.name, 'covstats.tsv')
-        qc_depth, coverage_target = ji.covstat_filter(header, covstat)
+        qc_depth, coverage_target = ji.covstat_filter(header, qc_covstats)
 
         # Recording data
-        ji.append_csv(contig_file, f"{pair.name},{header},{norm_depth},{qc_depth},{perc_mapped},{perc_pass}")
+        rows[contig_file].append(f"{pair.name},{header},{norm_depth},{qc_depth},{perc_mapped},{perc_pass}")
         
         # PASS / FAIL checkpoint for read mapping
         if perc_pass == 'FAIL':
             continue
         
-        # Genome extraction from filtered contigs
-        extraction = ji.extract_genome(filtered, 
-                                        header, 
-                                        extraction_dir, 
-                                        pair.name)
-        genomes.append(extraction)
+        passed.append(header)
+
+    # Genome extraction from filtered contigs
+    extractions = ji.extract_genomes(filtered, passed, extraction_dir, pair.name)
+    genomes = [(header, extractions[header]) for header in passed if header in extractions]
 
     ji.logfile("Genomes extracted", f"{pair.name}: {len(genomes)}", logs)
 
@@ -247,30 +343,33 @@ for pair in pairs:
         if host is not None:
             bacteria_name = os.path.basename(host).replace(".fasta", "")
             ji.logfile("Mapping QC reads to host", f"{pair.name} QC reads mapped to {bacteria_name}", logs)
-            ji.map_reads(host, deduped, host_mapping_dir, f"{pair.name}_{bacteria_name}")
+            graph.add("map_host", lambda: ji.map_reads(host, deduped, host_mapping_dir, f"{pair.name}_{bacteria_name}",
+                                                       index=ji.reference_index(host)),
+                      deps=[dedupe_stage], inputs=[host])
+            graph.build("map_host")
 
     # Looping through checkv genomes
-    for genome in genomes:
+    for header, genome in genomes:
         name = os.path.basename(genome).replace(".fasta", "")
         format_genome = ji.format_genome(genome, format_dir, name)
-
-        # Creating csv
-        assembly_check_file = os.path.join(output, 'mapping_reassembly.csv')
-        if not os.path.exists(assembly_check_file):
-            ji.create_csv(assembly_check_file, "sample,mapped_contig_size(1st),mapped_contig_count,unmapped_contig_count,mapped_contig_warning,unmapped_contig_warning,same_size_check")
+        if format_genome is None:
+            continue
 
         # Scanning formatted genome
         f_size, f_count, f_check = ji.contig_scan(format_genome)
 
         # Separating reads for mapped reassembly process
+        mapped_contigs = None
+        unmapped_contigs = None
         if enable_reassembly:
-            qc_map, qc_unmap, outdir = ji.separate_reads(genome, deduped, mapped_assembly, name)
-            
-            # Assembling mapped and unmapped reads
-            if not os.path.getsize(qc_map) == 0:
-                mapped_contigs = ji.PE_assembly(qc_map, outdir, "spades_mapped")
-            if not os.path.getsize(qc_unmap) == 0:
-                unmapped_contigs = ji.PE_assembly(qc_unmap, outdir, "spades_unmapped")    
+            separated = None
+            if graph.results.get("map_qc") is not None:
+                separated = ji.separated_reads(graph.results["map_qc"], header)
+            graph.add(f"reassembly_{name}", lambda: reassemble(genome, deduped, name, separated),
+                      deps=["map_qc" if separated else dedupe_stage], inputs=[genome], params=section("SPAdes"))
+            reassembly = graph.build(f"reassembly_{name}")
+            if reassembly is not None:
+                mapped_contigs, unmapped_contigs = reassembly
 
         # Initialising values
         m_warning, m_size, m_count, m_check = ['NA', 'NA', 'NA', 'NA']
@@ -278,7 +377,7 @@ for pair in pairs:
         matched = 'NA'
 
         # Assessing mapped contigs 
-        if os.path.exists(mapped_contigs):
+        if mapped_contigs is not None and os.path.exists(mapped_contigs):
 
             # Obtain size of the 1st contig, the number of contigs
             m_size, m_count, m_check = ji.contig_scan(mapped_contigs)
@@ -309,33 +408,43 @@ for pair in pairs:
             u_size, u_count, u_check, u_warning = 'N/A','N/A','N/A','N/A'
 
         # Collating data
-        ji.append_csv(assembly_check_file, f"{name},{m_size},{m_count},{u_count},{m_warning},{u_warning},{matched}")
+        rows[assembly_check_file].append(f"{name},{m_size},{m_count},{u_count},{m_warning},{u_warning},{matched}")
 
     # Quality checks
     if enable_qc:
         ji.fastqc(assemble_reads, qc_dir) 
-    
-    # Sample finish
-    ji.logfile("Sample run complete", pair.name, logs)
+
+    return True
+
+def reassemble(genome, reads, name, separated=None):
+    # Reads separated by the QC mapping are used when available, otherwise the genome is mapped on its own
+    if separated is None:
+        qc_map, qc_unmap, outdir = ji.separate_reads(genome, reads, mapped_assembly, name)
+    else:
+        qc_map, qc_unmap = separated
+        outdir = os.path.join(mapped_assembly, name)
+        os.makedirs(outdir, exist_ok=True)
+    mapped_contigs = None
+    unmapped_contigs = None
+
+    # Assembling mapped and unmapped reads
+    if os.path.exists(qc_map) and not os.path.getsize(qc_map) == 0:
+        mapped_contigs = ji.PE_assembly(qc_map, outdir, "spades_mapped")
+    if os.path.exists(qc_unmap) and not os.path.getsize(qc_unmap) == 0:
+        unmapped_contigs = ji.PE_assembly(qc_unmap, outdir, "spades_unmapped")
+    return [mapped_contigs, unmapped_contigs]
+
+
+# Running samples concurrently within the cpu / memory budget
+ji.logfile("pipeline options", f"sample workers: {ji.workers}", logs)
+failed = scheduler.run_samples(run_sample, pairs, ji.workers, ji.resource_budget())
+for pair, error in failed:
+    ji.logfile("ERROR: sample run crashed", f"{pair.name}: {error.strip().splitlines()[-1]}", logs)
 
 # Barcoding
 if enable_barcodes:
     ji.logfile("Barcoding", "-----", logs)
-    os.makedirs(barcode_dir)
-    tags = []
-    
-    # Tagging
-    for file in os.listdir(format_dir):
-        filepath = os.path.join(format_dir, file)
-        new_tag = ji.generate_unique_tag(tags)
-        tags.append(new_tag)
-        ji.barcode_phage(filepath, new_tag, barcode_dir)
-        
-        # Producing index file
-        index = os.path.join(output, 'index.csv')
-        if not os.path.exists(index):
-            ji.create_csv(index, "sample,phage_ID")
-        ji.append_csv(index, f"{file},{new_tag}.fasta")
+    ji.barcode_batch(format_dir, barcode_dir, os.path.join(output, 'index.csv'))
 
 # Phanatic finish
 ji.logfile("Phanatic base assembly finished", "-----", logs)
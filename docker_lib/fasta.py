@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# FASTA random access through a samtools style .fai index
+
+import os
+import mmap
+from array import array
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class IndexEntry(object):
+    def __init__(self, name, length, offset, linebases, linewidth):
+        self.name = name;
+        self.length = length;
+        self.offset = offset;
+        self.linebases = linebases;
+        self.linewidth = linewidth;
+
+    def span(self):
+        # Bytes from the first base to the last, including line breaks
+        if self.length == 0:
+            return 0
+        full_lines, remainder = divmod(self.length, self.linebases)
+        return full_lines * self.linewidth + remainder
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def build_index(path):
+    # Records name, length, offset, bases per line and bytes per line for each record
+    entries = []
+    if os.path.getsize(path) == 0:
+        return entries
+    with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        pos = 0
+        name = None
+        while pos < size:
+            end = mm.find(b'\n', pos)
+            if end == -1:
+                end = size
+            line = mm[pos:end]
+
+            if line.startswith(b'>'):
+                if name is not None:
+                    entries.append(_entry(name, lines, offset))
+                name = line[1:].split(None, 1)[0].decode() if line[1:].strip() else ""
+                offset = end + 1
+                lines = []
+            elif name is not None:
+                lines.append((len(line.rstrip(b'\r')), end + 1 - pos))
+            pos = end + 1
+
+        if name is not None:
+            entries.append(_entry(name, lines, offset))
+    return entries
+
+def _entry(name, lines, offset):
+    # Trailing empty lines are not part of the sequence
+    while lines and lines[-1][0] == 0:
+        lines.pop()
+    length = sum(bases for bases, width in lines)
+    if not lines:
+        return IndexEntry(name, 0, offset, 0, 0)
+    linebases, linewidth = lines[0]
+
+    # Ragged records are described as one line spanning the whole sequence
+    regular = all(bases == linebases and width == linewidth for bases, width in lines[:-1])
+    if not regular or lines[-1][0] > linebases:
+        span = sum(width for bases, width in lines[:-1]) + lines[-1][0]
+        return IndexEntry(name, length, offset, length, span)
+    return IndexEntry(name, length, offset, linebases, linewidth)
+
+def write_index(entries, index_path):
+    with open(index_path, 'w') as file:
+        for entry in entries:
+            file.write(f"{entry.name}\t{entry.length}\t{entry.offset}\t{entry.linebases}\t{entry.linewidth}\n")
+
+def read_index(index_path):
+    entries = []
+    with open(index_path) as file:
+        for line in file:
+            name, length, offset, linebases, linewidth = line.rstrip('\n').split('\t')[:5]
+            entries.append(IndexEntry(name, int(length), int(offset), int(linebases), int(linewidth)))
+    return entries
+
+def load_index(path):
+    # Reuses <path>.fai when it is newer than the FASTA, otherwise builds and saves it
+    index_path = f"{path}.fai"
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        return read_index(index_path)
+    entries = build_index(path)
+    try:
+        write_index(entries, index_path)
+    except OSError:
+        pass
+    return entries
+
+def fetch(path, names, entries=None):
+    # Returns {requested name: sequence bytes} for every name found, in one pass over the file
+    if entries is None:
+        entries = load_index(path)
+    by_name = {}
+    for entry in entries:
+        by_name.setdefault(entry.name, entry)
+
+    # Names that are not an exact ID fall back to a substring match, like the old header scan
+    found = {}
+    for name in names:
+        entry = by_name.get(name)
+        if entry is None:
+            entry = next((item for item in entries if name in item.name), None)
+        if entry is not None:
+            found[name] = entry
+    if not found:
+        return {}
+
+    sequences = {}
+    with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for name, entry in found.items():
+            raw = mm[entry.offset:entry.offset + entry.span()]
+            sequences[name] = raw.translate(None, b'\r\n')
+    return sequences
+
+def scan_lengths(path):
+    # Sequence lengths in file order, counted from the raw bytes between headers
+    lengths = array('Q')
+    if os.path.getsize(path) == 0:
+        return lengths
+    with open(path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        pos = 0 if mm[:1] == b'>' else mm.find(b'\n>')
+        if pos > 0:
+            pos += 1
+        while pos != -1 and pos < size:
+            start = mm.find(b'\n', pos)
+            if start == -1:
+                lengths.append(0)
+                break
+            end = mm.find(b'\n>', start)
+            if end == -1:
+                end = size
+            body = mm[start + 1:end]
+            lengths.append(len(body) - body.count(b'\n') - body.count(b'\r'))
+            pos = end + 1 if end < size else -1
+    return lengths
+
+def count_over(lengths, threshold, skip=0):
+    # Number of sequences longer than threshold, ignoring the first skip records
+    return sum(1 for length in lengths[skip:] if length > threshold)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# In process removal of exact duplicate read pairs from interleaved FASTQ, one pass with memory
+# bounded by a fixed size table of 64 bit BLAKE2 digests
+
+import gzip
+import hashlib
+import itertools
+import numpy as np
+
+# Share of the table filled before new pairs stop being stored
+max_load = 0.7
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class DedupeStats(object):
+    def __init__(self):
+        self.pairs = 0;
+        self.kept = 0;
+        self.duplicates = 0;
+        self.unchecked = 0;
+
+    def __str__(self):
+        text = f"{self.kept}/{self.pairs} pairs kept, {self.duplicates} duplicates removed"
+        if self.unchecked:
+            text += f", {self.unchecked} pairs kept unchecked after the digest table filled"
+        return text
+
+class DigestTable(object):
+    # Open addressing set of non zero uint64 digests with linear probing, filled a batch at a time
+    def __init__(self, max_bytes):
+        slots = 1 << max(10, (max_bytes // 8).bit_length() - 1)
+        self.keys = np.zeros(slots, dtype=np.uint64)
+        self.mask = np.uint64(slots - 1)
+        self.limit = int(slots * max_load)
+        self.size = 0
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes
+
+    def add(self, digests):
+        # digests must be unique and non zero. Returns (new, stored) masks, new digests are stored
+        # until the table reaches its load limit, after that they are only looked up
+        room = max(self.limit - self.size, 0)
+        new = np.zeros(len(digests), dtype=bool)
+        stored = np.zeros(len(digests), dtype=bool)
+        new[:room] = self.probe(digests[:room], True)
+        stored[:room] = new[:room]
+        new[room:] = self.probe(digests[room:], False)
+        self.size += int(stored.sum())
+        return new, stored
+
+    def probe(self, digests, insert):
+        # Linear probing of all digests together, returns the mask of those not already present
+        new = np.zeros(len(digests), dtype=bool)
+        pending = np.arange(len(digests))
+        slots = digests & self.mask
+        while len(pending):
+            current = self.keys[slots]
+            empty = current == 0
+            matched = current == digests[pending]
+            if insert and empty.any():
+                # Of the digests probing the same empty slot the first takes it, the rest probe on
+                claim = np.flatnonzero(empty)
+                taken, first = np.unique(slots[claim], return_index=True)
+                winners = claim[first]
+                self.keys[taken] = digests[pending[winners]]
+                new[pending[winners]] = True
+                done = matched.copy()
+                done[winners] = True
+                advance = ~empty & ~matched
+            else:
+                new[pending[empty]] = True
+                done = matched | empty
+                advance = ~done
+            slots[advance] = (slots[advance] + np.uint64(1)) & self.mask
+            pending = pending[~done]
+            slots = slots[~done]
+        return new
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def pair_digests(seqs_1, seqs_2, swapped=True):
+    # 64 bit digests of the read sequences of each pair, zero is kept free for empty slots.
+    # With swapped, (R2, R1) is the same pair as (R1, R2), the fragment read from the other end
+    joined = []
+    for seq_1, seq_2 in zip(seqs_1, seqs_2):
+        if swapped and seq_2 < seq_1:
+            seq_1, seq_2 = seq_2, seq_1
+        joined.append(hashlib.blake2b(seq_1 + b"\n" + seq_2, digest_size=8).digest())
+    digests = np.frombuffer(b"".join(joined), dtype=np.uint64).copy()
+    digests[digests == 0] = 1
+    return digests
+
+def read_batch(file, size):
+    # Up to size interleaved pairs as lists of their eight lines
+    lines = list(itertools.islice(file, 8 * size))
+    if len(lines) % 8:
+        raise ValueError(f"{getattr(file, 'name', 'input')}: odd number of reads or truncated FASTQ record")
+    if not all(line.startswith(b"@") for line in itertools.chain(lines[0::8], lines[4::8])):
+        raise ValueError(f"{getattr(file, 'name', 'input')}: FASTQ record does not start with @")
+    return lines
+
+def dedupe_pairs(file, out, table_mb=256, batch_reads=20000, swapped=True):
+    # Writes the first occurrence of each pair from file to out, both binary file objects.
+    # Returns DedupeStats, pairs arriving after the table is full are kept without being stored
+    table = DigestTable(int(table_mb * 1024 ** 2))
+    stats = DedupeStats()
+    while True:
+        lines = read_batch(file, batch_reads)
+        if not lines:
+            return stats
+        digests = pair_digests([line.rstrip(b"\r\n") for line in lines[1::8]],
+                               [line.rstrip(b"\r\n") for line in lines[5::8]], swapped)
+
+        # Repeats inside the batch are resolved first, the table only sees each digest once
+        unique, first = np.unique(digests, return_index=True)
+        new, stored = table.add(unique)
+        keep = np.zeros(len(digests), dtype=bool)
+        keep[first[new]] = True
+
+        out.write(b"".join(b"".join(lines[8 * i:8 * i + 8]) for i in np.flatnonzero(keep).tolist()))
+        kept = int(keep.sum())
+        stats.pairs += len(digests)
+        stats.kept += kept
+        stats.duplicates += len(digests) - kept
+        stats.unchecked += int((new & ~stored).sum())
+
+def open_fastq(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, compresslevel=1) if 'w' in mode else gzip.open(path, mode)
+    return open(path, mode, buffering=1 << 20)
+
+def dedupe_file(infile, outfile, **options):
+    # dedupe_pairs between FASTQ files, gzipped when the name ends in .gz
+    with open_fastq(infile, 'rb') as file, open_fastq(outfile, 'wb') as out:
+        return dedupe_pairs(file, out, **options)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+# In process trimming of paired FASTQ, the bbduk ftl / ftr / minavgquality / minlength filters
+# applied to batches of reads as numpy arrays, without starting a JVM
+
+import gzip
+import itertools
+import numpy as np
+
+# Error probability of each phred score (offset 33), bbduk averages these rather than the scores
+error_probability = 10 ** (-np.arange(94, dtype=np.float64) / 10)
+max_score = len(error_probability) - 1
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class TrimStats(object):
+    def __init__(self):
+        self.pairs = 0;
+        self.kept = 0;
+        self.too_short = 0;
+        self.low_quality = 0;
+        self.bases_in = 0;
+        self.bases_out = 0;
+
+    def __str__(self):
+        return (f"{self.kept}/{self.pairs} pairs kept, {self.too_short} too short, "
+                f"{self.low_quality} low quality, {self.bases_out}/{self.bases_in} bases kept")
+
+class Batch(object):
+    # headers keep their newline, sequences and qualities do not
+    def __init__(self, headers, seqs, quals):
+        self.headers = headers;
+        self.seqs = seqs;
+        self.quals = quals;
+
+    def __len__(self):
+        return len(self.headers)
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def open_fastq(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+def read_batch(file, size):
+    lines = list(itertools.islice(file, 4 * size))
+    if len(lines) % 4:
+        raise ValueError(f"{file.name}: truncated FASTQ record")
+    headers = lines[0::4]
+    if not all(header.startswith(b"@") for header in headers):
+        raise ValueError(f"{file.name}: FASTQ record does not start with @")
+    seqs = [line.rstrip(b"\r\n") for line in lines[1::4]]
+    quals = [line.rstrip(b"\r\n") for line in lines[3::4]]
+    return Batch(headers, seqs, quals)
+
+def read_pairs(read_1, read_2, size):
+    # Yields (Batch, Batch) of up to size pairs from the two files in step
+    with open_fastq(read_1) as file_1, open_fastq(read_2) as file_2:
+        while True:
+            batch_1 = read_batch(file_1, size)
+            batch_2 = read_batch(file_2, size)
+            if len(batch_1) != len(batch_2):
+                raise ValueError(f"{read_1} and {read_2} have different numbers of reads")
+            if not len(batch_1):
+                return
+            yield batch_1, batch_2
+
+def trim_bounds(lengths, left, right):
+    # ftl / ftr, bases before left and after right (0 based, inclusive) are removed
+    start = np.minimum(left, lengths)
+    end = np.maximum(np.minimum(right + 1, lengths), start)
+    return start, end
+
+def average_quality(quals, start, end):
+    # Phred value of the mean error probability over start..end of each read, rounded as bbduk does.
+    # Reads are ragged, so the sums are taken from one running total over the joined batch
+    lengths = np.fromiter(map(len, quals), dtype=np.int64, count=len(quals))
+    offsets = np.zeros(len(quals) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    scores = np.minimum(np.frombuffer(b"".join(quals), dtype=np.uint8) - 33, max_score)
+    total = np.zeros(len(scores) + 1)
+    np.cumsum(error_probability[scores], out=total[1:])
+    bases = end - start
+    errors = total[offsets[:-1] + end] - total[offsets[:-1] + start]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quality = np.rint(-10 * np.log10(errors / bases))
+    return np.where(bases > 0, quality, 0)
+
+def filter_batch(batch, left, right, min_length, min_quality):
+    # Returns (start, end, long enough, good quality) arrays for one side of the pairs
+    lengths = np.fromiter(map(len, batch.seqs), dtype=np.int64, count=len(batch))
+    if not np.array_equal(lengths, np.fromiter(map(len, batch.quals), dtype=np.int64, count=len(batch))):
+        raise ValueError("FASTQ sequence and quality lengths differ")
+    start, end = trim_bounds(lengths, left, right)
+    long_enough = end - start >= max(min_length, 1)
+    if min_quality > 0:
+        good = average_quality(batch.quals, start, end) >= min_quality
+    else:
+        good = np.ones(len(batch), dtype=bool)
+    return start, end, long_enough, good
+
+def write_batch(out, batch_1, bounds_1, batch_2, bounds_2, keep):
+    # Kept pairs interleaved, read 1 then read 2 with their headers unchanged
+    chunks = []
+    sides = [(batch_1, bounds_1[0].tolist(), bounds_1[1].tolist()),
+             (batch_2, bounds_2[0].tolist(), bounds_2[1].tolist())]
+    for i in np.flatnonzero(keep).tolist():
+        for batch, starts, ends in sides:
+            start, end = starts[i], ends[i]
+            chunks += [batch.headers[i], batch.seqs[i][start:end], b"\n+\n", batch.quals[i][start:end], b"\n"]
+    out.write(b"".join(chunks))
+
+def trim_pairs(read_1, read_2, out, left=0, right=-1, min_length=0, min_quality=0, batch_reads=20000):
+    # Trims read_1 / read_2 into out, a binary file object, and returns TrimStats.
+    # A pair is removed when either read fails (bbduk removeifeitherbad), right < 0 keeps the read ends
+    if right < 0:
+        right = np.iinfo(np.int64).max - 1
+    stats = TrimStats()
+    for batch_1, batch_2 in read_pairs(read_1, read_2, batch_reads):
+        start_1, end_1, long_1, good_1 = filter_batch(batch_1, left, right, min_length, min_quality)
+        start_2, end_2, long_2, good_2 = filter_batch(batch_2, left, right, min_length, min_quality)
+        long_enough = long_1 & long_2
+        keep = long_enough & good_1 & good_2
+        write_batch(out, batch_1, (start_1, end_1), batch_2, (start_2, end_2), keep)
+
+        stats.pairs += len(batch_1)
+        stats.kept += int(keep.sum())
+        stats.too_short += int((~long_enough).sum())
+        stats.low_quality += int((long_enough & ~keep).sum())
+        stats.bases_in += sum(map(len, batch_1.seqs)) + sum(map(len, batch_2.seqs))
+        stats.bases_out += int((end_1 - start_1)[keep].sum() + (end_2 - start_2)[keep].sum())
+    return stats
+
+def trim_file(read_1, read_2, outfile, **options):
+    # trim_pairs to a FASTQ file, gzipped when the name ends in .gz
+    if outfile.endswith(".gz"):
+        handle = gzip.open(outfile, 'wb', compresslevel=1)
+    else:
+        handle = open(outfile, 'wb', buffering=1 << 20)
+    with handle:
+        return trim_pairs(read_1, read_2, handle, **options)
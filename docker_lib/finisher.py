@@ -3,8 +3,47 @@
 
 import os
 import sys
+import configparser
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import pandas as pd
+import checkv_results
+import base_coverage
+import scheduler
+import schemas
+
+# Plot size, coverage is reduced to one min/max pair per horizontal pixel before drawing
+figsize = (15, 8)
+dpi = 300
+
+# Configuration, PHANATIC_HOME moves the container paths for runs outside the container
+home = os.environ.get("PHANATIC_HOME", "/assemble")
+config_file = os.path.join(home, "output", "config.ini")
+config = configparser.ConfigParser()
+if os.path.isfile(config_file):
+    config.read(config_file)
+else:
+    config.read(os.path.join(home, "config.ini"))
+
+# Host coverage windows, read in chunks so whole host genomes are never held in memory
+window = config.getint("coverage", "window", fallback=1000)
+chunk_bytes = config.getint("coverage", "chunk_mb", fallback=4) * 1024 * 1024
+
+# Graphs and tables are produced by a pool of worker processes, 0 uses every cpu
+workers = config.getint("scheduler", "finisher_workers", fallback=0) or scheduler.system_cpus()
+
+# Summary tables are written as typed CSV, with a Parquet copy when enabled
+write_parquet = config.getboolean("output", "parquet", fallback=False)
+
+# Types for the per sample tables read by the pool
+table_schemas = {
+    "covstats.tsv": schemas.covstats,
+    "scafstats.tsv": schemas.scafstats,
+}
+
+# CheckV columns left out of raw_data.csv
+checkv_drop = ['provirus', 'proviral_length', 'viral_genes', 'host_genes', 'provirus', 'proviral_length', 'kmer_freq']
 
 ### Functions
 
@@ -57,67 +96,123 @@ def generate_coverage_graph(covstats, basecov, outdir):
         cutoff = 100
 
     # Read data from the basecov file
-    headers = ["ID", "Pos", "Coverage"]
-    df = pd.read_csv(basecov, sep='\t', comment='#', names=headers)
-
-    # Separating data from basecov
-    coverage = df[df['ID'] == contig]
-
-    # Plot basecoverage
-    x_values = coverage['Pos']
-    y_values = coverage['Coverage']
+    x_values, y_values = base_coverage.load_contig(basecov, contig)
 
     # Check coverage
-    below_cutoff_count = sum(1 for y in y_values if y < cutoff)
-    if any(y < cutoff for y in y_values):
+    below_cutoff_count = base_coverage.below_cutoff(y_values, cutoff)
+    if below_cutoff_count:
         print(f"Warning: {below_cutoff_count} coverage values have dipped below {cutoff}")
 
+    # Plot basecoverage
+    x_values, y_values = base_coverage.downsample(x_values, y_values, int(figsize[0] * dpi))
+
     # Create a plot for coverage data
-    plt.figure(figsize=(15, 8))
-    plt.plot(x_values, 
+    fig, ax = plt.subplots(figsize=figsize)
+    ax.plot(x_values, 
             y_values, 
             marker = ',', 
             markersize = 0.1,
             linestyle = '-', 
             color='b')
-    plt.title(f"Per base coverage for {contig}")
-    plt.xlabel("Position")
-    plt.ylabel("Coverage")
-    plt.grid(True)
+    ax.set_title(f"Per base coverage for {contig}")
+    ax.set_xlabel("Position")
+    ax.set_ylabel("Coverage")
+    ax.grid(True)
 
     # Control line
-    plt.axhline(y=400, color='red', linestyle=':')
-    plt.axhline(y=100, color='red', linestyle='-')
+    ax.axhline(y=400, color='red', linestyle=':')
+    ax.axhline(y=100, color='red', linestyle='-')
 
     # Save the plot as an image file (e.g., PNG)
     outfile = os.path.join(outdir, f"{contig}.png")
-    plt.savefig(outfile, dpi = 300)
+    fig.savefig(outfile, dpi = dpi)
+    plt.close(fig)
+
+def basecov_path(dirpath):
+    base = os.path.join(dirpath, base_coverage.store_name)
+    if not os.path.exists(base):
+        base = os.path.join(dirpath, "basecov.tsv")
+    return base
+
+def graph_sample(dirpath):
+    print(os.path.basename(dirpath))
+    cov = os.path.join(dirpath, "covstats.tsv")
+
+    # Running graph
+    try:
+        generate_coverage_graph(cov, basecov_path(dirpath), dirpath)
+    except Exception as e:
+        print(e)
+
+def read_table(path):
+    schema = table_schemas.get(os.path.basename(path), schemas.columns)
+    if path.endswith('.tsv'):
+        df = schemas.read_csv(path, schema, sep='\t')
+    elif path.endswith('.csv'):
+        df = schemas.read_csv(path, schema)
+    else:
+        print(f"Error reading {path}")
+        return None
 
-########################################################################
+    # Sample name from the directory holding the table
+    df.insert(0, 'sample', os.path.basename(os.path.dirname(path)))
+    return df
 
-# Directories
-qc_phage = '/assemble/output/mapping_QC_to_phage'
-norm_phage = '/assemble/output/mapping_Norm_to_phage'
-qc_host = '/assemble/output/mapping_QC_to_host'
-dirs = [qc_phage, norm_phage, qc_host]
-
-# Running script
-for directory in dirs:
-    if os.path.exists(directory):
-        for file in os.listdir(directory):
-            print(file)
-            # Setting function inputs
-            dirpath = os.path.join(directory, file)
-            cov = os.path.join(dirpath, "covstats.tsv")
-            base = os.path.join(dirpath, "basecov.tsv")
-
-            # Running graph
-            try:
-                generate_coverage_graph(cov, base, dirpath)
-            except Exception as e:
-                print(e)
-    else:
-        print("error")
+def checkv_rows(dirpath):
+    # Quality, completeness and contamination merged per contig by one read of each sample's tables
+    results = checkv_results.load(dirpath)
+    return results.rows(os.path.basename(dirpath), drop=checkv_drop)
+
+def host_rows(dirpath):
+    # Windowed coverage per host contig
+    base = basecov_path(dirpath)
+    if not os.path.exists(base):
+        return []
+    runs = base_coverage.read_coverage(base, chunk_bytes)
+    outfile = os.path.join(dirpath, "coverage_windows.tsv")
+    totals = base_coverage.write_windows(outfile, base_coverage.windows(runs, window))
+    rows = []
+    for contig, total in totals.items():
+        rows.append({
+            'sample': os.path.basename(dirpath),
+            'contig_id': contig,
+            'length': total['bases'],
+            'mean_coverage': round(total['depth'] / total['bases'], 2) if total['bases'] else 0,
+            'lowest_window_mean': round(total['lowest_window_mean'], 2),
+            'zero_coverage_bases': total['zero_bases'],
+            'zero_coverage_windows': total['zero_windows'],
+        })
+    return rows
+
+# Work run by the pool, tasks are (type, path)
+task_functions = {
+    "graph": graph_sample,
+    "table": read_table,
+    "checkv": checkv_rows,
+    "host": host_rows,
+}
+
+def run_task(task):
+    kind, path = task
+    return task_functions[kind](path)
+
+def sample_dirs(directory):
+    if not os.path.exists(directory):
+        print(f"error: {directory} not found")
+        return []
+    return [os.path.join(directory, file) for file in sorted(os.listdir(directory))]
+
+def collect(results, kind):
+    # [(path, result)] for one task type in submission order, failed tasks are reported and skipped
+    collected = []
+    for (task_kind, path), result, error in results:
+        if task_kind != kind:
+            continue
+        if error is not None:
+            print(f"ERROR {path}: {error.strip().splitlines()[-1]}")
+        elif result is not None:
+            collected.append((path, result))
+    return collected
 
 ######
 '''
@@ -127,70 +222,10 @@ The below section may or may not be necessary, it concatenates data for all cont
 '''
 ######
 
-def filescan(dir, filetype):
-    dfs = []
-    for file in os.listdir(dir):
-        path = os.path.join(dir, file, filetype)
-        if path.endswith('.tsv'):
-            df = pd.read_csv(path, sep='\t')
-        elif path.endswith('.csv'):
-            df = pd.read_csv(path)
-        else:
-            print(f"Error reading {path}")
-            continue
-        
-        # Adding to list
-        df.insert(0, 'sample', file)
-        dfs.append(df)
-        
+def filescan(results, filetype):
+    dfs = [df for path, df in collect(results, "table") if os.path.basename(path) == filetype]
     df = pd.concat(dfs)
     return df
-    
-# Preparing function parameters
-outdir = '/assemble/output/'
-
-# CheckV files
-checkv_dir = os.path.join(outdir, "checkv")
-qual = "quality_summary.tsv"
-comp = "completeness.tsv"
-cont = "contamination.tsv"
-
-try:
-    df = filescan(checkv_dir, qual)
-    cols = ['provirus', 'proviral_length', 'viral_genes', 'host_genes', 'provirus', 'proviral_length', 'kmer_freq']
-    df = df.drop(columns=cols)
-    df2 = filescan(checkv_dir, comp)
-    df3 = filescan(checkv_dir, cont)
-    
-    # Merging
-    checkv = df.merge(df2, on=['sample','contig_id', 'contig_length']).merge(df3, on=['sample','contig_id', 'contig_length'])
-    
-except Exception as e:
-    print(f"ERROR {e}")
-
-# Coverage files
-qc_dir = os.path.join(outdir, 'mapping_QC_to_phage')
-covstat = 'covstats.tsv'
-scafstat = 'scafstats.tsv'
-
-try:
-    df = filescan(qc_dir, covstat)
-    df2 = filescan(qc_dir, scafstat)
-    
-    # Merging
-    df.rename(columns={'#ID' : 'contig_id'}, inplace=True)
-    df2.rename(columns={'#name' : 'contig_id'}, inplace=True)
-    coverage = df.merge(df2, on=['sample', 'contig_id'])
-    
-except Exception as e:
-    print(f"ERROR {e}")
-
-# Final merge
-merge = coverage.merge(checkv, on=['sample', 'contig_id'])
-
-# Saving file 
-outfile = os.path.join(outdir, 'raw_data.csv')
-merge.to_csv(outfile, index=False)
 
 ######
 '''
@@ -211,31 +246,94 @@ genomes >1000bp within the assembly
 '''
 ######
 
-# Building combined summary file
-try:
-    # Reading merge files
-    contig_sum = os.path.join(outdir, 'sample_summary.csv')
-    sample_sum = os.path.join(outdir, 'contig_summary.csv')
-    df = pd.read_csv(contig_sum)
-    df2 = pd.read_csv(sample_sum)
-
-    # Merging + sorting
-    merge = df.merge(df2, on='sample', how='outer')
-    merge.sort_values(by='phage_QC_mapped_(%)', ascending=False, inplace=True)
-
-    # If barcodes are enabled
-    barcode_index = os.path.join(outdir, 'index.csv')
-    if os.path.exists(barcode_index):
-        barcodes = pd.read_csv(barcode_index)
-
-        # Have to split sample column into <sample_name,contig_name>
-
-    # Saving
-    outfile = os.path.join(outdir, 'combined_summary.csv')
-    merge.to_csv(outfile, index=False)
-
-except Exception as e:
-    print(f"ERROR: {e}")
+########################################################################
 
-# Building reassembly_summary.csv
-# Assessing transduction using basecov for host
+def main(outdir=os.path.join(home, 'output')):
+
+    # Directories
+    qc_phage = os.path.join(outdir, 'mapping_QC_to_phage')
+    norm_phage = os.path.join(outdir, 'mapping_Norm_to_phage')
+    qc_host = os.path.join(outdir, 'mapping_QC_to_host')
+    checkv_dir = os.path.join(outdir, "checkv")
+
+    # Coverage files
+    covstat = 'covstats.tsv'
+    scafstat = 'scafstats.tsv'
+
+    # Graphs and table loads for every sample go to the pool together, results are merged below
+    tasks = []
+    for directory in [qc_phage, norm_phage, qc_host]:
+        tasks.extend(("graph", dirpath) for dirpath in sample_dirs(directory))
+    tasks.extend(("checkv", dirpath) for dirpath in sample_dirs(checkv_dir))
+    for dirpath in sample_dirs(qc_phage):
+        tasks.append(("table", os.path.join(dirpath, covstat)))
+        tasks.append(("table", os.path.join(dirpath, scafstat)))
+    tasks.extend(("host", dirpath) for dirpath in sample_dirs(qc_host))
+    results = scheduler.map_samples(run_task, tasks, workers)
+
+    # CheckV files
+    try:
+        rows = [row for path, sample_rows in collect(results, "checkv") for row in sample_rows]
+        checkv = schemas.apply(pd.DataFrame(rows), schemas.checkv)
+    except Exception as e:
+        print(f"ERROR {e}")
+
+    try:
+        df = filescan(results, covstat)
+        df2 = filescan(results, scafstat)
+
+        # Merging
+        df.rename(columns={'#ID' : 'contig_id'}, inplace=True)
+        df2.rename(columns={'#name' : 'contig_id'}, inplace=True)
+        coverage = df.merge(df2, on=['sample', 'contig_id'])
+
+        # Final merge
+        merge = coverage.merge(checkv, on=['sample', 'contig_id'])
+
+        # Saving file 
+        outfile = os.path.join(outdir, 'raw_data.csv')
+        schemas.write_table(schemas.apply(merge), outfile, write_parquet)
+
+    except Exception as e:
+        print(f"ERROR {e}")
+
+    # Building combined summary file
+    try:
+        # Reading merge files
+        contig_sum = os.path.join(outdir, 'sample_summary.csv')
+        sample_sum = os.path.join(outdir, 'contig_summary.csv')
+        df = schemas.read_csv(contig_sum, schemas.sample_summary)
+        df2 = schemas.read_csv(sample_sum, schemas.contig_summary)
+
+        # Merging + sorting
+        merge = df.merge(df2, on='sample', how='outer')
+        merge.sort_values(by='phage_QC_mapped_(%)', ascending=False, inplace=True)
+
+        # If barcodes are enabled
+        barcode_index = os.path.join(outdir, 'index.csv')
+        if os.path.exists(barcode_index):
+            barcodes = pd.read_csv(barcode_index)
+
+            # Have to split sample column into <sample_name,contig_name>
+
+        # Saving
+        outfile = os.path.join(outdir, 'combined_summary.csv')
+        schemas.write_table(schemas.apply(merge), outfile, write_parquet)
+
+    except Exception as e:
+        print(f"ERROR: {e}")
+
+    # Building reassembly_summary.csv
+
+    # Assessing transduction using basecov for host
+    try:
+        rows = [row for path, sample_rows in collect(results, "host") for row in sample_rows]
+        if rows:
+            outfile = os.path.join(outdir, 'host_coverage.csv')
+            df = schemas.apply(pd.DataFrame(rows), schemas.host_coverage)
+            schemas.write_table(df, outfile, write_parquet)
+    except Exception as e:
+        print(f"ERROR: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,41 @@
 
 import os
 import sys
-import datetime
 import configparser
 import subprocess
-import csv
-import random
-from Bio import SeqIO
-from Bio.SeqIO.FastaIO import SimpleFastaParser
+import time
+import threading
+import fcntl
+import scheduler
+import cache
+import logger
+import mapstats
+import fasta
+import checkv_results
+import barcode
+import base_coverage
+import host_index
+import read_split
+import metrics
+import fastq_trim
+import fastq_dedupe
 
 ## CONFIGURATION
 
-config_file = "/assemble/output/config.ini"
-logs = "/assemble/output/phanatic_log.tsv"
+# Container paths, PHANATIC_HOME moves them for runs outside the container
+home = os.environ.get("PHANATIC_HOME", "/assemble")
+input_dir = os.path.join(home, "input")
+output_dir = os.path.join(home, "output")
+cache_mount = os.path.join(home, "cache")
+
+config_file = os.path.join(output_dir, "config.ini")
+logs = os.path.join(output_dir, "phanatic_log.tsv")
 
 config = configparser.ConfigParser()
 if os.path.isfile(config_file):
     config.read(config_file)
 else:
-    config_file = "/assemble/config.ini"
+    config_file = os.path.join(home, "config.ini")
     config.read(config_file)
 
 image = config["phanatic"]["image"]
@@ -32,6 +49,17 @@ trim_length = int(config["trim"]["trim_length"])
 minimum_length = config["trim"]["minimum_length"]
 q_trim = config["trim"]["read_quality"]
 
+# In process numpy trimming replaces bbduk for inputs up to numpy_max_mb (gzipped R1 + R2)
+trim_engine = config.get("trim", "engine", fallback="bbduk")
+trim_numpy_max_mb = config.getfloat("trim", "numpy_max_mb", fallback=500)
+trim_batch_reads = config.getint("trim", "batch_reads", fallback=20000)
+
+# In process exact duplicate removal replaces dedupe.sh, with a digest table of table_mb
+dedupe_engine = config.get("dedupe", "engine", fallback="dedupe")
+dedupe_table_mb = config.getfloat("dedupe", "table_mb", fallback=256)
+dedupe_swapped = config.getboolean("dedupe", "swapped", fallback=True)
+dedupe_batch_reads = config.getint("dedupe", "batch_reads", fallback=20000)
+
 minimum_insert = int(config["merge"]["minimum_insert"])
 minimum_overlap = int(config["merge"]["minimum_overlap"])
 
@@ -44,6 +72,58 @@ filter_length = int(config["filter"]["filter_length"])
 
 prefix = config["barcoding"]["prefix"]
 barcode_length = int(config["barcoding"]["barcode_length"])
+deterministic_tags = config.getboolean("barcoding", "deterministic", fallback=False)
+
+# Per base coverage is kept as a binary store, the basecov text is removed after conversion
+keep_basecov = config.getboolean("coverage", "keep_basecov", fallback=False)
+
+workers = config.getint("scheduler", "workers", fallback=1)
+budget_cpus = config.getint("scheduler", "cpus", fallback=0) or scheduler.system_cpus()
+budget_memory_gb = config.getint("scheduler", "memory_gb", fallback=0)
+light_threads = config.getint("scheduler", "light_threads", fallback=4)
+
+# Stage costs as (cpus, memory MB), JVM tools are sized by their -Xmx heap
+memory_mb = scheduler.parse_memory(memory)
+stage_costs = {
+    "assembly": (threads, memory_gb * 1024),
+    "checkv": (light_threads, 4096),
+    "fastqc": (1, 512),
+    "format": (1, 1024),
+    "trim_numpy": (1, 1024),
+    "dedupe_numpy": (1, int(dedupe_table_mb) + 512),
+}
+
+# Logging
+log_jsonl = config.getboolean("logging", "jsonl", fallback=False)
+log_interval = config.getfloat("logging", "flush_seconds", fallback=1.0)
+loggers = {}
+
+# Wall time, cpu, peak memory and io of every tool run
+if config.getboolean("logging", "metrics", fallback=True):
+    metrics.configure(os.path.join(output_dir, "phanatic_metrics.tsv"), jsonl=log_jsonl,
+                      interval=config.getfloat("logging", "metrics_interval", fallback=0.1))
+
+# Stage output cache, shared across runs when /assemble/cache is mounted
+stage_cache = None
+if config.getboolean("cache", "enable", fallback=False):
+    cache_dir = config.get("cache", "directory", fallback="")
+    if not cache_dir:
+        cache_dir = cache_mount if os.path.isdir(cache_mount) else os.path.join(output_dir, ".stage_cache")
+    cache_gb = config.getfloat("cache", "max_gb", fallback=100)
+    stage_cache = cache.StageCache(cache_dir, int(cache_gb * 1024 ** 3))
+
+# bbmap indexes of host genomes, built once per distinct host and kept between runs
+host_indexes = None
+if config.getboolean("cache", "host_index", fallback=True):
+    index_root = config.get("cache", "directory", fallback="")
+    if not index_root and os.path.isdir(cache_mount):
+        index_root = cache_mount
+    if index_root:
+        index_root = os.path.join(index_root, "bbmap_index")
+    else:
+        index_root = os.path.join(output_dir, ".host_index")
+    host_indexes = host_index.IndexCache(index_root)
+host_maps = {}
 
 ###_______________________________________________________________________________________
 
@@ -61,11 +141,126 @@ class Pair(object):
 ## FUNCTIONS
 
 def logfile(function, text, logfile):
-    newline = "\n"
-    date_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    report = f"{newline}[{image}]\t[{date_time}]\t[{function}]\t[{text}]"
-    with open(logfile, "a") as file:
-        file.write(report)
+    # Entries are queued and written in batches by one thread per process
+    if logfile not in loggers:
+        loggers[logfile] = logger.Logger(logfile, image, jsonl=log_jsonl, interval=log_interval)
+    loggers[logfile].log(function, text)
+
+def flush_logs():
+    for log in loggers.values():
+        log.flush()
+
+def stage_cost(stage):
+    return stage_costs.get(stage, (light_threads, memory_mb))
+
+def resource_budget():
+    if budget_memory_gb:
+        total_memory = budget_memory_gb * 1024
+    else:
+        total_memory = scheduler.system_memory() or max(memory_mb, memory_gb * 1024)
+    return scheduler.ResourceBudget(budget_cpus, total_memory)
+
+def cache_lookup(command, stage, inputs, outputs, params=None):
+    # Returns (key, restored), outputs are restored when the inputs and command line have been seen before
+    if stage_cache is None or not outputs:
+        return None, False
+    key = stage_cache.key(command, inputs, outputs, params)
+    if stage_cache.restore(key, outputs):
+        logfile("Cache", f"{stage}: restored {', '.join(os.path.basename(path) for path in outputs)}", logs)
+        return key, True
+
+    # Cached files are hard links, so tools must not rewrite them in place
+    for path in outputs:
+        cache.remove_path(path)
+    return key, False
+
+def run_tool(command, stage, inputs=(), outputs=(), thread_flag="t=", params=None):
+    key, restored = cache_lookup(command, stage, inputs, outputs, params)
+    if restored:
+        return
+
+    with scheduler.reserve(*stage_cost(stage)) as cpus:
+        if thread_flag == "t=":
+            command = command + [f"t={cpus}"]
+        elif thread_flag:
+            command = command + [thread_flag, f"{cpus}"]
+        metrics.run(command, stage, inputs)
+
+    if key is not None:
+        stage_cache.store(key, outputs)
+
+def run_pipeline(commands, stage, inputs=(), outputs=(), params=None):
+    # Runs commands connected stdout to stdin, bbtools commands share the granted threads.
+    # A command can also be a function (input, output) run on a thread, reading the previous command's
+    # output (None when first) and writing the next command's input (None when last), its settings go in params
+    key, restored = cache_lookup([token for command in commands
+                                  for token in (command if isinstance(command, list) else ["<in process>"]) + ["|"]],
+                                 stage, inputs, outputs, params)
+    if restored:
+        return
+
+    cpus, memory_cost = stage_cost(stage)
+    jvms = sum(1 for command in commands if isinstance(command, list) and command[0].endswith(".sh"))
+    errors = []
+    with scheduler.reserve(cpus, memory_cost * max(jvms, 1)) as cpus:
+        processes = []
+        threads = []
+        stdin = None
+        started = time.monotonic()
+        for i, command in enumerate(commands):
+            last = i == len(commands) - 1
+            if callable(command):
+                output = stdout = None
+                if not last:
+                    read, write = os.pipe()
+                    output, stdout = os.fdopen(write, 'wb'), os.fdopen(read, 'rb')
+                threads.append(threading.Thread(target=feed, args=(command, stdin, output, errors)))
+                stdin = stdout
+                continue
+            if command[0].endswith(".sh"):
+                command = command + [f"t={cpus}"]
+            process = metrics.watch(subprocess.Popen(command, stdin=stdin, stdout=None if last else subprocess.PIPE))
+            if stdin is not None:
+                stdin.close()
+            stdin = process.stdout
+            processes.append((i, command, process))
+
+        for thread in threads:
+            thread.start()
+
+        # Only the first tool reads the input files
+        codes = [(command, metrics.wait(process, stage, started, inputs if i == 0 else ()))
+                 for i, command, process in processes]
+        for thread in threads:
+            thread.join()
+
+    # A failed in process command is the cause when the tools after it exit on a broken pipe
+    for error in errors:
+        if not isinstance(error, BrokenPipeError):
+            raise error
+    for command, code in codes:
+        if code != 0:
+            raise subprocess.CalledProcessError(code, command)
+    if errors:
+        raise errors[0]
+
+    if key is not None:
+        stage_cache.store(key, outputs)
+
+def feed(function, input, output, errors):
+    # In process pipeline command, its pipes are closed after so the commands either side see the end
+    try:
+        function(input, output)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        for handle in (input, output):
+            if handle is None:
+                continue
+            try:
+                handle.close()
+            except OSError as e:
+                errors.append(e)
 
 def check_filepath(filepath, create=False):
     if os.path.exists(filepath):
@@ -84,14 +279,12 @@ def check_filepath(filepath, create=False):
             sys.exit(1)
 
 def generate_unique_tag(existing_tags):
-    # characters = "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    characters = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    while True:
-        password = "".join(random.sample(characters, barcode_length))
-        tag = f"{prefix}_{password}"
-        if tag not in existing_tags:
-            logfile("Barcoding", f"Tag gen: {tag}", logs)
-            return tag
+    # Single tag outside a batch, see barcode.BarcodeBatch
+    batch = barcode.BarcodeBatch(prefix, barcode_length)
+    batch.tags = set(existing_tags)
+    tag = batch.tag()
+    logfile("Barcoding", f"Tag gen: {tag}", logs)
+    return tag
 
 def create_csv(filename, headers):
     with open(filename, 'w', newline='') as csvfile:
@@ -99,8 +292,28 @@ def create_csv(filename, headers):
 
 def append_csv(filename, data):
     with open(filename, 'a', newline='') as csvfile:
+        fcntl.flock(csvfile, fcntl.LOCK_EX)
         csvfile.write(data+'\n')
 
+def merge_csv_lines(filename, data):
+    # Appends the lines not already in the file, so a sample re-run after a crash adds no duplicates
+    with open(filename, 'a+', newline='') as csvfile:
+        fcntl.flock(csvfile, fcntl.LOCK_EX)
+        csvfile.seek(0)
+        present = set(line.rstrip('\n') for line in csvfile)
+        csvfile.writelines(f"{line}\n" for line in dict.fromkeys(data) if line not in present)
+
+def remove_csv_lines(filename, data):
+    if not os.path.exists(filename):
+        return
+    remove = set(data)
+    with open(filename, 'r+', newline='') as csvfile:
+        fcntl.flock(csvfile, fcntl.LOCK_EX)
+        lines = csvfile.readlines()
+        csvfile.seek(0)
+        csvfile.writelines(line for line in lines if line.rstrip('\n') not in remove)
+        csvfile.truncate()
+
 def find_read_pairs(input_dir):
     read_pairs = []
     for file in os.listdir(input_dir):
@@ -120,10 +333,58 @@ def find_read_pairs(input_dir):
     logfile("Pairing input files", f"Read pairs = {len(read_pairs)}", logs)
     return read_pairs
 
+def numpy_trim(read_pair):
+    # True when the in process trimmer is selected and the reads are small enough for it
+    if trim_engine != "numpy":
+        return False
+    size = sum(os.path.getsize(path) for path in (read_pair.read_1, read_pair.read_2))
+    if size > trim_numpy_max_mb * 1024 ** 2:
+        logfile("Trimming", f"{read_pair.name}: {size / 1024 ** 2:.0f} MB of reads, above numpy_max_mb, using bbduk", logs)
+        return False
+    return True
+
+def trim_options():
+    return {
+        "left": 0+trim_length,
+        "right": read_length-trim_length,
+        "min_length": int(minimum_length),
+        "min_quality": float(q_trim),
+        "batch_reads": trim_batch_reads
+    }
+
+def trim_reads(read_pair, out, stage="trim"):
+    # numpy trimming of a pair into out, a path or binary file object, recorded as a tool run of stage
+    inputs = [read_pair.read_1, read_pair.read_2]
+    with metrics.measure(stage, "fastq_trim", inputs):
+        if isinstance(out, str):
+            stats = fastq_trim.trim_file(read_pair.read_1, read_pair.read_2, out, **trim_options())
+        else:
+            stats = fastq_trim.trim_pairs(read_pair.read_1, read_pair.read_2, out, **trim_options())
+    logfile("Trimming", f"{read_pair.name}: {stats}", logs)
+    return stats
+
 def PE_trim(read_pair, outdir):
     read_1 = read_pair.read_1
     read_2 = read_pair.read_2
     outfile = f"{outdir}/{read_pair.name}.fastq"
+    if numpy_trim(read_pair):
+        options = trim_options()
+        command = ["fastq_trim"] + [f"{key}={value}" for key, value in options.items() if key != "batch_reads"]
+        key, restored = cache_lookup(command, "trim", [read_1, read_2], [outfile])
+        try:
+            if not restored:
+                os.makedirs(outdir, exist_ok=True)
+                with scheduler.reserve(*stage_cost("trim_numpy")):
+                    trim_reads(read_pair, outfile)
+                if key is not None:
+                    stage_cache.store(key, [outfile])
+            logfile("Trimming", f"{read_pair.name}: success", logs)
+            return outfile
+        except (OSError, ValueError) as e:
+            cache.remove_path(outfile)
+            logfile("Trimming", f"{read_pair.name}: failed, {e}", logs)
+            return
+
     tl = 0+trim_length
     tr = read_length-trim_length
     command = [
@@ -140,14 +401,54 @@ def PE_trim(read_pair, outdir):
         f"minlength={minimum_length}"
     ]
     try:
-        subprocess.run(command, check=True)
+        run_tool(command, "trim", inputs=[read_1, read_2], outputs=[outfile])
         logfile("Trimming", f"{read_pair.name}: success", logs)
         return outfile
     except subprocess.CalledProcessError:
         logfile("Trimming", f"{read_pair.name}: failed", logs)
 
+def dedupe_options():
+    return {
+        "table_mb": dedupe_table_mb,
+        "batch_reads": dedupe_batch_reads,
+        "swapped": dedupe_swapped
+    }
+
+def dedupe_reads(name, infile, out, stage="dedupe"):
+    # numpy duplicate removal from infile to out, paths or binary file objects, recorded as a tool run of stage
+    inputs = [infile] if isinstance(infile, str) else []
+    with metrics.measure(stage, "fastq_dedupe", inputs):
+        if isinstance(infile, str):
+            stats = fastq_dedupe.dedupe_file(infile, out, **dedupe_options())
+        elif isinstance(out, str):
+            with open(out, 'wb', buffering=1 << 20) as handle:
+                stats = fastq_dedupe.dedupe_pairs(infile, handle, **dedupe_options())
+        else:
+            stats = fastq_dedupe.dedupe_pairs(infile, out, **dedupe_options())
+    logfile("Dedupe", f"{name}: {stats}", logs)
+    if stats.unchecked:
+        logfile("Warning", f"{name}: dedupe table full, raise [dedupe] table_mb to check every pair", logs)
+    return stats
+
 def remove_duplicate_reads(infile, outdir, name):
     outfile = f"{outdir}/{name}.fastq"
+    if dedupe_engine == "numpy":
+        command = ["fastq_dedupe"] + [f"{key}={value}" for key, value in dedupe_options().items() if key != "batch_reads"]
+        key, restored = cache_lookup(command, "dedupe", [infile], [outfile])
+        try:
+            if not restored:
+                os.makedirs(outdir, exist_ok=True)
+                with scheduler.reserve(*stage_cost("dedupe_numpy")):
+                    dedupe_reads(name, infile, outfile)
+                if key is not None:
+                    stage_cache.store(key, [outfile])
+            logfile("Dedupe", f"{name}: success", logs)
+            return outfile
+        except (OSError, ValueError) as e:
+            cache.remove_path(outfile)
+            logfile("Dedupe", f"{name}: failed, {e}", logs)
+            return
+
     command = [
         "dedupe.sh",
         f"-Xmx{memory}",
@@ -158,7 +459,7 @@ def remove_duplicate_reads(infile, outdir, name):
         f"out={outfile}"
     ]
     try:
-        subprocess.run(command, check=True)
+        run_tool(command, "dedupe", inputs=[infile], outputs=[outfile])
         logfile("Dedupe", f"{name}: success", logs)
         return outfile
     except subprocess.CalledProcessError:
@@ -177,13 +478,82 @@ def merge_reads(infile, outdir, name):
         f"outu={outfile_unmerged}"
     ]
     try:
-        subprocess.run(command, check=True)
+        run_tool(command, "merge", inputs=[infile])
         logfile("Merge", f"{name}: success", logs)
         return outfile_merged, outfile_unmerged
     except subprocess.CalledProcessError:
         logfile("Merge fail", f"{name}: failed", logs)
     
     
+def stream_reads(read_pair, dedupe_dir, norm_dir, normalise=True, keep_deduped=True):
+    # Trim, dedupe and normalise connected by pipes, deduped reads are only written when needed downstream
+    name = read_pair.name
+    deduped = f"{dedupe_dir}/{name}.fastq"
+    normalised = f"{norm_dir}/{name}.fastq"
+    tl = 0+trim_length
+    tr = read_length-trim_length
+    commands = []
+    params = {}
+
+    # The numpy engines run in process on threads, in place of the bbduk / dedupe.sh processes
+    if numpy_trim(read_pair):
+        commands.append(lambda input, output: trim_reads(read_pair, output, "stream"))
+        params["fastq_trim"] = trim_options()
+    else:
+        commands.append([
+            "bbduk.sh",
+            f"-Xmx{memory}",
+            "tpe",
+            "tbo",
+            f"in1={read_pair.read_1}",
+            f"in2={read_pair.read_2}",
+            "out=stdout.fq",
+            f"ftl={tl}",
+            f"ftr={tr}",
+            f"minavgquality={q_trim}",
+            f"minlength={minimum_length}"
+        ])
+    if dedupe_engine == "numpy":
+        commands.append(lambda input, output: dedupe_reads(name, input, output or deduped, "stream"))
+        params["fastq_dedupe"] = dedupe_options()
+    else:
+        commands.append([
+            "dedupe.sh",
+            f"-Xmx{memory}",
+            "ac=f",
+            "s=5",
+            "e=2",
+            "int=t",
+            "in=stdin.fq",
+            "out=stdout.fq" if normalise else f"out={deduped}"
+        ])
+    if normalise:
+        if keep_deduped:
+            commands.append(["tee", deduped])
+        commands.append([
+            "bbnorm.sh",
+            f"-Xmx{memory}",
+            "min=5",
+            f"target={target_coverage}",
+            "int=t",
+            "in=stdin.fq",
+            f"out={normalised}"
+        ])
+        outputs = [deduped, normalised] if keep_deduped else [normalised]
+        result = [deduped if keep_deduped else None, normalised]
+    else:
+        outputs = [deduped]
+        result = [deduped, deduped]
+
+    for directory in (dedupe_dir, norm_dir):
+        os.makedirs(directory, exist_ok=True)
+    try:
+        run_pipeline(commands, "stream", inputs=[read_pair.read_1, read_pair.read_2], outputs=outputs, params=params or None)
+        logfile("Streamed trim / dedupe / normalise", f"{name}: success", logs)
+        return result
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        logfile("Streamed trim / dedupe / normalise", f"{name}: failed, {e}", logs)
+
 def normalise_reads(infile, outdir, name):
     outfile = f"{outdir}/{name}.fastq"
     command = [
@@ -195,7 +565,7 @@ def normalise_reads(infile, outdir, name):
         f"out={outfile}"
     ]
     try:
-        subprocess.run(command, check=True)
+        run_tool(command, "normalise", inputs=[infile], outputs=[outfile])
         logfile("Normalise", f"{name}: success", logs)
         return outfile
     except subprocess.CalledProcessError:
@@ -208,7 +578,6 @@ def PE_assembly(reads, outdir, name):
     
     command = [
         "spades.py",
-        "-t", f"{threads}",
         "-m", f"{memory_gb}",
         "--only-assembler",
         "--careful",
@@ -217,7 +586,7 @@ def PE_assembly(reads, outdir, name):
         "--12", f"{reads}"
     ]
     try:
-        subprocess.run(command, check=True)
+        run_tool(command, "assembly", inputs=[reads], outputs=[f"{outdir}/{name}"], thread_flag="-t")
         logfile("Assembly", f"{name}: success", logs)
         return f"{outdir}/{name}/contigs.fasta"
     except subprocess.CalledProcessError:
@@ -242,7 +611,7 @@ def format_genome(infile, outdir, name, filter=False):
         ]
         note = "Formatting"
     try:
-        subprocess.run(command, check=True)
+        run_tool(command, "format", inputs=[infile])
         logfile(note, f"{name}: success", logs)
         return outfile
     except subprocess.CalledProcessError:
@@ -253,55 +622,100 @@ def checkv(infile, outdir, name):
     command = [
         "checkv", "end_to_end",
         f"{infile}",
-        f"{outdir}/{name}"
+        f"{outdir}/{name}",
+        "--restart"
     ]
     try:
-        subprocess.run(command, check=True)
+        run_tool(command, "checkv", inputs=[infile], outputs=[outfile], thread_flag="-t",
+                 params={"database": os.environ.get("CHECKVDB")})
         logfile("CheckV", f"{name}: success", logs)
         return outfile
     except subprocess.CalledProcessError:
         logfile("CheckV", f"{name}: failed", logs)
 
 def find_complete_genomes(checkv, name):
-    genomes = []
-    with open(checkv) as tsvfile:
-        read = csv.reader(tsvfile, delimiter='\t')
-        next(read)
-        for row in read:
-            genomes.append(row[0])
-    genomes = tuple(genomes)
+    genomes = checkv_results.load(os.path.dirname(checkv)).complete_genomes()
     logfile("Finding complete genomes", name, logs)
     return genomes
 
 def find_hq_genomes(checkv, name):
-    genomes = []
-    with open(checkv) as tsvfile:
-        read = csv.reader(tsvfile, delimiter='\t')
-        next(read)
-        for row in read:
-            if 'High-quality' == row[7]:
-                genomes.append(row[0])
-    genomes = tuple(genomes)
+    genomes = checkv_results.load(os.path.dirname(checkv)).hq_genomes()
     logfile("Finding high-quality genomes", name, logs)
     return genomes
-    
+
+def find_genomes(checkv, name):
+    # Complete and high-quality contigs from one read of the CheckV tables, without duplicates
+    results = checkv_results.load(checkv)
+    genomes = results.selected()
+    logfile("Finding complete and high-quality genomes", f"{name}: {len(results.complete_genomes())} complete, {len(results.hq_genomes())} high-quality", logs)
+    return genomes
+
+def extract_genomes(contigs, headers, outdir, name):
+    # All headers are extracted through one .fai index, without parsing every record
+    sequences = fasta.fetch(contigs, headers)
+    outfiles = {}
+    for header in headers:
+        if header not in sequences:
+            logfile("Genome not found", f"{name}_{header}", logs)
+            continue
+        outfile = f"{outdir}/{name}_{header}.fasta"
+        phage = f"{name}_{header}"
+        with open(outfile, 'w') as textfile:
+            textfile.write(f">{phage}\n{sequences[header].decode()}\n\n")
+        logfile("Genome extracted", phage, logs)
+        outfiles[header] = outfile
+    return outfiles
+
 def extract_genome(contigs, header, outdir, name):
-    outfile = f"{outdir}/{name}_{header}.fasta"
-    phage = f"{name}_{header}"
-    handle = open(contigs)
-    textfile = open(outfile, 'w')
-    entries = list(SimpleFastaParser(handle)) 
-    for name, seq in entries: 	
-        if header in name: 		
-            print(f">{phage}\n{seq}\n", file=textfile)
-            logfile("Genome extracted", phage, logs)
-            return outfile
+    return extract_genomes(contigs, [header], outdir, name).get(header)
+
+def build_index(genome, path):
+    # bbmap with no reads only writes the reference index to path
+    command = [
+        "bbmap.sh",
+        f"-Xmx{memory}",
+        f"ref={genome}",
+        f"path={path}"
+    ]
+    run_tool(command, "mapping", inputs=[genome])
+
+def reference_index(genome):
+    # Cached index directory for genome, None when the index cache is disabled or fails
+    if host_indexes is None:
+        return None
+    try:
+        return host_indexes.get(genome, build_index)
+    except (OSError, RuntimeError, subprocess.CalledProcessError) as e:
+        logfile("Host index", f"{os.path.basename(genome)}: {e}", logs)
+        return None
 
-def map_reads(genome, reads, outdir, name):
+def run_split(command, contigs, outdir, inputs=()):
+    # bbmap writes SAM to stdout, the reads are split per contig as they arrive
+    with scheduler.reserve(*stage_cost("mapping")) as cpus:
+        started = time.monotonic()
+        process = metrics.watch(subprocess.Popen(command + [f"t={cpus}"], stdout=subprocess.PIPE))
+        try:
+            counts = read_split.split_sam(process.stdout, contigs, outdir)
+        finally:
+            process.stdout.close()
+            code = metrics.wait(process, "mapping", started, inputs)
+    if code != 0:
+        raise subprocess.CalledProcessError(code, command)
+    return counts
+
+def separated_reads(mapping_dir, contig):
+    # (mapped, unmapped) reads for contig from a map_reads run with separate, None if it was not separated
+    paths = read_split.read_paths(os.path.join(mapping_dir, "separated"), contig)
+    if all(os.path.exists(path) for path in paths):
+        return paths
+    return None
+
+def map_reads(genome, reads, outdir, name, index=None, separate=()):
+    # With separate, the same alignment also writes mapped / unmapped reads for each of those contigs
     
     # Output dir
     out = os.path.join(outdir, name)
-    os.makedirs(out)
+    os.makedirs(out, exist_ok=True)
     
     # Output files
     covstats = os.path.join(out, "covstats.tsv")
@@ -314,23 +728,40 @@ def map_reads(genome, reads, outdir, name):
     command = [
         "bbmap.sh", 
         f"-Xmx{memory}",
-        f"ref={genome}",
+        f"path={index}" if index else f"ref={genome}",
         f"in={reads}",
         f"covstats={covstats}",
         f"basecov={basecov}",
         f"scafstats={scafstats}"
     ]
     try:
-        subprocess.run(command, check=True)
+        if separate:
+            separated = os.path.join(out, "separated")
+            cache.remove_path(separated)
+            counts = run_split(command + ["out=stdout.sam", "trd=t"], separate, separated, inputs=[genome, reads])
+            for contig, count in counts.items():
+                logfile("Read extraction", f"{name}_{contig}: {count} pairs", logs)
+        else:
+            run_tool(command, "mapping", inputs=[genome, reads])
         logfile("Read mapping", f"{name}: success", logs)
     except subprocess.CalledProcessError:
         logfile("Read mapping", f"{name}: failed", logs)
+        return
+
+    # Converting per base coverage to the binary store
+    try:
+        base_coverage.convert(basecov, os.path.join(out, base_coverage.store_name))
+        if not keep_basecov:
+            os.remove(basecov)
+    except (OSError, ValueError) as e:
+        logfile("Coverage store", f"{name}: {e}", logs)
+    return out
 
 def separate_reads(genome, reads, outdir, name):
     
     # Output dir
     out = os.path.join(outdir, name)
-    os.makedirs(out)
+    os.makedirs(out, exist_ok=True)
     
     # Output files
     mapped = os.path.join(out, "mapped.fastq.gz")
@@ -346,7 +777,7 @@ def separate_reads(genome, reads, outdir, name):
         f"outu={unmapped}"
     ]
     try:
-        subprocess.run(command, check=True)
+        run_tool(command, "mapping", inputs=[genome, reads])
         logfile("Read extraction", f"{name}: success", logs)
     except subprocess.CalledProcessError:
         logfile("Read extraction", f"{name}: failed", logs)
@@ -361,7 +792,7 @@ def fastqc(reads, outdir):
         f"{outdir}"
     ]
     try:
-        subprocess.run(command, check=True)
+        run_tool(command, "fastqc", inputs=[reads], thread_flag=None)
         logfile("Reads QC", "success", logs)
     except subprocess.CalledProcessError:
         logfile("Reads QC", "failed", logs)
@@ -371,46 +802,43 @@ def barcode_phage(original, tag, outdir):
     new_file_path = os.path.join(outdir, tag)
 
     try:
-        # Read original
-        with open(original, 'r') as original_file:
-            original_record = SeqIO.read(original_file, 'fasta')
-
-        # Update header
-        original_record.id = tag
-        original_record.description = tag
-
-        # Write barcode file
-        with open(f'{new_file_path}.fasta', 'w') as new_file:
-            SeqIO.write(original_record, new_file, 'fasta')
-
-        # Append to log
+        sequence = barcode.read_single(original)
+        barcode.write_fasta(f'{new_file_path}.fasta', tag, sequence)
         logfile("BARCODE", f"{original_name}:{tag}", logs)
     except Exception as e:
         logfile("BARCODE ERROR", f"ERROR: {original_name}{e}", logs)
 
+def barcode_batch(indir, outdir, index):
+    # Tags every genome in indir, writing the barcoded files and index in one pass
+    batch = barcode.BarcodeBatch(prefix, barcode_length, deterministic_tags)
+    files = [os.path.join(indir, file) for file in os.listdir(indir)]
+    tagged, errors = batch.run(files, outdir, index)
+    for name, tag in tagged:
+        logfile("BARCODE", f"{name}:{tag}", logs)
+    for name, error in errors:
+        logfile("BARCODE ERROR", f"ERROR: {name}{error}", logs)
+    return tagged
+
+def load_host_mapping(mapping_file):
+    # The mapping csv is read once per process and kept
+    if mapping_file not in host_maps:
+        host_maps[mapping_file] = host_index.load_mapping(mapping_file, input_dir)
+    return host_maps[mapping_file]
+
 def host_csv_scan(mapping_file, read_1, read_2):
     
     # Initialising
-    host = None
     r1 = os.path.basename(read_1)
-    r2 = os.path.basename(read_2)
     
-    # Grabbing host from row
-    with open(mapping_file, newline='') as file:
-        reader = csv.reader(file, delimiter=',', quotechar='|')
-        for row in reader:
-            if row[0] == 'host':
-                continue
-            elif r1 == row[1] and r2 == row[2]:
-                host = row[0]
-                break
+    # Grabbing host from the loaded table
+    host = load_host_mapping(mapping_file).lookup(read_1, read_2)
     
     # Checking if host was found
     if host is None:
         logfile("No host identified", f"---", logs)
         return None
     else:
-        path = os.path.join("/assemble/input", host)
+        path = os.path.join(input_dir, host)
     
         # Checking path to host exists
         if os.path.exists(path):
@@ -422,59 +850,29 @@ def host_csv_scan(mapping_file, read_1, read_2):
 
 
 def covstat_filter(header, covstat):
-    cov = None
+    # covstat is a table from mapstats.load_table, a path is loaded on the spot
     cut = int(target_coverage * 0.8)
-    # Obtaining covstat
-    with open(covstat, newline='') as file:
-        reader = csv.reader(file, delimiter='\t', quotechar='|')
-        for row in reader:
-            if row[0] == header:
-                cov = float(row[1])
-                break
-    # Return value
-    if cov is None:
-        return None
-    
-    if cov:
-        return cov, cut
+    if not isinstance(covstat, mapstats.StatsTable):
+        covstat = mapstats.load_table(covstat)
+    cov = covstat.value(header, 1)
+    return cov, cut
 
 def scafstat_filter(header, scafstat):
-    perc_mapped = None
-    # Obtaining unambig % mapped reads
-    with open(scafstat, newline='') as file:
-        reader = csv.reader(file, delimiter='\t', quotechar='|')
-        for row in reader:
-            if row[0] == header:
-                perc_mapped = float(row[1])
-    # Return value
-    if perc_mapped is None:
-        return None
-    
-    if perc_mapped:
-        return perc_mapped, 90
+    # Obtaining unambig % mapped reads, the last row for a contig is used
+    if not isinstance(scafstat, mapstats.StatsTable):
+        scafstat = mapstats.load_table(scafstat, keep="last")
+    perc_mapped = scafstat.value(header, 1)
+    return perc_mapped, 90
 
 def contig_scan(contigs, mapped=True):
-    records = []
-    seqs = []
-    # Read original
-    for record in SeqIO.parse(contigs, 'fasta'):
-        records.append(len(record.seq))
-        
-        # Keep records for checking downstream
-        if len(record.seq) > 1000:
-            seqs.append(record)
-    
-    # Setting check status
+    # Lengths are counted from the raw FASTA bytes, no sequence records are built
+    records = fasta.scan_lengths(contigs)
+
+    # Setting status, mapped assemblies are only checked past the first contig
     if mapped:
-        if any(value > 1000 for value in records[1:]):
-            check = True
-        else:
-            check = False
+        check = fasta.count_over(records, 1000, skip=1) > 0
     else:
-        if any(value > 1000 for value in records):
-            check = True
-        else:
-            check = False
+        check = fasta.count_over(records, 1000) > 0
 
     # Get info
     try:
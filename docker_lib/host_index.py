@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# Host mapping table read once, and bbmap reference indexes built once per host genome
+
+import os
+import csv
+import fcntl
+import cache
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class HostMap(object):
+    def __init__(self, hosts, input_dir):
+        self.hosts = hosts;
+        self.input_dir = input_dir;
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def lookup(self, read_1, read_2):
+        # Host file name for a read pair, None if the pair is not in the table
+        return self.hosts.get((os.path.basename(read_1), os.path.basename(read_2)))
+
+    def path(self, host):
+        return os.path.join(self.input_dir, host)
+
+class IndexCache(object):
+    def __init__(self, root):
+        self.root = root
+        self.digests = {}
+
+    def key(self, host):
+        # Content hash of the host genome, remembered per size, mtime and inode
+        stat = os.stat(host)
+        ident = (os.path.realpath(host), stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        if ident not in self.digests:
+            self.digests[ident] = cache.hash_path(host)
+        return self.digests[ident]
+
+    def index_dir(self, host):
+        return os.path.join(self.root, self.key(host))
+
+    def get(self, host, build):
+        # Returns the index directory for host, calling build(host, directory) if it does not exist yet
+        directory = self.index_dir(host)
+        if ready(directory):
+            os.utime(directory)
+            return directory
+
+        # One process builds each index, others wait on the lock and reuse it
+        os.makedirs(self.root, exist_ok=True)
+        with open(f"{directory}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not ready(directory):
+                tmp = f"{directory}.tmp"
+                cache.remove_path(tmp)
+                build(host, tmp)
+                if not ready(tmp):
+                    cache.remove_path(tmp)
+                    raise RuntimeError(f"No index was built for {host}")
+                cache.remove_path(directory)
+                os.replace(tmp, directory)
+        return directory
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def load_mapping(mapping_file, input_dir="/assemble/input"):
+    # (read_1, read_2) -> host, the first row for a pair wins like the original scan
+    hosts = {}
+    with open(mapping_file, newline='') as file:
+        reader = csv.reader(file, delimiter=',', quotechar='|')
+        for row in reader:
+            if len(row) < 3 or row[0] == 'host':
+                continue
+            hosts.setdefault((row[1], row[2]), row[0])
+    return HostMap(hosts, input_dir)
+
+def ready(directory):
+    # bbmap writes the genome summary once the index is complete
+    return os.path.exists(os.path.join(directory, "ref", "genome", "1", "summary.txt"))
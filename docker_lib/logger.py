@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# Buffered log writer, entries are queued and written in batches by a background thread
+
+import os
+import json
+import time
+import fcntl
+import queue
+import atexit
+import datetime
+import threading
+import multiprocessing.util
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class Logger(object):
+    def __init__(self, path, image, jsonl=False, interval=1.0, batch_size=512):
+        self.path = path
+        self.image = image
+        self.jsonl_path = f"{os.path.splitext(path)[0]}.jsonl" if jsonl else None
+        self.interval = interval
+        self.batch_size = batch_size
+        self._reset()
+        atexit.register(self.close)
+        os.register_at_fork(before=self.flush)
+        multiprocessing.util.register_after_fork(self, Logger._reset)
+
+    def _reset(self):
+        # Threads do not survive a fork, each process gets its own queue and writer
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = None
+        if multiprocessing.parent_process() is not None:
+            multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+    def log(self, function, text):
+        if self.pid != os.getpid():
+            self._reset()
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._run, daemon=True)
+                    self.thread.start()
+        self.queue.put((time.time(), function, text))
+
+    def flush(self):
+        if self.thread is None or self.pid != os.getpid():
+            return
+        # Waiting in steps rather than queue.join(), a writer that died would never drain the queue
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks and self.thread.is_alive():
+                self.queue.all_tasks_done.wait(0.1)
+
+    def close(self):
+        if self.thread is None or self.pid != os.getpid():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+
+            # Collecting entries until the batch is full or the interval has passed
+            while item is not None and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            entries = [entry for entry in batch if entry is not None]
+            try:
+                self._write(entries)
+            except Exception as e:
+                print(f"Could not write to {self.path}: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _write(self, entries):
+        if not entries:
+            return
+        lines = []
+        records = []
+        for stamp, function, text in entries:
+            date_time = datetime.datetime.fromtimestamp(stamp).strftime("%Y-%m-%d %H:%M:%S")
+            lines.append(f"\n[{self.image}]\t[{date_time}]\t[{function}]\t[{text}]")
+            if self.jsonl_path is not None:
+                records.append(json.dumps({
+                    "image": self.image,
+                    "time": date_time,
+                    "function": function,
+                    "text": str(text),
+                    "pid": self.pid,
+                }) + "\n")
+        append(self.path, "".join(lines))
+        if self.jsonl_path is not None:
+            append(self.jsonl_path, "".join(records))
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def append(path, text, header=None):
+    # One locked write per batch keeps lines from concurrent workers whole, header starts an empty file
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if header is not None and os.fstat(fd).st_size == 0:
+            text = header + text
+        data = text.encode(errors="backslashreplace")
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+    finally:
+        os.close(fd)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# Indexed tables for bbmap covstats / scafstats output, read once per sample
+
+import os
+import csv
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class StatsTable(object):
+    def __init__(self, names, columns, index):
+        self.names = names;
+        self.columns = columns;
+        self.index = index;
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, contig):
+        return contig in self.index
+
+    def value(self, contig, column):
+        # Column can be a header name or a position, None if the contig is not in the table
+        i = self.index.get(contig)
+        if i is None:
+            return None
+        if isinstance(column, int):
+            column = self.header[column]
+        return self.columns[column][i]
+
+    @property
+    def header(self):
+        return list(self.columns)
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def load_table(path, keep="first"):
+    # Reads a bbmap stats tsv into columns keyed by header, with a contig ID -> row index
+    names = []
+    columns = {}
+    index = {}
+    if path is None or not os.path.exists(path):
+        return StatsTable(names, columns, index)
+
+    with open(path, newline='') as file:
+        reader = csv.reader(file, delimiter='\t', quotechar='|')
+        header = None
+        for row in reader:
+            if not row:
+                continue
+            if header is None and row[0].startswith('#'):
+                header = [row[0].lstrip('#')] + row[1:]
+                columns = {name: [] for name in header}
+                continue
+            if header is None:
+                header = [f"column_{i}" for i in range(len(row))]
+                columns = {name: [] for name in header}
+
+            contig = row[0]
+            row = [contig] + [_number(value) for value in row[1:]]
+            row = row + [None] * (len(header) - len(row))
+            if contig in index and keep == "first":
+                continue
+            if contig not in index:
+                index[contig] = len(names)
+                names.append(contig)
+                for name, value in zip(header, row):
+                    columns[name].append(value)
+            else:
+                # keep == "last", later rows replace earlier ones
+                i = index[contig]
+                for name, value in zip(header, row):
+                    columns[name][i] = value
+
+    return StatsTable(names, columns, index)
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
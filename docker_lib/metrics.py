@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+# Resource use of external tools, wall and cpu time, peak memory and disk io per process
+
+import os
+import json
+import time
+import datetime
+import resource
+import threading
+import contextlib
+import subprocess
+import logger
+from Phanatic.metrics import fields
+
+# Sample and stage graph step the next tool runs belong to
+context = {"sample": "", "step": ""}
+
+# Per thread cpu time where the platform has it
+thread_usage = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+
+# Written when configured, rows are appended by every worker process
+tsv_path = None
+jsonl_path = None
+
+# /proc/<pid>/task/<tid>/children needs CONFIG_PROC_CHILDREN, without it descendants come from a scan of /proc
+proc_children = os.path.exists(f"/proc/self/task/{os.getpid()}/children")
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class PeakMonitor(object):
+    # Samples the peak resident memory (VmHWM) of each watched tool and its descendants on one thread.
+    # wait4's ru_maxrss cannot be used, Linux carries the forking worker's peak across exec into it
+    def __init__(self, interval=0.1, scan_interval=1.0):
+        self.interval = interval
+        self.scan_interval = scan_interval
+        self.peaks = {}
+        self.lock = threading.Lock()
+        self.pid = None
+        self.children = {}
+        self.scanned = 0
+
+    def watch(self, pid):
+        # Called once Popen has returned, the child has exec'd so its memory is the tool's own
+        with self.lock:
+            self.peaks[pid] = 0
+        self.sample([pid])
+        if self.pid != os.getpid():
+            # Threads do not survive a fork, each worker process starts its own sampler
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def release(self, pid):
+        # Peak in kB of the largest process in the tool's tree
+        with self.lock:
+            return self.peaks.pop(pid, 0)
+
+    def sample(self, pids):
+        # Only the watched trees are walked. The fallback scan of every process is reused between
+        # samples and repeated at most once per scan_interval
+        if not proc_children and time.monotonic() - self.scanned >= self.scan_interval:
+            self.children = child_map()
+            self.scanned = time.monotonic()
+        for pid in pids:
+            members = descendants(pid) if proc_children else tree(pid, self.children)
+            peak = max((read_hwm(member) for member in members), default=0)
+            with self.lock:
+                if pid in self.peaks:
+                    self.peaks[pid] = max(self.peaks[pid], peak)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                pids = list(self.peaks)
+            if pids:
+                self.sample(pids)
+            time.sleep(self.interval)
+
+# Peak memory of running tools
+monitor = PeakMonitor()
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def configure(path, jsonl=False, interval=None):
+    global tsv_path, jsonl_path
+    tsv_path = path
+    jsonl_path = f"{os.path.splitext(path)[0]}.jsonl" if path and jsonl else None
+    if interval:
+        monitor.interval = interval
+
+@contextlib.contextmanager
+def label(**values):
+    # Tool runs inside the block are recorded against these values
+    previous = dict(context)
+    context.update({key: value or "" for key, value in values.items()})
+    try:
+        yield
+    finally:
+        context.clear()
+        context.update(previous)
+
+def input_bytes(paths):
+    total = 0
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+            else:
+                total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+def read_io(pid):
+    # /proc/<pid>/io of an exited but not yet reaped process, includes its reaped children.
+    # "thread-self" reads the counters of the calling thread
+    counters = {}
+    try:
+        with open(f"/proc/{pid}/io") as file:
+            for line in file:
+                key, _, value = line.partition(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+def read_hwm(pid):
+    # Peak resident memory in kB from /proc/<pid>/status, 0 once the process has exited
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+def descendants(pid):
+    # pid and every process below it, from the children list of each thread of each member
+    members = [pid]
+    for member in members:
+        try:
+            tasks = os.listdir(f"/proc/{member}/task")
+        except OSError:
+            continue
+        for task in tasks:
+            try:
+                with open(f"/proc/{member}/task/{task}/children") as file:
+                    members.extend(int(child) for child in file.read().split())
+            except (OSError, ValueError):
+                pass
+    return members
+
+def child_map():
+    # {parent pid: [child pids]} from /proc/<pid>/stat, the comm field may hold spaces so ppid follows the last ")"
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as file:
+                ppid = int(file.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+def tree(pid, children):
+    members = [pid]
+    for member in members:
+        members.extend(children.get(member, []))
+    return members
+
+def watch(process):
+    # Starts sampling the peak memory of a tool started with Popen, wait collects it
+    monitor.watch(process.pid)
+    return process
+
+def wait(process, stage, started, inputs=()):
+    # Reaps process with wait4 for its cpu time, records the run and returns the exit code
+    io = {}
+    try:
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        io = read_io(process.pid)
+    except (AttributeError, ChildProcessError, InterruptedError):
+        pass
+    peak = monitor.release(process.pid)
+    try:
+        pid, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait()
+    wall = time.monotonic() - started
+    code = os.waitstatus_to_exitcode(status)
+    process.returncode = code
+
+    args = process.args if isinstance(process.args, list) else [process.args]
+    record(tool_row(stage, os.path.basename(str(args[0])), process.pid, code, wall,
+                    usage.ru_utime, usage.ru_stime, peak, io, inputs))
+    return code
+
+def run(command, stage, inputs=(), **kwargs):
+    # subprocess.run(command, check=True) with the process resources recorded
+    started = time.monotonic()
+    process = watch(subprocess.Popen(command, **kwargs))
+    try:
+        code = wait(process, stage, started, inputs)
+    except BaseException:
+        monitor.release(process.pid)
+        process.kill()
+        process.wait()
+        raise
+    if code != 0:
+        raise subprocess.CalledProcessError(code, command)
+
+@contextlib.contextmanager
+def measure(stage, tool, inputs=()):
+    # Work done in process on the calling thread, recorded like a tool run. The memory recorded is
+    # how far the process peak rose during the block, work on other threads at the same time counts too
+    started = time.monotonic()
+    before = resource.getrusage(thread_usage)
+    io_before = read_io("thread-self")
+    peak_before = read_hwm("self")
+    code = 1
+    try:
+        yield
+        code = 0
+    finally:
+        usage = resource.getrusage(thread_usage)
+        io = {key: value - io_before.get(key, 0) for key, value in read_io("thread-self").items()}
+        record(tool_row(stage, tool, os.getpid(), code, time.monotonic() - started,
+                        usage.ru_utime - before.ru_utime, usage.ru_stime - before.ru_stime,
+                        read_hwm("self") - peak_before, io, inputs))
+
+def tool_row(stage, tool, pid, code, wall, user, system, peak_kb, io, inputs):
+    return {
+        "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "sample": context["sample"],
+        "step": context["step"],
+        "stage": stage,
+        "tool": tool,
+        "pid": pid,
+        "exit_code": code,
+        "wall_s": round(wall, 3),
+        "user_s": round(user, 3),
+        "sys_s": round(system, 3),
+        "max_rss_mb": round(peak_kb / 1024, 1),
+        "read_bytes": io.get("read_bytes", 0),
+        "write_bytes": io.get("write_bytes", 0),
+        "rchar": io.get("rchar", 0),
+        "wchar": io.get("wchar", 0),
+        "input_bytes": input_bytes(inputs),
+    }
+
+def record(row):
+    if tsv_path is None:
+        return
+    try:
+        logger.append(tsv_path, "\t".join(str(row[field]) for field in fields) + "\n",
+                      header="\t".join(fields) + "\n")
+        if jsonl_path is not None:
+            logger.append(jsonl_path, json.dumps(row) + "\n")
+    except OSError as e:
+        print(f"Could not write to {tsv_path}: {e}")
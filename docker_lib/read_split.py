@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# Splits bbmap SAM output into per contig read sets, so one alignment serves every genome
+
+import os
+import gzip
+import shutil
+
+# SAM flags
+paired_first = 0x40
+paired_second = 0x80
+unmapped = 0x4
+reverse = 0x10
+not_primary = 0x100 | 0x800
+
+complement = bytes.maketrans(b"ACGTNacgtn", b"TGCANtgcan")
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class ReadSplitter(object):
+    def __init__(self, contigs, outdir, compresslevel=1):
+        self.contigs = list(dict.fromkeys(contigs))
+        self.outdir = outdir
+        self.compresslevel = compresslevel
+        self.bucket_dir = os.path.join(outdir, ".buckets")
+        self.buckets = {}
+        self.counts = {}
+        shutil.rmtree(self.bucket_dir, ignore_errors=True)
+        os.makedirs(self.bucket_dir)
+        self.wanted = {contig.encode(): contig for contig in self.contigs}
+
+    def bucket(self, key):
+        # Pairs are written once, to the bucket of the candidate contigs they mapped to
+        if key not in self.buckets:
+            path = os.path.join(self.bucket_dir, f"{len(self.buckets)}.fastq.gz")
+            self.buckets[key] = gzip.open(path, 'wb', compresslevel=self.compresslevel)
+            self.counts[key] = 0
+        return self.buckets[key]
+
+    def add(self, records):
+        # records are the primary SAM lines of one template, as (flag, rname, fastq bytes)
+        key = frozenset(self.wanted[rname] for flag, rname, fastq in records
+                        if not flag & unmapped and rname in self.wanted)
+        self.bucket(key).write(b"".join(fastq for flag, rname, fastq in records))
+        self.counts[key] += 1
+
+    def finish(self):
+        # Mapped reads for a contig are the buckets that include it, unmapped reads are all the others.
+        # Gzip members concatenate, so the per contig files are joined without recompressing
+        for handle in self.buckets.values():
+            handle.close()
+        paths = {key: handle.name for key, handle in self.buckets.items()}
+        totals = {}
+        for contig in self.contigs:
+            mapped_path, unmapped_path = read_paths(self.outdir, contig)
+            os.makedirs(os.path.dirname(mapped_path), exist_ok=True)
+            _join([path for key, path in paths.items() if contig in key], mapped_path)
+            _join([path for key, path in paths.items() if contig not in key], unmapped_path)
+            totals[contig] = sum(count for key, count in self.counts.items() if contig in key)
+        shutil.rmtree(self.bucket_dir, ignore_errors=True)
+        return totals
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def read_paths(outdir, contig):
+    # (mapped, unmapped) read files for one contig
+    directory = os.path.join(outdir, contig.replace(os.sep, "_"))
+    return os.path.join(directory, "mapped.fastq.gz"), os.path.join(directory, "unmapped.fastq.gz")
+
+def fastq(fields, flag):
+    # SAM stores reverse strand alignments reverse complemented, FASTQ gets the read as sequenced
+    name, seq, qual = fields[0], fields[9], fields[10]
+    if flag & reverse:
+        seq = seq.translate(complement)[::-1]
+        qual = qual[::-1]
+    if qual == b"*":
+        qual = b"I" * len(seq)
+    if flag & paired_first:
+        name += b"/1"
+    elif flag & paired_second:
+        name += b"/2"
+    return b"@" + name + b"\n" + seq + b"\n+\n" + qual + b"\n"
+
+def split_sam(stream, contigs, outdir, compresslevel=1):
+    # Reads a SAM stream once, returns {contig: read pairs mapped}
+    splitter = ReadSplitter(contigs, outdir, compresslevel)
+    template = None
+    records = []
+    for line in stream:
+        if line.startswith(b"@"):
+            continue
+        fields = line.rstrip(b"\r\n").split(b"\t", 11)
+        if len(fields) < 11:
+            continue
+        flag = int(fields[1])
+        if flag & not_primary:
+            continue
+
+        # Mates are written next to each other, a new name starts the next template
+        if fields[0] != template and records:
+            splitter.add(records)
+            records = []
+        template = fields[0]
+        rname = fields[2].split(None, 1)[0] if fields[2] else fields[2]
+        records.append((flag, rname, fastq(fields, flag)))
+    if records:
+        splitter.add(records)
+    return splitter.finish()
+
+def _join(sources, destination):
+    with open(destination, 'wb') as out:
+        for source in sources:
+            with open(source, 'rb') as file:
+                shutil.copyfileobj(file, out, 1024 * 1024)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Resource scheduler for running samples concurrently
+
+import os
+import sys
+import contextlib
+import multiprocessing
+import traceback
+
+# Budget shared with each worker process by the pool initialiser
+_budget = None
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class ResourceBudget(object):
+    def __init__(self, cpus, memory_mb, context=None):
+        if context is None:
+            context = multiprocessing.get_context("fork")
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.condition = context.Condition()
+        self.free_cpus = context.Value('i', cpus, lock=False)
+        self.free_memory = context.Value('i', memory_mb, lock=False)
+
+    def acquire(self, cpus, memory_mb):
+        # Requests larger than the whole machine are clamped so they can still run alone
+        cpus = max(1, min(cpus, self.cpus))
+        memory_mb = max(0, min(memory_mb, self.memory_mb))
+        with self.condition:
+            while self.free_cpus.value < cpus or self.free_memory.value < memory_mb:
+                self.condition.wait()
+            self.free_cpus.value -= cpus
+            self.free_memory.value -= memory_mb
+        return cpus, memory_mb
+
+    def release(self, cpus, memory_mb):
+        with self.condition:
+            self.free_cpus.value += cpus
+            self.free_memory.value += memory_mb
+            self.condition.notify_all()
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def parse_memory(value):
+    # Converts java style memory strings (24000m, 24g) to MB
+    value = str(value).strip().lower()
+    units = {"k": 1 / 1024, "m": 1, "g": 1024, "t": 1024 * 1024}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(int(value) / (1024 * 1024))
+
+def system_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def system_memory():
+    # Physical memory in MB
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024))
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+def init_worker(budget):
+    global _budget
+    _budget = budget
+
+@contextlib.contextmanager
+def reserve(cpus, memory_mb):
+    # Blocks until the budget can hold the stage, yields the cpus granted
+    if _budget is None:
+        yield cpus
+        return
+    granted = _budget.acquire(cpus, memory_mb)
+    try:
+        yield granted[0]
+    finally:
+        _budget.release(*granted)
+
+def _run_task(task):
+    func, item = task
+    try:
+        return item, func(item), None
+    except BaseException:
+        # SystemExit from a worker would otherwise leave the pool waiting forever
+        return item, None, traceback.format_exc()
+
+def _results(func, items, workers, budget, ordered):
+    tasks = [(func, item) for item in items]
+
+    # Serial run in this process
+    if workers <= 1 or len(items) <= 1:
+        init_worker(budget)
+        yield from map(_run_task, tasks)
+        return
+
+    context = multiprocessing.get_context("fork")
+    pool = context.Pool(processes=min(workers, len(items)),
+                        initializer=init_worker,
+                        initargs=(budget,))
+    try:
+        if ordered:
+            yield from pool.imap(_run_task, tasks)
+        else:
+            yield from pool.imap_unordered(_run_task, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def run_samples(func, items, workers, budget=None):
+    failed = []
+    for item, result, error in _results(func, items, workers, budget, ordered=False):
+        if error is not None:
+            print(error, file=sys.stderr)
+            failed.append((item, error))
+    return failed
+
+def map_samples(func, items, workers, budget=None):
+    # Returns [(item, result, error)] in the order of items
+    results = []
+    for item, result, error in _results(func, list(items), workers, budget, ordered=True):
+        if error is not None:
+            print(error, file=sys.stderr)
+        results.append((item, result, error))
+    return results
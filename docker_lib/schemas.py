@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# Column types for the tables merged by the finisher, and typed CSV / Parquet output
+
+import os
+import pandas as pd
+
+# Columns repeated on every row, stored once per value
+categories = ["sample", "contig_id", "contig_name", "checkv_quality", "miuvig_quality",
+              "completeness_method", "sample_status", "mapped_status", "provirus"]
+
+# bbmap covstats
+covstats = {
+    "#ID": "string",
+    "Avg_fold": "float64",
+    "Length": "Int64",
+    "Ref_GC": "float32",
+    "Covered_percent": "float32",
+    "Covered_bases": "Int64",
+    "Plus_reads": "Int64",
+    "Minus_reads": "Int64",
+    "Read_GC": "float32",
+    "Median_fold": "Int64",
+    "Std_Dev": "float64",
+}
+
+# bbmap scafstats
+scafstats = {
+    "#name": "string",
+    "%unambiguousReads": "float32",
+    "unambiguousMB": "float32",
+    "%ambiguousReads": "float32",
+    "ambiguousMB": "float32",
+    "unambiguousReads": "Int64",
+    "ambiguousReads": "Int64",
+    "assignedReads": "Int64",
+    "assignedBases": "Int64",
+}
+
+# CheckV quality_summary, completeness and contamination
+checkv = {
+    "contig_id": "string",
+    "contig_length": "Int64",
+    "provirus": "string",
+    "proviral_length": "Int64",
+    "gene_count": "Int64",
+    "viral_genes": "Int64",
+    "host_genes": "Int64",
+    "checkv_quality": "string",
+    "miuvig_quality": "string",
+    "completeness": "float32",
+    "completeness_method": "string",
+    "contamination": "float32",
+    "kmer_freq": "float32",
+    "warnings": "string",
+    "aai_expected_length": "float64",
+    "aai_completeness": "float32",
+    "aai_confidence": "string",
+    "aai_error": "float32",
+    "aai_num_hits": "Int64",
+    "aai_top_hit": "string",
+    "aai_id": "float32",
+    "aai_af": "float32",
+    "hmm_completeness_lower": "float32",
+    "hmm_completeness_upper": "float32",
+    "hmm_num_hits": "Int64",
+    "total_genes": "Int64",
+    "host_length": "Int64",
+    "region_types": "string",
+    "region_lengths": "string",
+    "region_coords_bp": "string",
+    "region_coords_genes": "string",
+}
+
+# Summary tables written by the coordinator
+sample_summary = {
+    "sample": "string",
+    "genomes": "Int64",
+    "sample_status": "string",
+}
+
+contig_summary = {
+    "sample": "string",
+    "contig_name": "string",
+    "normalised_seq_depth": "float64",
+    "QC_seq_depth": "float64",
+    "phage_QC_mapped_(%)": "float32",
+    "mapped_status": "string",
+}
+
+host_coverage = {
+    "sample": "string",
+    "contig_id": "string",
+    "length": "Int64",
+    "mean_coverage": "float64",
+    "lowest_window_mean": "float64",
+    "zero_coverage_bases": "Int64",
+    "zero_coverage_windows": "Int64",
+}
+
+# Every known column, used for merged tables
+columns = {}
+for schema in (covstats, scafstats, checkv, sample_summary, contig_summary, host_coverage):
+    columns.update(schema)
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def column_type(name, schema=None):
+    # Merge suffixes (_x / _y) keep the type of the original column
+    schema = columns if schema is None else schema
+    if name in schema:
+        return schema[name]
+    if name[-2:] in ("_x", "_y") and name[:-2] in schema:
+        return schema[name[:-2]]
+    return None
+
+def read_csv(path, schema, **kwargs):
+    # Columns named in the schema are parsed as their type, anything new is left to pandas
+    header = pd.read_csv(path, nrows=0, **kwargs).columns
+    dtype = {name: schema[name] for name in header if name in schema}
+    try:
+        return pd.read_csv(path, dtype=dtype, **kwargs)
+    except (TypeError, ValueError):
+        # Values that do not fit a column type, cast what can be cast after reading
+        return apply(pd.read_csv(path, **kwargs), schema)
+
+def apply(df, schema=None):
+    # Casts known columns and stores repeated text columns as categoricals
+    types = {}
+    for name in df.columns:
+        kind = column_type(name, schema)
+        base = name[:-2] if name[-2:] in ("_x", "_y") else name
+        if name in categories or base in categories:
+            kind = "category"
+        if kind is not None and str(df[name].dtype) != kind:
+            types[name] = kind
+    for name, kind in types.items():
+        try:
+            df[name] = df[name].astype(kind)
+        except (TypeError, ValueError):
+            pass
+    return df
+
+def parquet_engine():
+    for engine in ("pyarrow", "fastparquet"):
+        try:
+            __import__(engine)
+            return engine
+        except ImportError:
+            continue
+    return None
+
+def write_table(df, csv_path, parquet=False):
+    # CSV is always written, a Parquet copy sits alongside it when enabled and an engine is installed
+    df.to_csv(csv_path, index=False)
+    if not parquet:
+        return None
+    engine = parquet_engine()
+    if engine is None:
+        print(f"Parquet output needs pyarrow or fastparquet, only {os.path.basename(csv_path)} written")
+        return None
+    parquet_path = f"{os.path.splitext(csv_path)[0]}.parquet"
+    df.to_parquet(parquet_path, engine=engine, index=False)
+    return parquet_path
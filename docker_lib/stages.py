@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# Per-sample stage graph with completion manifests, used to resume interrupted runs
+
+import os
+import json
+import hashlib
+import datetime
+import metrics
+
+# Files up to this size are fingerprinted by content rather than mtime
+content_limit = 16 * 1024 * 1024
+
+###_______________________________________________________________________________________
+
+## CLASSES
+
+class Stage(object):
+    def __init__(self, name, func, deps, inputs, params, outputs=None):
+        self.name = name;
+        self.func = func;
+        self.deps = tuple(deps);
+        self.inputs = tuple(inputs);
+        self.params = params or {};
+        self.outputs = outputs or _flatten;
+
+class StageGraph(object):
+    def __init__(self, sample, manifest_dir):
+        self.sample = sample
+        self.dir = os.path.join(manifest_dir, sample)
+        self.stages = {}
+        self.results = {}
+        self._current = {}
+
+    def add(self, name, func, deps=(), inputs=(), params=None, outputs=None):
+        # outputs maps the stage result to its output paths, by default every string in the result
+        for dep in deps:
+            if dep not in self.stages:
+                raise KeyError(f"{name}: unknown dependency {dep}")
+        self.stages[name] = Stage(name, func, deps, inputs, params, outputs)
+
+    def manifest_path(self, name):
+        return os.path.join(self.dir, f"{name}.json")
+
+    def manifest(self, name):
+        try:
+            with open(self.manifest_path(name)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def current(self, name):
+        # A stage is current if its manifest matches its inputs, parameters and upstream manifests
+        if name in self._current:
+            return self._current[name]
+        stage = self.stages[name]
+        manifest = self.manifest(name)
+        current = (
+            manifest is not None
+            and manifest.get("params") == _normalise(stage.params)
+            and manifest.get("inputs") == fingerprint(stage.inputs)
+            and set(manifest.get("deps", {})) == set(stage.deps)
+        )
+        if current:
+            for dep in stage.deps:
+                dep_manifest = self.manifest(dep)
+                if not self.current(dep) or dep_manifest["digest"] != manifest["deps"][dep]:
+                    current = False
+                    break
+        self._current[name] = current
+        return current
+
+    def build(self, name):
+        # Returns the stage result, running upstream stages only when this stage has to run
+        if name in self.results:
+            return self.results[name]
+        stage = self.stages[name]
+
+        if self.current(name):
+            manifest = self.manifest(name)
+            if all(os.path.exists(path) for path in manifest["outputs"]):
+                self.results[name] = manifest["result"]
+                return manifest["result"]
+
+        for dep in stage.deps:
+            if self.build(dep) is None:
+                self.results[name] = None
+                return None
+
+        with metrics.label(sample=self.sample, step=name):
+            result = stage.func()
+        if result is not None:
+            self.record(stage, result)
+        self.results[name] = result
+        return result
+
+    def record(self, stage, result):
+        outputs = [path for path in stage.outputs(result) if os.path.exists(path)]
+        deps = {dep: self.manifest(dep)["digest"] for dep in stage.deps}
+        manifest = {
+            "stage": stage.name,
+            "sample": self.sample,
+            "params": _normalise(stage.params),
+            "inputs": fingerprint(stage.inputs),
+            "deps": deps,
+            "outputs": outputs,
+            "result": result,
+        }
+        # Digest covers the outputs so downstream stages rerun when a stage produced new files
+        manifest["digest"] = hashlib.sha256(
+            json.dumps([manifest, fingerprint(outputs)], sort_keys=True).encode()
+        ).hexdigest()
+        manifest["finished"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        # Writing atomically so a crash never leaves a half written manifest
+        os.makedirs(self.dir, exist_ok=True)
+        path = self.manifest_path(stage.name)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+        self._current[stage.name] = True
+
+###_______________________________________________________________________________________
+
+## FUNCTIONS
+
+def fingerprint(paths):
+    # Small files are fingerprinted by content so regenerated but identical files still match
+    prints = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            prints[path] = None
+            continue
+        if os.path.isfile(path) and stat.st_size <= content_limit:
+            with open(path, 'rb') as file:
+                prints[path] = [stat.st_size, hashlib.sha256(file.read()).hexdigest()]
+        else:
+            prints[path] = [stat.st_size, stat.st_mtime_ns]
+    return prints
+
+def _flatten(result):
+    if isinstance(result, str):
+        return [result]
+    if isinstance(result, dict):
+        result = list(result.values())
+    paths = []
+    if isinstance(result, (list, tuple)):
+        for value in result:
+            paths.extend(_flatten(value))
+    return paths
+
+def _normalise(params):
+    # Round trip through json so tuples and numbers compare like the stored manifest
+    return json.loads(json.dumps(params, sort_keys=True))
@@ -1,104 +1,108 @@
 import os
-import sys
-import pandas as pd
-import hashlib
+import time
+from .hashing import sha256_file
+from . import manifest
+
+class CheckReport(object):
+    def __init__(self, output, strict=False):
+        self.output = output;
+        self.strict = strict;
+        self.missing = [];
+        self.changed = [];
+        self.added = [];
+        self.errors = [];
+        self.hashed = 0;
+        self.total = 0;
+        self.root_match = False;
+        self.timings = {};
+
+    @property
+    def ok(self):
+        return not (self.missing or self.changed or self.added or self.errors)
+
+    def __iter__(self):
+        # Unpacks as (missing_files, changed_files) like the earlier return value
+        return iter((self.missing, self.changed))
 
 def generate_sha256_hash(path):
-    with open(path, 'rb') as file:
-        file_contents = file.read()
-    hash_object = hashlib.sha256(file_contents)
-    hex = hash_object.hexdigest()
-    return hex
+    return sha256_file(path)
 
-def check_task(output):
+def check_task(output, strict=False):
 
     # Initialising
-    error = False
-
-    # Initialising 
-    hash_files = []
-
-    # Find required files
-    log = os.path.join(output, 'phanatic_log.tsv')
-    raw = os.path.join(output, 'raw_data.csv')
-    summary = os.path.join(output, 'combined_summary.csv')
-
-    # Adding config and mapping files if they exist
-    config = os.path.join(output, 'config.ini')
-    mapping = os.path.join(output, 'host_mapping.csv')
+    report = CheckReport(output, strict)
+    start = time.perf_counter()
 
     # Checking required files exist
-    files = [log, raw, summary]
-    for file in files:
-        if os.path.exists(file):
-            hash_files.append(file)
-        else:
-            print(f"ERROR: {os.path.basename(file)} does not exist, cannot perform checks")
-            sys.exit(0)
+    for file in manifest.required_files:
+        if not os.path.exists(os.path.join(output, file)):
+            print(f"ERROR: {file} does not exist, cannot perform checks")
+            report.errors.append(f"{file} does not exist")
+            return report
 
     # Checking optional files exist
-    files = [config, mapping]
-    for file in files:
-        if os.path.exists(file):
-            hash_files.append(file)
-        else:
-            print(f"File: {os.path.basename(file)} does not exist")
-
-    # Adding format_dir phage files
-    format_dir = os.path.join(output, 'phage_genomes')
-    for file in os.listdir(format_dir):
-        path = os.path.join(format_dir, file)
-        hash_files.append(path)
-
-    # Hashing files
-    hash_entries = []
-    for file_path in hash_files:
-        basename = os.path.basename(file_path)
-        hash_key = generate_sha256_hash(file_path)
-        hash_entries.append((basename, hash_key))
-
-    # Creating dataframes
+    for file in manifest.optional_files:
+        if not os.path.exists(os.path.join(output, file)):
+            print(f"File: {file} does not exist")
+
+    # Reading the manifest row by row into a name lookup
     keys = os.path.join(output, '.hash_keys')
-    original = pd.read_csv(keys)
-    df = pd.DataFrame(hash_entries, columns=['file_name', 'hash_key_check'])
+    recorded = manifest.read(keys)
+    report.timings['read'] = time.perf_counter() - start
+
+    # Fast mode only re-hashes files whose size, mtime or inode differ from the manifest
+    step = time.perf_counter()
+    current, rehashed = manifest.build(output, previous=recorded, strict=strict)
+    report.hashed = len(rehashed)
+    report.total = len(current)
+    report.timings['hash'] = time.perf_counter() - step
+    print(f"{'Strict' if strict else 'Fast'} check: {report.hashed} of {report.total} files hashed")
+
+    # Identical root hashes mean every file matches
+    step = time.perf_counter()
+    report.root_match = recorded.root is not None and current.root == recorded.root
+    if report.root_match:
+        report.timings['compare'] = time.perf_counter() - step
+        report.timings['total'] = time.perf_counter() - start
+        print("Root hash matches, no errors detected")
+        return report
+
+    # Version 1 manifests list bare file names
+    if recorded.version == 1:
+        checked = {os.path.basename(name): entry.digest for name, entry in current.entries.items()}
+    else:
+        checked = {name: entry.digest for name, entry in current.entries.items()}
+
+    # Checking files
+    for name, entry in recorded.entries.items():
+        digest = checked.get(name)
+        if digest is None:
+            report.missing.append(name)
+        elif digest != entry.digest:
+            report.changed.append(name)
+    report.added = [name for name in checked if name not in recorded.entries]
+    report.timings['compare'] = time.perf_counter() - step
 
     # Checking size
-    if len(original) == len(df):
+    if len(recorded) == len(checked):
         print("Same number of files hashed")
-    elif len(original) > len(df):
+    elif len(recorded) > len(checked):
         print("Files are missing from phage_genomes directory")
-    elif len(original) < len(df):
+    elif len(recorded) < len(checked):
         print("Files have been added to phage_genomes directory")
 
-    # Checking files
-    missing_files = []
-    changed_files = []
-    for index, row in original.iterrows():
-        name = row['file_name']
-        key = row['hash_key']
-
-        # Missing
-        if name not in df['file_name'].values:
-            missing_files.append(name)
-            continue
-        
-        # Check if the hash key is different
-        check_key = df[df['file_name'] == name]['hash_key_check'].values[0]
-        if key != check_key:
-            changed_files.append(name)
-
     # Report
-    if len(missing_files) > 0:
-        for file in missing_files:
-            print(f"Warning, file is missing: {file}")
-            error = True
-    
-    if len(changed_files) > 0:
-        for file in changed_files:
-            print(f"Warning, file hash has changed: {file}")
-            error = True
-
-    if not error:
+    for file in report.missing:
+        print(f"Warning, file is missing: {file}")
+
+    for file in report.changed:
+        print(f"Warning, file hash has changed: {file}")
+
+    for file in report.added:
+        print(f"Warning, file is not in the manifest: {file}")
+
+    if report.ok:
         print("No errors detected")
 
-    return missing_files, changed_files
+    report.timings['total'] = time.perf_counter() - start
+    return report
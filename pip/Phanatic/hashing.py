@@ -0,0 +1,40 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Files are read through a reusable buffer of this size, so memory does not depend on file size
+chunk_size = 1024 * 1024
+
+# hashlib releases the GIL while hashing, so threads hash files in parallel
+default_workers = min(8, os.cpu_count() or 1)
+
+_local = threading.local()
+
+def _buffer():
+    # One buffer per thread, reused for every file that thread hashes
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        buffer = _local.buffer = bytearray(chunk_size)
+    return buffer
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    buffer = _buffer()
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as file:
+        while True:
+            size = file.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+def hash_files(paths, workers=None):
+    # Returns [(path, hex digest)] in the order of paths
+    paths = list(paths)
+    workers = default_workers if workers is None else workers
+    if workers <= 1 or len(paths) <= 1:
+        return [(path, sha256_file(path)) for path in paths]
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        return list(zip(paths, pool.map(sha256_file, paths)))
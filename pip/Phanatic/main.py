@@ -5,8 +5,9 @@ def main():
     import subprocess
     import argparse
     import random
-    import pandas as pd
     from .check import check_task
+    from .manifest import same_root
+    from .metrics import summary_task
 
     # Did you know prompts
     prompts = [
@@ -43,6 +44,12 @@ def main():
             raise argparse.ArgumentTypeError("no hash file exists")
         return dir_path
 
+    def valid_output(dir_path):
+        if not os.path.isdir(dir_path):
+            raise argparse.ArgumentTypeError(
+                f"{dir_path} is not a valid directory path")
+        return dir_path
+
     def valid_file(file_path):
         if not os.path.isfile(file_path):
             raise argparse.ArgumentTypeError(
@@ -62,8 +69,12 @@ def main():
     parser.add_argument('-r', '--reads', type=str, choices=['PE_illumina', 'ONT'], default='PE_illumina', help='Pipeline options')
     parser.add_argument('-c', '--config', type=valid_file, help='Use config file to customise assembly')
     parser.add_argument('--host_mapping', type=valid_file, help='Use an index file to specify host bacterial genome')
+    parser.add_argument('--cache', type=valid_dir, help='Share a stage output cache directory between runs (requires [cache] enable = True)')
     parser.add_argument('-v', '--version', action="store_true", help='Print the docker image version')
     parser.add_argument('--check', type=check_dir, help='Verify data integrity of a phanatic output directory')
+    parser.add_argument('--strict', action="store_true", help='Re-hash every file during --check instead of only files that changed size, mtime or inode')
+    parser.add_argument('--compare', type=check_dir, nargs=2, metavar='DIR', help='Compare two phanatic output directories by their manifest root hash')
+    parser.add_argument('--metrics', type=valid_output, metavar='DIR', help='Summarise tool run time, cpu, memory and io per stage from a phanatic output directory')
     parser.add_argument('--show_console', action="store_true", help='Include this flag to write output to console')
     parser.add_argument('--manual', action="store_true", help='Enter container interactively')
     args = parser.parse_args()
@@ -74,7 +85,22 @@ def main():
         sys.exit(0)
 
     if args.check:
-        check_task(args.check)
+        check_task(args.check, strict=args.strict)
+        sys.exit(0)
+
+    if args.metrics:
+        summary_task(args.metrics)
+        sys.exit(0)
+
+    if args.compare:
+        first, second = [os.path.join(path, '.hash_keys') for path in args.compare]
+        same = same_root(first, second)
+        if same is None:
+            print("Root hash missing, regenerate the manifest of older output directories")
+        elif same:
+            print("Root hashes match, the directories hold identical files")
+        else:
+            print("Root hashes differ")
         sys.exit(0)
 
     # Obtaining absolute paths if entered correctly
@@ -116,6 +142,12 @@ def main():
     else:
         docker = "docker run -d"
 
+    # Mounting the stage output cache
+    if args.cache:
+        cache_path = os.path.abspath(args.cache)
+        print(f"Using {cache_path} as the stage output cache \n")
+        docker = f"{docker} -v {cache_path}:/assemble/cache"
+
     # Running docker
     if args.manual: 
         os.system(f"docker exec -it \
@@ -0,0 +1,143 @@
+import os
+import csv
+import hashlib
+from .hashing import hash_files
+
+# Manifest format, version 1 is the original file_name,hash_key csv
+version = 2
+magic = "#phanatic_manifest"
+fields = ['file_name', 'hash_key', 'size', 'mtime_ns', 'inode']
+
+# Files covered by the manifest, required files must exist for a check
+required_files = ['phanatic_log.tsv', 'raw_data.csv', 'combined_summary.csv']
+optional_files = ['config.ini', 'host_mapping.csv']
+genome_dir = 'phage_genomes'
+
+class Entry(object):
+    def __init__(self, name, digest, size=None, mtime_ns=None, inode=None):
+        self.name = name;
+        self.digest = digest;
+        self.size = size;
+        self.mtime_ns = mtime_ns;
+        self.inode = inode;
+
+    def matches(self, stat):
+        # Same size, modification time and inode as when the file was hashed
+        if self.size is None:
+            return False
+        return (self.size, self.mtime_ns, self.inode) == (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+class Manifest(object):
+    def __init__(self, entries=(), version=version, root=None):
+        self.version = version
+        self.entries = {entry.name: entry for entry in entries}
+        self._root = root
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __getitem__(self, name):
+        return self.entries[name]
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = merkle_root(self.entries.values())
+        return self._root
+
+def output_files(output):
+    # Names relative to the output directory, in manifest order
+    names = [name for name in required_files + optional_files if os.path.exists(os.path.join(output, name))]
+    format_dir = os.path.join(output, genome_dir)
+    if os.path.isdir(format_dir):
+        names.extend(f"{genome_dir}/{file}" for file in sorted(os.listdir(format_dir)))
+    return names
+
+def merkle_root(entries):
+    # Leaves are name + digest sorted by name, pairs are hashed up to a single root
+    level = [hashlib.sha256(f"{entry.name}\0{entry.digest}".encode()).digest()
+             for entry in sorted(entries, key=lambda entry: entry.name)]
+    if not level:
+        return hashlib.sha256(b"").hexdigest()
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+def build(output, names=None, previous=None, strict=True, workers=None):
+    # Hashes the files, in fast mode unchanged files keep their digest from the previous manifest.
+    # Returns the manifest and the names that were re-hashed
+    names = output_files(output) if names is None else names
+    entries = {}
+    stats = {}
+    rehash = []
+    for name in names:
+        stat = os.stat(os.path.join(output, name))
+        stats[name] = stat
+        old = previous.entries.get(name) if previous is not None else None
+        if not strict and old is not None and old.matches(stat):
+            entries[name] = Entry(name, old.digest, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        else:
+            rehash.append(name)
+
+    paths = [os.path.join(output, name) for name in rehash]
+    for name, (path, digest) in zip(rehash, hash_files(paths, workers)):
+        stat = stats[name]
+        entries[name] = Entry(name, digest, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    return Manifest([entries[name] for name in names]), rehash
+
+def write(manifest, path):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', newline='') as file:
+        file.write(f"{magic}\tversion={version}\troot={manifest.root}\n")
+        writer = csv.writer(file)
+        writer.writerow(fields)
+        for entry in manifest.entries.values():
+            writer.writerow([entry.name, entry.digest, entry.size, entry.mtime_ns, entry.inode])
+    os.replace(tmp, path)
+
+def read_header(path):
+    # (version, root) from the first line, root is None for version 1 manifests
+    with open(path, newline='') as file:
+        line = file.readline().rstrip('\r\n')
+    if not line.startswith(magic):
+        return 1, None
+    values = dict(item.split('=', 1) for item in line.split('\t')[1:] if '=' in item)
+    return int(values.get('version', version)), values.get('root')
+
+def iter_entries(path):
+    # Entries streamed one row at a time, for both manifest versions
+    with open(path, newline='') as file:
+        first = file.readline()
+        if not first.startswith(magic):
+            file.seek(0)
+        reader = csv.DictReader(file)
+        for row in reader:
+            if not row.get('file_name'):
+                continue
+            yield Entry(row['file_name'],
+                        row['hash_key'],
+                        _int(row.get('size')),
+                        _int(row.get('mtime_ns')),
+                        _int(row.get('inode')))
+
+def read(path):
+    manifest_version, root = read_header(path)
+    return Manifest(iter_entries(path), manifest_version, root)
+
+def same_root(first, second):
+    # Whole directory comparison from the manifest headers, None if either has no root
+    root_a = read_header(first)[1]
+    root_b = read_header(second)[1]
+    if root_a is None or root_b is None:
+        return None
+    return root_a == root_b
+
+def _int(value):
+    if value in (None, ''):
+        return None
+    return int(value)
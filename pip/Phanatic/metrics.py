@@ -0,0 +1,104 @@
+import os
+import csv
+import json
+
+# Columns of phanatic_metrics.tsv, one row per external tool process
+fields = [
+    "time", "sample", "step", "stage", "tool", "pid", "exit_code",
+    "wall_s", "user_s", "sys_s", "max_rss_mb",
+    "read_bytes", "write_bytes", "rchar", "wchar", "input_bytes"
+]
+numeric = ["wall_s", "user_s", "sys_s", "max_rss_mb", "read_bytes", "write_bytes", "rchar", "wchar", "input_bytes"]
+
+metrics_file = "phanatic_metrics.tsv"
+percentiles = (50, 90, 99)
+
+def read_metrics(path):
+    # Rows from the TSV or JSONL metrics file, numbers as floats
+    rows = []
+    with open(path, newline='') as file:
+        if path.endswith(".jsonl"):
+            records = (json.loads(line) for line in file if line.strip())
+        else:
+            records = csv.DictReader(file, delimiter='\t')
+        for record in records:
+            row = dict(record)
+            for field in numeric:
+                try:
+                    row[field] = float(row.get(field) or 0)
+                except ValueError:
+                    row[field] = 0.0
+            rows.append(row)
+    return rows
+
+def percentile(values, q):
+    # Linear interpolation between the closest ranks
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+def summarise(rows, by=("stage", "tool")):
+    # {group: {"runs", "failed", "total_wall_s", "slowest", field: {p50, p90, p99, max}}}
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row.get(key) or "" for key in by), []).append(row)
+
+    summary = {}
+    for group, members in groups.items():
+        stats = {
+            "runs": len(members),
+            "failed": sum(1 for row in members if str(row.get("exit_code")) not in ("0", "0.0")),
+            "total_wall_s": sum(row["wall_s"] for row in members),
+            "slowest": max(members, key=lambda row: row["wall_s"]).get("sample") or "",
+        }
+        for field in numeric:
+            values = [row[field] for row in members]
+            stats[field] = {f"p{q}": percentile(values, q) for q in percentiles}
+            stats[field]["max"] = max(values)
+        summary[group] = stats
+    return summary
+
+def _size(value):
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024:
+            return f"{value:.0f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TB"
+
+def summary_task(output):
+    # Prints per stage percentiles of the metrics recorded in an output directory
+    path = os.path.join(output, metrics_file)
+    if not os.path.exists(path):
+        jsonl = f"{os.path.splitext(path)[0]}.jsonl"
+        if not os.path.exists(jsonl):
+            print(f"ERROR: {metrics_file} does not exist in {output}")
+            return None
+        path = jsonl
+    rows = read_metrics(path)
+    summary = summarise(rows)
+
+    total = sum(stats["total_wall_s"] for stats in summary.values()) or 1
+    header = ["stage", "tool", "runs", "failed", "wall_total", "share",
+              "wall_p50", "wall_p90", "wall_max", "cpu_p50", "rss_p50", "rss_max",
+              "read_p50", "write_p50", "input_p50", "slowest"]
+    lines = [header]
+    for (stage, tool), stats in sorted(summary.items(), key=lambda item: -item[1]["total_wall_s"]):
+        cpu = stats["user_s"]["p50"] + stats["sys_s"]["p50"]
+        lines.append([
+            stage, tool, str(stats["runs"]), str(stats["failed"]),
+            f"{stats['total_wall_s']:.1f}s", f"{100 * stats['total_wall_s'] / total:.1f}%",
+            f"{stats['wall_s']['p50']:.1f}s", f"{stats['wall_s']['p90']:.1f}s", f"{stats['wall_s']['max']:.1f}s",
+            f"{cpu:.1f}s",
+            f"{stats['max_rss_mb']['p50']:.0f}MB", f"{stats['max_rss_mb']['max']:.0f}MB",
+            _size(stats["read_bytes"]["p50"]), _size(stats["write_bytes"]["p50"]),
+            _size(stats["input_bytes"]["p50"]), stats["slowest"],
+        ])
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    print(f"{len(rows)} tool runs from {path}")
+    for line in lines:
+        print("  ".join(value.ljust(width) for value, width in zip(line, widths)))
+    return summary
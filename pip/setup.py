@@ -17,7 +17,7 @@ setup(
         "Programming Language :: Python :: 3.9",
         "Programming Language :: Python :: 3.10",
     ],
-    install_requires=["pandas"],
+    install_requires=[],
     python_requires=">=3.6",
     packages=find_packages(),
     data_files=[("", ["LICENSE.md"])],